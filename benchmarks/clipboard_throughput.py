@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Measures clipboard receive throughput in MB/s for payloads of
+# increasing size.
+#
+# The stand-in compositor offers a selection and writes the payload
+# into the pipe from a separate thread, like a real source would from
+# its own process. Every receive mode of DataControlOffer is measured:
+# buffered in memory, spilled to a memfd and streamed via callback.
+# For comparison the old way of concatenating bytes objects is run
+# through the chunk callback.
+#
+# Usage: ./run_example benchmarks/clipboard_throughput.py [max_size_in_MiB]
+
+import sys
+import time
+
+from wl_framework.loop_integrations import PollIntegration
+from wl_framework.network.connection import WaylandConnection
+from wl_framework.protocols.data_control import DataControl
+from benchmarks.stand_in_compositor import StandInCompositor
+
+MIME_TYPE = 'application/octet-stream'
+MiB = 1024 * 1024
+
+class Clipboard(DataControl):
+	def __init__(self, connection):
+		super().__init__(connection)
+		self.offer = None
+
+	def on_new_selection(self, offer):
+		self.offer = offer
+
+class Client(WaylandConnection):
+	def on_initial_sync(self, data):
+		super().on_initial_sync(data)
+		self.clipboard = Clipboard(self)
+		self.synced = True
+
+	def log(self, *msg):
+		pass
+
+def run_until(loop, condition):
+	while not condition():
+		for fd, evt in loop._poll.poll(100):
+			loop.handle_event(fd, evt)
+		loop.check_timers()
+
+def sync(loop, client):
+	client.synced = False
+	client.sync(lambda data: setattr(client, 'synced', True))
+	run_until(loop, lambda: client.synced)
+
+def receive(loop, offer, size, **kwargs):
+	result = list()
+	start = time.perf_counter()
+	offer.receive(MIME_TYPE, lambda mime_type, data: result.append(data), **kwargs)
+	run_until(loop, lambda: result)
+	elapsed = time.perf_counter() - start
+	data = result[0]
+	if isinstance(data, int):
+		received = data
+	elif hasattr(data, 'close'):
+		received = data.seek(0, 2)
+		data.close()
+	else:
+		received = len(data)
+	if received != size:
+		raise RuntimeError(f"Received {received} of {size} bytes")
+	return elapsed
+
+def measure(loop, offer, size):
+	old = [b'']
+	def concat(mime_type, chunk):
+		old[0] += chunk
+	modes = (
+		('bytearray', dict()),
+		('memfd spill', dict(spill_threshold=MiB)),
+		('chunk callback', dict(chunk_callback=lambda mime_type, chunk: None)),
+		('bytes concat (old)', dict(chunk_callback=concat)),
+	)
+	for name, kwargs in modes:
+		old[0] = b''
+		elapsed = receive(loop, offer, size, **kwargs)
+		print(f"{size // MiB:6d} MiB  {name:20s} {size / MiB / elapsed:10.1f} MB/s")
+
+if __name__ == '__main__':
+
+	max_size = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+
+	compositor = StandInCompositor()
+	compositor.set_environment()
+	compositor.start()
+
+	loop = PollIntegration()
+	client = Client(eventloop_integration=loop)
+	client.synced = False
+	run_until(loop, lambda: client.synced)
+	# Wait for the data device to be created
+	sync(loop, client)
+
+	size = 1
+	while size <= max_size:
+		compositor.set_selection({MIME_TYPE: bytes(size * MiB)})
+		client.clipboard.offer = None
+		run_until(loop, lambda: client.clipboard.offer is not None)
+		measure(loop, client.clipboard.offer, size * MiB)
+		size *= 4
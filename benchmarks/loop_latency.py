@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+# Measures event-to-callback latency and timer jitter for every
+# available loop integration, idle and under load.
+#
+# A stand-in compositor running in a separate process injects toplevel
+# title changes carrying a CLOCK_MONOTONIC timestamp taken right before
+# writing to the socket. The client measures the time until the title
+# reaches ForeignTopLevel.on_toplevel_synced(). While doing so a periodic
+# timer measures how far each firing is off from its interval.
+#
+# Usage: ./run_example benchmarks/loop_latency.py [event_count]
+
+import os
+import sys
+import time
+import multiprocessing
+
+from wl_framework.network.connection import (
+	WaylandConnection,
+	WaylandDisconnected
+)
+from wl_framework.protocols.foreign_toplevel import ForeignTopLevel
+from benchmarks.stand_in_compositor import StandInCompositor
+
+EVENT_SPACING = 0.002
+TIMER_INTERVAL = 0.01
+LOAD_INTERVAL = 0.005
+LOAD_DURATION = 0.002
+
+class Finished(Exception):
+	pass
+
+def run_compositor(socket_dir, ready, event_count):
+	compositor = StandInCompositor(socket_dir)
+	ready.set()
+	compositor.start()
+	compositor.manager_bound.wait()
+	toplevel = compositor.new_toplevel('latency', 'start')
+	for _ in range(event_count):
+		time.sleep(EVENT_SPACING)
+		compositor.set_title(toplevel, f"ts:{time.monotonic_ns()}")
+	# Keep the socket open until the client is done
+	time.sleep(3600)
+
+class LatencyToplevels(ForeignTopLevel):
+	def __init__(self, connection, client):
+		super().__init__(connection)
+		self._client = client
+
+	def on_toplevel_synced(self, toplevel):
+		now = time.monotonic_ns()
+		if toplevel.title.startswith('ts:'):
+			self._client.on_latency(now - int(toplevel.title[3:]))
+
+class LatencyClient(WaylandConnection):
+	def __init__(self, loop, event_count, loaded, on_finished):
+		self.latencies = list()
+		self.jitter = list()
+		self._event_count = event_count
+		self._on_finished = on_finished
+		self._last_tick = None
+		super().__init__(eventloop_integration=loop)
+		self.add_timer(TIMER_INTERVAL, self.on_tick)
+		if loaded:
+			self.add_timer(LOAD_INTERVAL, self.on_load)
+
+	def on_initial_sync(self, data):
+		super().on_initial_sync(data)
+		self.toplevels = LatencyToplevels(self, self)
+
+	def on_latency(self, latency_ns):
+		self.latencies.append(latency_ns)
+		if len(self.latencies) == self._event_count:
+			self._on_finished()
+
+	def on_tick(self):
+		now = time.monotonic()
+		if self._last_tick is not None:
+			self.jitter.append(abs(now - self._last_tick - TIMER_INTERVAL))
+		self._last_tick = now
+
+	def on_load(self):
+		# Simulates a client doing some rendering work
+		end = time.monotonic() + LOAD_DURATION
+		while time.monotonic() < end:
+			pass
+
+	def close(self):
+		try:
+			self.shutdown()
+		except WaylandDisconnected:
+			pass
+
+def run_poll(event_count, loaded):
+	from wl_framework.loop_integrations import PollIntegration
+	loop = PollIntegration()
+	def finished():
+		raise Finished()
+	client = LatencyClient(loop, event_count, loaded, finished)
+	try:
+		loop.run()
+	except Finished:
+		pass
+	client.close()
+	return client
+
+def run_epoll(event_count, loaded):
+	from wl_framework.loop_integrations import EpollIntegration
+	loop = EpollIntegration()
+	def finished():
+		raise Finished()
+	client = LatencyClient(loop, event_count, loaded, finished)
+	try:
+		loop.run()
+	except Finished:
+		pass
+	client.close()
+	loop.close()
+	return client
+
+def run_asyncio(event_count, loaded):
+	import asyncio
+	from wl_framework.loop_integrations import AsyncIOIntegration
+	async def main():
+		done = asyncio.get_running_loop().create_future()
+		def finished():
+			if not done.done():
+				done.set_result(None)
+		client = LatencyClient(AsyncIOIntegration(), event_count, loaded, finished)
+		await done
+		client.close()
+		return client
+	return asyncio.run(main())
+
+def run_glib(event_count, loaded):
+	from gi.repository import GLib
+	from wl_framework.loop_integrations import GLibIntegration
+	main_loop = GLib.MainLoop()
+	client = LatencyClient(GLibIntegration(), event_count, loaded, main_loop.quit)
+	main_loop.run()
+	client.close()
+	return client
+
+INTEGRATIONS = (
+	('poll', run_poll),
+	('epoll', run_epoll),
+	('asyncio', run_asyncio),
+	('glib', run_glib),
+)
+
+def percentile(values, p):
+	if not values:
+		return float('nan')
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def measure(runner, event_count, loaded):
+	ctx = multiprocessing.get_context('fork')
+	ready = ctx.Event()
+	socket_dir = os.path.join(
+		os.getenv('TMPDIR', '/tmp'), f"wl_framework-bench-{os.getpid()}"
+	)
+	os.makedirs(socket_dir, exist_ok=True)
+	process = ctx.Process(
+		target=run_compositor, args=(socket_dir, ready, event_count), daemon=True
+	)
+	process.start()
+	ready.wait()
+	os.environ['XDG_RUNTIME_DIR'] = socket_dir
+	os.environ['WAYLAND_DISPLAY'] = 'wayland-stand-in'
+	try:
+		return runner(event_count, loaded)
+	finally:
+		process.kill()
+		process.join()
+		os.unlink(os.path.join(socket_dir, 'wayland-stand-in'))
+		os.rmdir(socket_dir)
+
+if __name__ == '__main__':
+
+	event_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+	header = (
+		f"{'integration':12s} {'condition':9s} " +
+		f"{'p50 (us)':>10s} {'p99 (us)':>10s} {'max (us)':>10s} " +
+		f"{'timer p50 (us)':>15s} {'timer p99 (us)':>15s}"
+	)
+	rows = list()
+	for name, runner in INTEGRATIONS:
+		for loaded in (False, True):
+			condition = 'loaded' if loaded else 'idle'
+			try:
+				client = measure(runner, event_count, loaded)
+			except ImportError as e:
+				rows.append(f"{name:12s} {condition:9s} unavailable: {e}")
+				continue
+			latencies = [x / 1000 for x in client.latencies]
+			jitter = [x * 1000000 for x in client.jitter]
+			rows.append(
+				f"{name:12s} {condition:9s} " +
+				f"{percentile(latencies, 50):10.1f} " +
+				f"{percentile(latencies, 99):10.1f} " +
+				f"{max(latencies):10.1f} " +
+				f"{percentile(jitter, 50):15.1f} " +
+				f"{percentile(jitter, 99):15.1f}"
+			)
+	print()
+	print(header)
+	print('-' * len(header))
+	for row in rows:
+		print(row)
+	print()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Measures the memory used per protocol object with tracemalloc.
+#
+# Objects are created by feeding events directly into the protocol
+# handlers of a client connected to the stand-in compositor, so
+# only allocations of the client side are counted. For toplevels the
+# numbers include everything a toplevel costs after its initial state
+# has been committed: the object itself, its state and its entries in
+# the connection and ForeignTopLevel tables.
+#
+# Usage: ./run_example benchmarks/memory_toplevel.py [object_count]
+
+import gc
+import sys
+import tracemalloc
+
+from wl_framework.loop_integrations import PollIntegration
+from wl_framework.network.connection import WaylandConnection, SERVER_ID_START
+from wl_framework.protocols.base import ArgString, ArgUint32
+from wl_framework.protocols.foreign_toplevel import ForeignTopLevel
+from wl_framework.protocols.data_control import DataControlOffer
+from wl_framework.protocols.cosmic_workspaces import (
+	CosmicWorkspaceHandle,
+	CosmicWorkspaceGroup
+)
+from benchmarks.stand_in_compositor import StandInCompositor, uint_array
+
+class Client(WaylandConnection):
+	def on_initial_sync(self, data):
+		super().on_initial_sync(data)
+		self.toplevels = ForeignTopLevel(self)
+		self.synced = True
+
+class StubManager:
+	# Stands in for the workspace manager, handles only use its version
+	version = 1
+	_stale_groups = None
+	_dirty = list()
+
+def wait_for_sync(loop, client):
+	client.synced = False
+	while not client.synced:
+		for fd, evt in loop._poll.poll(100):
+			loop.handle_event(fd, evt)
+
+def measure(name, count, create):
+	objects = list()
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.take_snapshot()
+	for index in range(count):
+		objects.append(create(index))
+	gc.collect()
+	after = tracemalloc.take_snapshot()
+	tracemalloc.stop()
+	size = sum(x.size_diff for x in after.compare_to(before, 'filename'))
+	print(f"{name:25s} {size / count:10.1f} bytes per object")
+	return objects
+
+def create_toplevel(client, index):
+	obj_id = SERVER_ID_START + index
+	manager = client.toplevels
+	manager.on_new_toplevel(ArgUint32.create(obj_id), None)
+	toplevel = manager.windows[obj_id]
+	toplevel.on_title(ArgString.create(f"Window title {index}"), None)
+	toplevel.on_app_id(ArgString.create('org.example.app'), None)
+	toplevel.on_state(uint_array((2,)), None)
+	toplevel.on_done(b'', None)
+	return toplevel
+
+if __name__ == '__main__':
+
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+	compositor = StandInCompositor()
+	compositor.set_environment()
+	compositor.start()
+
+	loop = PollIntegration()
+	client = Client(eventloop_integration=loop)
+	wait_for_sync(loop, client)
+	# Wait for the manager bind to be processed
+	client.synced = False
+	client.sync(lambda data: setattr(client, 'synced', True))
+	wait_for_sync(loop, client)
+
+	base = SERVER_ID_START + count
+	measure('toplevels (with state)', count,
+		lambda index: create_toplevel(client, index)
+	)
+	group = CosmicWorkspaceGroup(client, base, StubManager)
+	measure('cosmic workspace handles', count,
+		lambda index: CosmicWorkspaceHandle(client, base + 1 + index, group)
+	)
+	measure('data control offers', count,
+		lambda index: DataControlOffer(client, base + 1 + count + index, None)
+	)
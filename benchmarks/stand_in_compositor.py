@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+# Minimal stand-in compositor speaking just enough of the wire protocol
+# to drive wl_framework clients without a real compositor. It answers
+# wl_display.sync, announces a fixed set of globals, sends static
+# wl_output information and allows injecting foreign toplevel events
+# and data control selections.
+# Toplevels are kept across client connections, like a real compositor
+# would keep its windows, and are announced once the manager is bound.
+
+import os
+import array
+import socket
+import struct
+import tempfile
+import threading
+
+from wl_framework.protocols.base import (
+	ArgInt32,
+	ArgUint32,
+	ArgString
+)
+
+SERVER_ID_START = 0xff000000
+
+def message(obj_id, opcode, data=b''):
+	return struct.pack('=II', obj_id, (8 + len(data)) << 16 | opcode) + data
+
+def uint_array(values):
+	data = b''.join(ArgUint32.create(x) for x in values)
+	return ArgUint32.create(len(data)) + data
+
+class StandInCompositor:
+	GLOBALS = (
+		('wl_seat', 7),
+		('wl_shm', 1),
+		('wl_output', 4),
+		('zwlr_foreign_toplevel_manager_v1', 3),
+		('zwlr_data_control_manager_v1', 2),
+	)
+
+	def __init__(self, socket_dir=None, name='wayland-stand-in'):
+		if socket_dir is None:
+			socket_dir = tempfile.mkdtemp(prefix='wl_framework-')
+		self.socket_dir = socket_dir
+		self.name = name
+		self.path = os.path.join(socket_dir, name)
+		self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self._server.bind(self.path)
+		self._server.listen(4)
+		self._lock = threading.Lock()
+		self._client = None
+		self._next_id = SERVER_ID_START
+		self.registry = None
+		self.bound = dict()
+		self.manager_bound = threading.Event()
+		self.toplevels = dict()
+		self.data_device = None
+		# offer id -> {mime_type: payload}
+		self.offers = dict()
+
+	def set_environment(self, env=os.environ):
+		env['XDG_RUNTIME_DIR'] = self.socket_dir
+		env['WAYLAND_DISPLAY'] = self.name
+
+	def start(self):
+		thread = threading.Thread(target=self.serve_forever, daemon=True)
+		thread.start()
+		return thread
+
+	def serve_forever(self):
+		while True:
+			client, _ = self._server.accept()
+			self._client = client
+			self.registry = None
+			self.bound.clear()
+			self.manager_bound.clear()
+			self.data_device = None
+			self.offers.clear()
+			self._serve(client)
+			client.close()
+
+	def disconnect(self):
+		# Simulates a compositor crash
+		if self._client is None:
+			return
+		self.manager_bound.clear()
+		self._client.shutdown(socket.SHUT_RDWR)
+
+	def send(self, data):
+		with self._lock:
+			self._client.sendall(data)
+
+	# Injected events
+	def new_toplevel(self, app_id='app', title='title', states=tuple()):
+		toplevel = self._next_id
+		self._next_id += 1
+		self.toplevels[toplevel] = [app_id, title, tuple(states)]
+		self.send(self._announce_toplevel(toplevel))
+		return toplevel
+
+	def set_title(self, toplevel, title, done=True):
+		self.toplevels[toplevel][1] = title
+		data = message(toplevel, 0, ArgString.create(title))
+		if done:
+			data += message(toplevel, 5)
+		self.send(data)
+
+	def set_app_id(self, toplevel, app_id, done=True):
+		self.toplevels[toplevel][0] = app_id
+		data = message(toplevel, 1, ArgString.create(app_id))
+		if done:
+			data += message(toplevel, 5)
+		self.send(data)
+
+	def set_states(self, toplevel, states, done=True):
+		self.toplevels[toplevel][2] = tuple(states)
+		data = message(toplevel, 4, uint_array(states))
+		if done:
+			data += message(toplevel, 5)
+		self.send(data)
+
+	def close_toplevel(self, toplevel):
+		del self.toplevels[toplevel]
+		self.send(message(toplevel, 6))
+
+	def set_selection(self, payloads, primary=False):
+		# payloads maps mime types to the bytes written to receivers
+		offer = self._next_id
+		self._next_id += 1
+		self.offers[offer] = dict(payloads)
+		data = message(self.data_device, 0, ArgUint32.create(offer))
+		for mime_type in payloads:
+			data += message(offer, 0, ArgString.create(mime_type))
+		data += message(self.data_device, 3 if primary else 1, ArgUint32.create(offer))
+		self.send(data)
+		return offer
+
+	def _announce_toplevel(self, toplevel):
+		# Server allocated ids are only valid for a single client
+		manager = self.bound['zwlr_foreign_toplevel_manager_v1']
+		app_id, title, states = self.toplevels[toplevel]
+		data = message(manager, 0, ArgUint32.create(toplevel))
+		data += message(toplevel, 0, ArgString.create(title))
+		data += message(toplevel, 1, ArgString.create(app_id))
+		if 'wl_output' in self.bound:
+			data += message(toplevel, 2, ArgUint32.create(self.bound['wl_output']))
+		data += message(toplevel, 4, uint_array(states))
+		data += message(toplevel, 5)
+		return data
+
+	# Internal helpers
+	def _serve(self, client):
+		buf = b''
+		while True:
+			try:
+				data, aux_data, _, _ = client.recvmsg(
+					4096, socket.CMSG_SPACE(32 * 4)
+				)
+			except OSError:
+				return
+			if not data:
+				return
+			fds = array.array('i')
+			for _, _, cmsg_data in aux_data:
+				fds.frombytes(cmsg_data)
+			fds = list(fds)
+			buf += data
+			while len(buf) >= 8:
+				obj_id, sizeop = struct.unpack('=II', buf[:8])
+				size = sizeop >> 16
+				if len(buf) < size:
+					break
+				self._handle_request(obj_id, sizeop & 0xffff, buf[8:size], fds)
+				buf = buf[size:]
+			# Everything not taken by a request
+			for fd in fds:
+				os.close(fd)
+
+	def _handle_request(self, obj_id, opcode, data, fds):
+		if obj_id == 1 and opcode == 0:
+			# wl_display.sync
+			_, callback = ArgUint32.parse(data)
+			self.send(
+				message(callback, 0, ArgUint32.create(0)) +
+				message(1, 1, ArgUint32.create(callback))
+			)
+		elif obj_id == 1 and opcode == 1:
+			# wl_display.get_registry
+			_, self.registry = ArgUint32.parse(data)
+			out = b''
+			for global_id, (name, version) in enumerate(self.GLOBALS, start=1):
+				out += message(self.registry, 0,
+					ArgUint32.create(global_id) +
+					ArgString.create(name) +
+					ArgUint32.create(version)
+				)
+			self.send(out)
+		elif obj_id == self.registry and opcode == 0:
+			# wl_registry.bind
+			consumed, name = ArgString.parse(data[4:])
+			offset = 4 + consumed
+			version, new_id = struct.unpack('=II', data[offset:offset + 8])
+			self.bound[name] = new_id
+			if name == 'wl_output':
+				self._send_output(new_id)
+			elif name == 'zwlr_foreign_toplevel_manager_v1':
+				self.send(b''.join(
+					self._announce_toplevel(x) for x in self.toplevels
+				))
+				self.manager_bound.set()
+		elif obj_id == self.bound.get('zwlr_data_control_manager_v1') and opcode == 1:
+			# get_data_device
+			_, self.data_device = ArgUint32.parse(data)
+		elif obj_id in self.offers and opcode == 0:
+			# zwlr_data_control_offer_v1.receive, written from a thread
+			# like a real source would from its own process
+			_, mime_type = ArgString.parse(data)
+			payload = self.offers[obj_id].get(mime_type, b'')
+			threading.Thread(
+				target=self._write_payload, args=(fds.pop(0), payload), daemon=True
+			).start()
+		elif obj_id in self.offers and opcode == 1:
+			del self.offers[obj_id]
+
+	def _write_payload(self, fd, payload):
+		view = memoryview(payload)
+		try:
+			while view:
+				view = view[os.write(fd, view):]
+		except OSError:
+			pass
+		finally:
+			os.close(fd)
+
+	def _send_output(self, obj_id):
+		geometry = ArgInt32.create(0) * 5
+		geometry += ArgString.create('stand-in') + ArgString.create('output')
+		geometry += ArgInt32.create(0)
+		mode = ArgUint32.create(3)
+		mode += ArgInt32.create(1920) + ArgInt32.create(1080) + ArgInt32.create(60000)
+		self.send(
+			message(obj_id, 0, geometry) +
+			message(obj_id, 1, mode) +
+			message(obj_id, 3, ArgInt32.create(1)) +
+			message(obj_id, 4, ArgString.create('HDMI-A-1')) +
+			message(obj_id, 5, ArgString.create('Stand-in output')) +
+			message(obj_id, 2)
+		)
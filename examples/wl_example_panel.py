@@ -10,7 +10,12 @@ from gi.repository import Gtk, Gdk, GtkLayerShell, GObject
 
 from wl_framework.loop_integrations import GLibIntegration
 from wl_framework.network.connection import WaylandConnection
+from wl_framework.protocols.base import UnsupportedProtocolError
 from wl_framework.protocols.foreign_toplevel import ForeignTopLevel
+from wl_framework.protocols.idle_notify import IdleNotifyManager, IdleScheduler
+
+# Seconds without user activity until the clock stops updating
+IDLE_TIMEOUT = 60
 
 # Signal hub + Wayland connection
 class Context(GObject.Object, WaylandConnection):
@@ -19,7 +24,9 @@ class Context(GObject.Object, WaylandConnection):
 		WaylandConnection.__init__(self, eventloop_integration=GLibIntegration())
 		self.add_signal('periodic_update', tuple())
 		self.add_signal('wayland_sync')
-		self.add_timer(2, self.on_periodic_update)
+		# The clock only shows minutes, allow coalescing with other timers
+		# and stop updating it at all while the user is away.
+		self.add_timer(2, self.on_periodic_update, slack=1, idle_suspend=True)
 		self.manager = TaskManager(self)
 
 	def add_signal(self, signal_name, signal_args=None):
@@ -34,6 +41,11 @@ class Context(GObject.Object, WaylandConnection):
 	def on_initial_sync(self, data):
 		super().on_initial_sync(data)
 		self.seat = self.display.seat
+		try:
+			self.idle_manager = IdleNotifyManager(self, IdleScheduler)
+			self.idle_manager.get_idle_notifier(IDLE_TIMEOUT, self.seat)
+		except UnsupportedProtocolError:
+			pass
 		self.emit('wayland_sync', self)
 
 	def on_periodic_update(self):
@@ -44,6 +56,9 @@ class ToplevelManager(ForeignTopLevel):
 	def __init__(self, wl_connection, context):
 		super().__init__(wl_connection)
 		self.context = context
+		# Terminals and progress bars may change their title many
+		# times per second, relabel at most 4 times per second.
+		self.set_rate_limit('title', 0.25)
 
 	def on_toplevel_created(self, toplevel):
 		self.context.emit('toplevel_new', toplevel)
@@ -131,8 +146,11 @@ class PanelWindow(Gtk.Window):
 		self.box.pack_start(button, False, False, 0)
 
 	def on_toplevel_synced(self, context, toplevel):
-		# Obviously this should do a proper diff and only update if required
-		toplevel.button.set_label(toplevel.title)
+		# Only touch the widgets affected by the last commit
+		if 'title' in toplevel.changes:
+			toplevel.button.set_label(toplevel.title)
+		if 'states' not in toplevel.changes:
+			return
 		if 'activated' in toplevel.states:
 			if toplevel.button != self.active_button:
 				if self.active_button:
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   wl_fanout.py daemon     Keeps the state of a single Wayland connection
+#   wl_fanout.py            Prints the state of a running daemon
+#   wl_fanout.py focused    Prints the focused window from the daemon's snapshot
+
+import sys
+
+from wl_framework.loop_integrations import PollIntegration
+from wl_framework.network.connection import WaylandConnection
+from wl_framework.fanout.server import StateServer
+from wl_framework.fanout.client import StateClient
+from wl_framework.fanout.shm import SnapshotReader, get_default_path
+
+
+class Daemon(WaylandConnection):
+
+	def on_initial_sync(self, data):
+		super().on_initial_sync(data)
+		self.server = StateServer(self, snapshot_path=get_default_path())
+		self.log(f"Serving state on {self.server.path}")
+
+
+class Monitor(StateClient):
+
+	def on_synced(self):
+		print(f"{len(self.toplevels)} toplevels on {len(self.outputs)} outputs")
+		for toplevel in self.toplevels.values():
+			print(f"  {toplevel.app_id}: {toplevel.title}")
+
+	def on_toplevel_changed(self, toplevel, changes):
+		print(f"{toplevel.app_id} changed {', '.join(sorted(changes))}: {toplevel.title}")
+
+	def on_toplevel_closed(self, toplevel):
+		print(f"{toplevel.app_id} closed")
+
+	def on_selection(self, mime_types, primary):
+		print(f"New {'primary' if primary else 'main'} selection: {', '.join(mime_types) or '-'}")
+
+	def on_disconnected(self):
+		print("Daemon went away")
+		sys.exit(0)
+
+
+if __name__ == '__main__':
+
+	if sys.argv[1:] == ['focused']:
+		try:
+			window = SnapshotReader().get_focused()
+		except (FileNotFoundError, ValueError) as e:
+			print(e)
+			sys.exit(1)
+		if window is not None:
+			print(f"{window.app_id}: {window.title}")
+		sys.exit(0)
+
+	loop = PollIntegration()
+	try:
+		if sys.argv[1:] == ['daemon']:
+			app = Daemon(eventloop_integration=loop, reconnect_interval=1)
+		else:
+			app = Monitor(loop)
+	except (RuntimeError, OSError) as e:
+		print(e)
+		sys.exit(1)
+	try:
+		loop.run()
+	except KeyboardInterrupt:
+		print()
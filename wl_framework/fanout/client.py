@@ -0,0 +1,310 @@
+import os
+import socket
+import array
+
+from ..protocols.foreign_toplevel import TopLevel
+from ..protocols.cosmic_workspaces import CosmicWorkspaceHandle
+from .server import get_default_path
+from . import wire
+
+class RemoteOutput:
+	__slots__ = ('id', 'name', 'description', 'x', 'y', 'width', 'height', 'scale', 'refresh')
+
+	def __init__(self, output_id):
+		self.id = output_id
+		self.name = None
+		self.description = None
+		self.x = 0
+		self.y = 0
+		self.width = 0
+		self.height = 0
+		self.scale = 1
+		self.refresh = 0
+
+	def __repr__(self):
+		return f'Output-{self.name or self.id}'
+
+class RemoteTopLevel:
+	# Mirrors TopLevel, requests are forwarded to the server.
+	# __dict__ allows users to attach their own attributes.
+	__slots__ = ('_client', 'id', 'title', 'app_id', 'states', 'parent', 'outputs', 'changes', '__dict__')
+
+	def __init__(self, client, toplevel_id):
+		self._client = client
+		self.id = toplevel_id
+		self.title = ''
+		self.app_id = ''
+		self.states = TopLevel.STATE_FLAGS.empty
+		self.parent = None
+		self.outputs = frozenset()
+		self.changes = frozenset()
+
+	# Requests
+	def activate(self):
+		self._client._request_toplevel(self, 'activate')
+
+	def close(self):
+		self._client._request_toplevel(self, 'close')
+
+	def set_minimize(self, enabled=True):
+		self._client._request_toplevel(self, 'minimize' if enabled else 'unminimize')
+
+	def set_maximize(self, enabled=True):
+		self._client._request_toplevel(self, 'maximize' if enabled else 'unmaximize')
+
+	def set_fullscreen(self, enabled=True):
+		self._client._request_toplevel(self, 'fullscreen' if enabled else 'unfullscreen')
+
+	def __repr__(self):
+		return f'TopLevel-{self.id}'
+
+class RemoteWorkspace:
+	__slots__ = ('_client', 'id', 'group', 'name', 'coordinates', 'states', 'changes')
+
+	def __init__(self, client, workspace_id):
+		self._client = client
+		self.id = workspace_id
+		self.group = None
+		self.name = None
+		self.coordinates = tuple()
+		self.states = CosmicWorkspaceHandle.STATE_FLAGS.empty
+		self.changes = frozenset()
+
+	def activate(self):
+		self._client._send(wire.Writer(wire.WORKSPACE_ACTIVATE).u32(self.id).finish())
+
+	def __repr__(self):
+		return f'Workspace-{self.name or self.id}'
+
+class StateClient:
+	"""
+		Client for StateServer, provides the state of the server's Wayland
+		connection without connecting to the compositor:
+
+			client = StateClient(PollIntegration())
+			for toplevel in client.toplevels.values():
+				...
+
+		With a loop integration the socket is read whenever it becomes
+		readable, otherwise dispatch() has to be called. Subclasses can
+		override the custom events below. Ids are assigned by the server
+		and stay valid while the server reconnects to the compositor.
+	"""
+	def __init__(self, eventloop_integration=None, path=None):
+		self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC)
+		self._socket.connect(path or get_default_path())
+		self._inbuf = bytearray()
+		self.loop = eventloop_integration
+		self.synced = False
+		self.outputs = dict()
+		self.toplevels = dict()
+		self.groups = dict()
+		self.workspaces = dict()
+		# [main, primary] mime types of the current selections
+		self.selections = [tuple(), tuple()]
+		self._handlers = {
+			wire.SNAPSHOT_BEGIN: self._on_snapshot_begin,
+			wire.SNAPSHOT_END: self._on_snapshot_end,
+			wire.OUTPUT: self._on_output,
+			wire.OUTPUT_REMOVED: self._on_output_removed,
+			wire.TOPLEVEL: self._on_toplevel,
+			wire.TOPLEVEL_CLOSED: self._on_toplevel_closed,
+			wire.WORKSPACE_GROUP: self._on_group,
+			wire.WORKSPACE: self._on_workspace,
+			wire.WORKSPACE_REMOVED: self._on_workspace_removed,
+			wire.SELECTION: self._on_selection,
+		}
+		if self.loop is not None:
+			self._socket.setblocking(False)
+			self.loop.create_reader(self._socket.fileno(), self._on_readable)
+
+	def fileno(self):
+		return self._socket.fileno()
+
+	def close(self):
+		if self.loop is not None:
+			self.loop.remove_reader(self._socket.fileno())
+		self._socket.close()
+
+	def dispatch(self):
+		# Blocks until data arrives if the socket is blocking. Returns
+		# False once the server went away.
+		try:
+			data = self._socket.recv(65536)
+		except BlockingIOError:
+			return True
+		if not data:
+			self.on_disconnected()
+			return False
+		self._inbuf += data
+		for opcode, payload in wire.split_messages(self._inbuf):
+			handler = self._handlers.get(opcode)
+			if handler is None:
+				raise wire.WireError(f"Unknown opcode {opcode}")
+			handler(wire.Reader(payload))
+		return True
+
+	# Requests
+	def receive(self, mime_type, primary=False):
+		# Returns the read end of a pipe the selection gets written to.
+		# The caller is responsible for closing it.
+		pipe_read, pipe_write = os.pipe()
+		try:
+			self._send(
+				wire.Writer(wire.RECEIVE).u32(int(primary)).str(mime_type).finish(),
+				(pipe_write,)
+			)
+		finally:
+			os.close(pipe_write)
+		return pipe_read
+
+	# Custom events
+	def on_synced(self):
+		# The initial snapshot is complete
+		pass
+
+	def on_output_changed(self, output):
+		pass
+
+	def on_output_removed(self, output):
+		pass
+
+	def on_toplevel_created(self, toplevel):
+		pass
+
+	def on_toplevel_changed(self, toplevel, changes):
+		pass
+
+	def on_toplevel_closed(self, toplevel):
+		pass
+
+	def on_workspace_changed(self, workspace, changes):
+		pass
+
+	def on_workspace_removed(self, workspace):
+		pass
+
+	def on_selection(self, mime_types, primary):
+		pass
+
+	def on_disconnected(self):
+		pass
+
+	# Internal helpers
+	def _on_readable(self, fd):
+		if not self.dispatch():
+			self.close()
+
+	def _send(self, message, fds=None):
+		if fds:
+			ancdata = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))]
+		else:
+			ancdata = []
+		# Requests are tiny, don't bother with partial sends
+		blocking = self._socket.getblocking()
+		self._socket.setblocking(True)
+		try:
+			self._socket.sendmsg([message], ancdata)
+		finally:
+			self._socket.setblocking(blocking)
+
+	def _request_toplevel(self, toplevel, action):
+		self._send(
+			wire.Writer(wire.TOPLEVEL_REQUEST).u32(toplevel.id)
+				.u32(wire.ACTIONS.index(action)).finish()
+		)
+
+	def _get_output(self, output_id):
+		output = self.outputs.get(output_id)
+		if output is None:
+			# Referenced before its state is complete
+			output = RemoteOutput(output_id)
+			self.outputs[output_id] = output
+		return output
+
+	# Message handlers
+	def _on_snapshot_begin(self, reader):
+		self.synced = False
+		self.outputs.clear()
+		self.toplevels.clear()
+		self.groups.clear()
+		self.workspaces.clear()
+		self.selections = [tuple(), tuple()]
+
+	def _on_snapshot_end(self, reader):
+		self.synced = True
+		self.on_synced()
+
+	def _on_output(self, reader):
+		output = self._get_output(reader.u32())
+		output.name = reader.str()
+		output.description = reader.str()
+		output.x = reader.i32()
+		output.y = reader.i32()
+		output.width = reader.i32()
+		output.height = reader.i32()
+		output.scale = reader.i32()
+		output.refresh = reader.i32()
+		if self.synced:
+			self.on_output_changed(output)
+
+	def _on_output_removed(self, reader):
+		output = self.outputs.pop(reader.u32(), None)
+		if output is not None and self.synced:
+			self.on_output_removed(output)
+
+	def _on_toplevel(self, reader):
+		toplevel_id = reader.u32()
+		toplevel = self.toplevels.get(toplevel_id)
+		created = toplevel is None
+		if created:
+			toplevel = RemoteTopLevel(self, toplevel_id)
+			self.toplevels[toplevel_id] = toplevel
+		changes = wire.decode_mask(reader.u32(), wire.TOPLEVEL_FIELDS)
+		toplevel.app_id = reader.str()
+		toplevel.title = reader.str()
+		toplevel.states = TopLevel.STATE_FLAGS.get(reader.u32())
+		parent = reader.u32()
+		toplevel.parent = self.toplevels.get(parent) if parent else None
+		toplevel.outputs = frozenset(self._get_output(x) for x in reader.u32_array())
+		toplevel.changes = changes
+		if not self.synced:
+			return
+		if created:
+			self.on_toplevel_created(toplevel)
+		self.on_toplevel_changed(toplevel, changes)
+
+	def _on_toplevel_closed(self, reader):
+		toplevel = self.toplevels.pop(reader.u32(), None)
+		if toplevel is not None and self.synced:
+			self.on_toplevel_closed(toplevel)
+
+	def _on_group(self, reader):
+		group_id = reader.u32()
+		self.groups[group_id] = frozenset(self._get_output(x) for x in reader.u32_array())
+
+	def _on_workspace(self, reader):
+		workspace_id = reader.u32()
+		workspace = self.workspaces.get(workspace_id)
+		if workspace is None:
+			workspace = RemoteWorkspace(self, workspace_id)
+			self.workspaces[workspace_id] = workspace
+		workspace.group = reader.u32()
+		workspace.changes = wire.decode_mask(reader.u32(), wire.WORKSPACE_FIELDS)
+		workspace.name = reader.str()
+		workspace.coordinates = reader.u32_array()
+		workspace.states = CosmicWorkspaceHandle.STATE_FLAGS.get(reader.u32())
+		if self.synced:
+			self.on_workspace_changed(workspace, workspace.changes)
+
+	def _on_workspace_removed(self, reader):
+		workspace = self.workspaces.pop(reader.u32(), None)
+		if workspace is not None and self.synced:
+			self.on_workspace_removed(workspace)
+
+	def _on_selection(self, reader):
+		primary = bool(reader.u32())
+		mime_types = reader.str_array()
+		self.selections[primary] = mime_types
+		if self.synced:
+			self.on_selection(mime_types, primary)
@@ -0,0 +1,402 @@
+import os
+import array
+import socket
+import struct
+
+from ..protocols.base import UnsupportedProtocolError
+from ..protocols.foreign_toplevel import ForeignTopLevel
+from ..protocols.cosmic_workspaces import CosmicWorkspaceManager
+from ..protocols.data_control import DataControl
+from .shm import SnapshotPublisher
+from . import wire
+
+def get_default_path():
+	return os.path.join(os.getenv('XDG_RUNTIME_DIR', '/tmp'), 'wl_framework-state')
+
+class _Client:
+	__slots__ = ('sock', 'fd', 'inbuf', 'fds', 'outbuf', 'watched')
+
+	def __init__(self, sock):
+		self.sock = sock
+		self.fd = sock.fileno()
+		self.inbuf = bytearray()
+		# Received fds not yet taken by a request, a message might
+		# arrive in parts after its fds.
+		self.fds = list()
+		self.outbuf = bytearray()
+		self.watched = False
+
+class _Workspaces(CosmicWorkspaceManager):
+	def __init__(self, connection, server):
+		self._server = server
+		super().__init__(connection)
+
+	def on_group(self, group):
+		self._server._on_group(group)
+
+	def on_group_changed(self, group, changes):
+		self._server._on_group(group)
+
+	def on_workspace(self, workspace):
+		self._server._on_workspace(workspace, frozenset(wire.WORKSPACE_FIELDS))
+
+	def on_workspace_changed(self, workspace, changes):
+		self._server._on_workspace(workspace, changes)
+
+	def on_workspace_removed(self, workspace):
+		self._server._on_workspace_removed(workspace)
+
+	def on_sync(self):
+		self._server._on_workspace_sync()
+
+class _Clipboard(DataControl):
+	def __init__(self, connection, server):
+		self._server = server
+		super().__init__(connection)
+
+	def on_new_selection(self, offer):
+		self._server._on_selection(offer, primary=False)
+
+	def on_new_primary_selection(self, offer):
+		self._server._on_selection(offer, primary=True)
+
+class StateServer:
+	"""
+		Shares the state of a single Wayland connection with any number
+		of local clients, see StateClient:
+
+			class Daemon(WaylandConnection):
+				def on_initial_sync(self, data):
+					super().on_initial_sync(data)
+					self.server = StateServer(self)
+
+		Binds foreign toplevels plus cosmic workspaces and data control if
+		supported. New clients get a snapshot of the current state, then
+		deltas as they are committed by the compositor. Every delta is
+		encoded once for all clients. Clients which don't read their
+		messages are disconnected once max_backlog bytes are queued.
+		Loop integrations without add_writer() block for up to
+		flush_timeout seconds on a full client socket instead.
+
+		With snapshot_path the focused toplevel, the toplevel list and
+		the active workspace are also published for SnapshotReader.
+	"""
+	def __init__(self, connection, path=None, max_backlog=4 * 1024 * 1024,
+		snapshot_path=None, flush_timeout=1.0):
+		self._connection = connection
+		self.path = path or get_default_path()
+		self.max_backlog = max_backlog
+		self.flush_timeout = flush_timeout
+		self._clients = dict()
+		# Protocol object -> id on the wire, stable across reconnects
+		self._ids = dict()
+		self._objects = dict()
+		self._next_id = 1
+		self._selections = [None, None]
+		self._workspace_changes = list()
+
+		self.toplevels = ForeignTopLevel(connection)
+		self.toplevels.add_tracker(self)
+		self.snapshot = None
+		if snapshot_path is not None:
+			self.snapshot = self.toplevels.add_tracker(SnapshotPublisher(snapshot_path))
+		connection.display.add_output_listener(self)
+		try:
+			self.workspaces = _Workspaces(connection, self)
+		except UnsupportedProtocolError:
+			self.workspaces = None
+		try:
+			self.clipboard = _Clipboard(connection, self)
+		except UnsupportedProtocolError:
+			self.clipboard = None
+
+		self._remove_stale_socket()
+		self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC)
+		self._socket.bind(self.path)
+		self._socket.listen(16)
+		self._socket.setblocking(False)
+		connection.add_reader(self._socket.fileno(), self._on_accept)
+
+	def close(self):
+		for client in tuple(self._clients.values()):
+			self._drop_client(client)
+		self._connection.remove_reader(self._socket.fileno())
+		self._socket.close()
+		if self.snapshot is not None:
+			self.snapshot.close()
+		try:
+			os.unlink(self.path)
+		except FileNotFoundError:
+			pass
+
+	def _remove_stale_socket(self):
+		# Only unlink the path if nobody is listening on it anymore
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM | socket.SOCK_CLOEXEC)
+		try:
+			probe.connect(self.path)
+		except FileNotFoundError:
+			return
+		except ConnectionRefusedError:
+			os.unlink(self.path)
+			return
+		finally:
+			probe.close()
+		raise RuntimeError(f"A StateServer is already running on {self.path}")
+
+	# Output listener hooks
+	def on_output_added(self, output):
+		self._broadcast(self._encode_output(output))
+
+	def on_output_changed(self, output, changes):
+		self._broadcast(self._encode_output(output))
+
+	def on_output_removed(self, output):
+		self._broadcast(wire.Writer(wire.OUTPUT_REMOVED).u32(self._forget(output)).finish())
+
+	# Toplevel tracker hooks
+	def on_toplevel_created(self, toplevel):
+		# Usually reported with its first commit, except for toplevels
+		# which showed up while resyncing after a reconnect.
+		self._get_id(toplevel)
+		if not toplevel._initial:
+			self._broadcast(self._encode_toplevel(toplevel, wire.TOPLEVEL_FIELDS))
+
+	def on_toplevel_changed(self, toplevel, changes):
+		self._broadcast(self._encode_toplevel(toplevel, changes))
+
+	def on_toplevel_closed(self, toplevel):
+		self._broadcast(wire.Writer(wire.TOPLEVEL_CLOSED).u32(self._forget(toplevel)).finish())
+
+	# Workspace and clipboard hooks
+	def _on_group(self, group):
+		self._broadcast(self._encode_group(group))
+
+	def _on_workspace(self, workspace, changes):
+		self._broadcast(self._encode_workspace(workspace, changes))
+		if self.snapshot is not None:
+			self._workspace_changes.append((workspace, changes))
+
+	def _on_workspace_removed(self, workspace):
+		self._broadcast(wire.Writer(wire.WORKSPACE_REMOVED).u32(self._forget(workspace)).finish())
+		if self.snapshot is not None:
+			self.snapshot.on_workspace_removed(workspace)
+
+	def _on_workspace_sync(self):
+		# Activation moves the active state from one workspace to another
+		# within one done event, deactivations are applied first so the
+		# newly active workspace wins.
+		changes = self._workspace_changes
+		self._workspace_changes = list()
+		changes.sort(key=lambda x: 'active' in x[0].states)
+		for workspace, workspace_changes in changes:
+			self.snapshot.on_workspace_changed(workspace, workspace_changes)
+
+	def _on_selection(self, offer, primary):
+		self._selections[primary] = offer
+		self._broadcast(self._encode_selection(offer, primary))
+
+	# Encoding
+	def _get_id(self, obj):
+		obj_id = self._ids.get(obj)
+		if obj_id is None:
+			obj_id = self._next_id
+			self._next_id += 1
+			self._ids[obj] = obj_id
+			self._objects[obj_id] = obj
+		return obj_id
+
+	def _forget(self, obj):
+		obj_id = self._ids.pop(obj, 0)
+		self._objects.pop(obj_id, None)
+		return obj_id
+
+	def _encode_output(self, output):
+		return wire.Writer(wire.OUTPUT).u32(self._get_id(output)).str(output.name) \
+			.str(output.description).i32(output.x).i32(output.y) \
+			.i32(output.width).i32(output.height).i32(output.scale) \
+			.i32(output.refresh).finish()
+
+	def _encode_toplevel(self, toplevel, changes):
+		parent = self.toplevels.windows.get(toplevel.parent) if toplevel.parent else None
+		return wire.Writer(wire.TOPLEVEL).u32(self._get_id(toplevel)) \
+			.u32(wire.encode_mask(changes, wire.TOPLEVEL_FIELDS)) \
+			.str(toplevel.app_id).str(toplevel.title).u32(toplevel.states.mask) \
+			.u32(0 if parent is None else self._get_id(parent)) \
+			.u32_array(self._get_id(x) for x in toplevel.outputs).finish()
+
+	def _encode_group(self, group):
+		return wire.Writer(wire.WORKSPACE_GROUP).u32(self._get_id(group)) \
+			.u32_array(self._get_id(x) for x in group.outputs).finish()
+
+	def _encode_workspace(self, workspace, changes):
+		return wire.Writer(wire.WORKSPACE).u32(self._get_id(workspace)) \
+			.u32(self._get_id(workspace._parent)) \
+			.u32(wire.encode_mask(changes, wire.WORKSPACE_FIELDS)) \
+			.str(workspace.name).u32_array(workspace.coordinates) \
+			.u32(workspace.states.mask).finish()
+
+	def _encode_selection(self, offer, primary):
+		mime_types = tuple() if offer is None else offer.get_mime_types()
+		return wire.Writer(wire.SELECTION).u32(int(primary)).str_array(mime_types).finish()
+
+	def _encode_snapshot(self):
+		messages = [wire.Writer(wire.SNAPSHOT_BEGIN).finish()]
+		for output in self._connection.display.outputs:
+			if output._synced:
+				messages.append(self._encode_output(output))
+		if self.workspaces is not None:
+			for group in self.workspaces.groups:
+				messages.append(self._encode_group(group))
+				for workspace in group.workspaces:
+					messages.append(self._encode_workspace(workspace, wire.WORKSPACE_FIELDS))
+		for toplevel in self.toplevels.windows.values():
+			if not toplevel._initial:
+				messages.append(self._encode_toplevel(toplevel, wire.TOPLEVEL_FIELDS))
+		for primary, offer in enumerate(self._selections):
+			if offer is not None:
+				messages.append(self._encode_selection(offer, primary))
+		messages.append(wire.Writer(wire.SNAPSHOT_END).finish())
+		return b''.join(messages)
+
+	# Requests
+	def _handle_request(self, client, opcode, data, fds):
+		reader = wire.Reader(data)
+		if opcode == wire.TOPLEVEL_REQUEST:
+			toplevel = self._objects.get(reader.u32())
+			action = reader.u32()
+			if toplevel is None or action >= len(wire.ACTIONS):
+				return
+			action = wire.ACTIONS[action]
+			if action == 'activate':
+				toplevel.activate(self._connection.display.seat)
+			elif action == 'close':
+				toplevel.close()
+			else:
+				enabled = not action.startswith('un')
+				name = action if enabled else action[2:]
+				getattr(toplevel, f'set_{name}')(enabled)
+		elif opcode == wire.WORKSPACE_ACTIVATE:
+			workspace = self._objects.get(reader.u32())
+			if workspace is not None and self.workspaces is not None:
+				workspace.activate()
+				self.workspaces.commit()
+		elif opcode == wire.RECEIVE:
+			primary = reader.u32()
+			mime_type = reader.str()
+			if not fds:
+				raise wire.WireError("RECEIVE without fd")
+			fd = fds.pop(0)
+			offer = self._selections[bool(primary)]
+			if offer is None or mime_type not in offer.get_mime_types():
+				# The client sees EOF on its end
+				os.close(fd)
+				return
+			offer.receive_fd(mime_type, fd)
+		else:
+			raise wire.WireError(f"Unknown opcode {opcode}")
+
+	# Client handling
+	def _on_accept(self):
+		while True:
+			try:
+				sock, _ = self._socket.accept()
+			except BlockingIOError:
+				return
+			sock.setblocking(False)
+			client = _Client(sock)
+			self._clients[client.fd] = client
+			self._connection.add_reader(client.fd, self._on_readable, client)
+			self._send(client, self._encode_snapshot())
+
+	def _on_readable(self, client):
+		try:
+			data, ancdata, _, _ = client.sock.recvmsg(
+				65536, socket.CMSG_SPACE(16 * struct.calcsize('i'))
+			)
+		except BlockingIOError:
+			return
+		except OSError:
+			data, ancdata = b'', ()
+		for level, kind, cmsg_data in ancdata:
+			if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+				received = array.array('i')
+				received.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % received.itemsize])
+				client.fds.extend(received)
+		if not data:
+			self._drop_client(client)
+			return
+		client.inbuf += data
+		try:
+			for opcode, payload in wire.split_messages(client.inbuf):
+				self._handle_request(client, opcode, payload, client.fds)
+		except (wire.WireError, struct.error, UnicodeDecodeError) as e:
+			self._log(f"Dropping client {client.fd}: {e}")
+			self._drop_client(client)
+
+	def _broadcast(self, message):
+		for client in tuple(self._clients.values()):
+			self._send(client, message)
+
+	def _send(self, client, message):
+		if client.outbuf:
+			client.outbuf += message
+			if len(client.outbuf) > self.max_backlog:
+				self._log(f"Dropping client {client.fd}: not reading its messages")
+				self._drop_client(client)
+			return
+		try:
+			sent = client.sock.send(message)
+		except BlockingIOError:
+			sent = 0
+		except OSError:
+			self._drop_client(client)
+			return
+		if sent == len(message):
+			return
+		client.outbuf += message[sent:]
+		try:
+			self._connection.add_writer(client.fd, self._on_writable, client)
+			client.watched = True
+		except NotImplementedError:
+			# Loop integration doesn't support writers, block instead
+			self._flush_blocking(client)
+
+	def _flush_blocking(self, client):
+		# Bounded, a client which doesn't read must not stall everyone else
+		client.sock.settimeout(self.flush_timeout)
+		try:
+			client.sock.sendall(client.outbuf)
+		except OSError as e:
+			self._log(f"Dropping client {client.fd}: {e}")
+			self._drop_client(client)
+			return
+		client.sock.setblocking(False)
+		client.outbuf.clear()
+
+	def _on_writable(self, client):
+		try:
+			sent = client.sock.send(client.outbuf)
+		except BlockingIOError:
+			return
+		except OSError:
+			self._drop_client(client)
+			return
+		del client.outbuf[:sent]
+		if not client.outbuf:
+			client.watched = False
+			self._connection.remove_writer(client.fd)
+
+	def _drop_client(self, client):
+		for fd in client.fds:
+			os.close(fd)
+		client.fds.clear()
+		if self._clients.pop(client.fd, None) is None:
+			return
+		self._connection.remove_reader(client.fd)
+		if client.watched:
+			self._connection.remove_writer(client.fd)
+		client.sock.close()
+
+	def _log(self, *msg):
+		name = f"[{self.__class__.__name__}]"
+		print(f" {name:^25s} ", *msg)
@@ -0,0 +1,300 @@
+import os
+import time
+import mmap
+import struct
+from collections import namedtuple
+
+from ..protocols.foreign_toplevel import TopLevel
+
+# File layout, native byte order as the file is local only:
+#   header   magic, version, flags, seq, capacity, used slots, focused slot,
+#            active workspace name
+#   slots    capacity times id, states mask, app_id, title
+#
+# seq is odd while the publisher is writing. Readers copy the data and
+# retry if seq was odd or changed in the meantime, the publisher never
+# waits for readers. Strings are utf-8, cut to their field size and
+# padded with NUL bytes.
+MAGIC = b'WLSS'
+VERSION = 1
+HEADER = struct.Struct('=4sHHIIIi64s')
+SLOT = struct.Struct('=II64s192s')
+_SEQ = struct.Struct('=I')
+_SEQ_OFFSET = 8
+
+# Header flags
+FLAG_CLOSED = 1
+# More toplevels exist than there are slots
+FLAG_TRUNCATED = 2
+
+Window = namedtuple('Window', ('id', 'app_id', 'title', 'states'))
+Snapshot = namedtuple('Snapshot', ('seq', 'windows', 'focused', 'workspace', 'truncated'))
+
+def get_default_path():
+	return os.path.join(os.getenv('XDG_RUNTIME_DIR', '/tmp'), 'wl_framework-snapshot')
+
+def _encode(value, size):
+	data = (value or '').encode('utf-8')
+	if len(data) > size:
+		# Don't leave half a code point behind
+		data = data[:size].decode('utf-8', 'ignore').encode('utf-8')
+	return data
+
+class SnapshotPublisher:
+	"""
+		Publishes the toplevel list, the focused toplevel and the active
+		workspace to a fixed layout file in $XDG_RUNTIME_DIR, guarded by
+		a sequence counter. Readers map the file and get a consistent
+		snapshot without any syscall, see SnapshotReader:
+
+			publisher = toplevels.add_tracker(SnapshotPublisher())
+
+		Every toplevel owns a slot, a change rewrites that slot and the
+		header only. Toplevels beyond capacity are not published and the
+		snapshot is flagged as truncated. The active workspace has to be
+		reported via on_workspace_changed(), StateServer does so when
+		given a snapshot_path.
+	"""
+	def __init__(self, path=None, capacity=256):
+		self.path = path or get_default_path()
+		self.capacity = capacity
+		self._size = HEADER.size + capacity * SLOT.size
+		self._slots = dict()
+		self._free = list(range(capacity - 1, -1, -1))
+		self._overflow = set()
+		self._next_id = 1
+		self._ids = dict()
+		self._focused = None
+		self._workspace = None
+		self._seq = 0
+
+		# Replace the file atomically so readers never map a short file
+		tmp_path = f'{self.path}.{os.getpid()}'
+		fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+		try:
+			os.ftruncate(fd, self._size)
+			self._mmap = mmap.mmap(fd, self._size)
+		finally:
+			os.close(fd)
+		self._write_header(0)
+		os.rename(tmp_path, self.path)
+
+	def close(self):
+		if self._mmap is None:
+			return
+		self._begin()
+		self._write_header(FLAG_CLOSED)
+		self._end()
+		self._mmap.close()
+		self._mmap = None
+		try:
+			os.unlink(self.path)
+		except FileNotFoundError:
+			pass
+
+	# Tracker hooks
+	def on_toplevel_created(self, toplevel):
+		self._ids[toplevel] = self._next_id
+		self._next_id += 1
+		if self._free:
+			self._slots[toplevel] = self._free.pop()
+		else:
+			self._overflow.add(toplevel)
+		if not toplevel._initial:
+			# Showed up while resyncing, there is no first commit
+			self.on_toplevel_changed(toplevel, frozenset())
+
+	def on_toplevel_changed(self, toplevel, changes):
+		slot = self._slots.get(toplevel)
+		if 'activated' in toplevel.states:
+			self._focused = toplevel
+		elif toplevel is self._focused:
+			self._focused = None
+		self._begin()
+		if slot is not None:
+			self._write_slot(slot, toplevel)
+		self._write_header()
+		self._end()
+
+	def on_toplevel_closed(self, toplevel):
+		self._ids.pop(toplevel, None)
+		self._overflow.discard(toplevel)
+		if toplevel is self._focused:
+			self._focused = None
+		slot = self._slots.pop(toplevel, None)
+		self._begin()
+		if slot is not None:
+			SLOT.pack_into(self._mmap, HEADER.size + slot * SLOT.size, 0, 0, b'', b'')
+			self._free.append(slot)
+			if self._overflow:
+				# Promote a toplevel which didn't fit so far
+				toplevel = self._overflow.pop()
+				self._slots[toplevel] = self._free.pop()
+				self._write_slot(self._slots[toplevel], toplevel)
+		self._write_header()
+		self._end()
+
+	# Workspace hooks, compatible with CosmicWorkspaceManager's events
+	def on_workspace_changed(self, workspace, changes):
+		if 'active' in workspace.states:
+			if workspace is self._workspace and 'name' not in changes:
+				return
+			self._workspace = workspace
+		elif workspace is self._workspace:
+			self._workspace = None
+		else:
+			return
+		self._begin()
+		self._write_header()
+		self._end()
+
+	def on_workspace_removed(self, workspace):
+		if workspace is self._workspace:
+			self._workspace = None
+			self._begin()
+			self._write_header()
+			self._end()
+
+	# Internal helpers
+	def _begin(self):
+		self._seq = (self._seq + 1) & 0xffffffff
+		_SEQ.pack_into(self._mmap, _SEQ_OFFSET, self._seq)
+
+	def _end(self):
+		self._seq = (self._seq + 1) & 0xffffffff
+		_SEQ.pack_into(self._mmap, _SEQ_OFFSET, self._seq)
+
+	def _write_header(self, flags=0):
+		if self._overflow:
+			flags |= FLAG_TRUNCATED
+		used = max(self._slots.values(), default=-1) + 1
+		focused = self._slots.get(self._focused, -1)
+		workspace = self._workspace.name if self._workspace is not None else None
+		HEADER.pack_into(
+			self._mmap, 0, MAGIC, VERSION, flags, self._seq, self.capacity,
+			used, focused, _encode(workspace, 64)
+		)
+
+	def _write_slot(self, slot, toplevel):
+		SLOT.pack_into(
+			self._mmap, HEADER.size + slot * SLOT.size, self._ids[toplevel],
+			toplevel.states.mask, _encode(toplevel.app_id, 64), _encode(toplevel.title, 192)
+		)
+
+class SnapshotReader:
+	"""
+		Reads the snapshot of a SnapshotPublisher, e.g. from a status bar
+		script polling the focused window:
+
+			reader = SnapshotReader()
+			window = reader.get_focused()
+			if window is not None:
+				print(window.app_id, window.title)
+
+		read() only touches the shared mapping. As long as seq didn't
+		change the previous Snapshot is returned without decoding it
+		again. If the publisher closed the file it is mapped again on
+		the next read(), raising FileNotFoundError if there is none.
+		A publisher which crashed doesn't close the file, so at most
+		every recheck seconds read() also checks whether path still
+		refers to the mapped file, i.e. a restarted publisher replaced
+		it.
+	"""
+	def __init__(self, path=None, retries=1000, recheck=1.0):
+		self.path = path or get_default_path()
+		self.retries = retries
+		self.recheck = recheck
+		self._mmap = None
+		self._snapshot = None
+		self._file_id = None
+		self._checked = 0
+		self._open()
+
+	def close(self):
+		if self._mmap is not None:
+			self._mmap.close()
+			self._mmap = None
+
+	def read(self):
+		if self._mmap is None:
+			self._open()
+		elif time.monotonic() - self._checked >= self.recheck:
+			self._check_replaced()
+		snapshot = self._read()
+		if snapshot is None:
+			# The publisher closed the file
+			self.close()
+			self._open()
+			snapshot = self._read()
+		return snapshot
+
+	def get_focused(self):
+		return self.read().focused
+
+	def get_windows(self):
+		return self.read().windows
+
+	def get_workspace(self):
+		return self.read().workspace
+
+	# Internal helpers
+	def _open(self):
+		with open(self.path, 'rb') as f:
+			self._mmap = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+			stat = os.fstat(f.fileno())
+		self._file_id = (stat.st_dev, stat.st_ino)
+		self._checked = time.monotonic()
+		magic, version = struct.unpack_from('=4sH', self._mmap)
+		if magic != MAGIC or version != VERSION:
+			self.close()
+			raise ValueError(f"{self.path} is not a snapshot of version {VERSION}")
+		self._snapshot = None
+
+	def _check_replaced(self):
+		self._checked = time.monotonic()
+		try:
+			stat = os.stat(self.path)
+		except FileNotFoundError:
+			# Gone without closing it, don't serve stale data
+			self.close()
+			raise
+		if (stat.st_dev, stat.st_ino) != self._file_id:
+			self.close()
+			self._open()
+
+	def _read(self):
+		mm = self._mmap
+		for _ in range(self.retries):
+			seq = _SEQ.unpack_from(mm, _SEQ_OFFSET)[0]
+			if seq & 1:
+				continue
+			if self._snapshot is not None and seq == self._snapshot.seq:
+				return self._snapshot
+			header = mm[:HEADER.size]
+			_, _, flags, _, capacity, used, focused, workspace = HEADER.unpack(header)
+			slots = mm[HEADER.size:HEADER.size + min(used, capacity) * SLOT.size]
+			if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] != seq:
+				continue
+			if flags & FLAG_CLOSED:
+				return None
+			self._snapshot = self._decode(seq, flags, focused, workspace, slots)
+			return self._snapshot
+		raise TimeoutError(f"No consistent snapshot after {self.retries} tries")
+
+	def _decode(self, seq, flags, focused, workspace, slots):
+		windows = list()
+		focused_window = None
+		for index, (window_id, mask, app_id, title) in enumerate(SLOT.iter_unpack(slots)):
+			if not window_id:
+				continue
+			window = Window(
+				window_id,
+				app_id.rstrip(b'\0').decode('utf-8'),
+				title.rstrip(b'\0').decode('utf-8'),
+				TopLevel.STATE_FLAGS.get(mask)
+			)
+			windows.append(window)
+			if index == focused:
+				focused_window = window
+		workspace = workspace.rstrip(b'\0').decode('utf-8') or None
+		return Snapshot(seq, tuple(windows), focused_window, workspace, bool(flags & FLAG_TRUNCATED))
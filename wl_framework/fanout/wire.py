@@ -0,0 +1,150 @@
+import struct
+
+# Messages start with a header of u32 size including the header, u16
+# opcode and u16 padding. Fields follow in native byte order as the
+# socket is local only:
+#   u32, i32   fixed size integers
+#   str        u32 length + utf-8 bytes, no padding
+#   u32[]      u32 count + values
+#   str[]      u32 count + strings
+HEADER = struct.Struct('=IHH')
+
+# Server -> client
+SNAPSHOT_BEGIN = 0        # ()
+SNAPSHOT_END = 1          # ()
+OUTPUT = 2                # id, name, description, x, y, width, height, scale, refresh
+OUTPUT_REMOVED = 3        # id
+TOPLEVEL = 4              # id, changes, app_id, title, states, parent, outputs u32[]
+TOPLEVEL_CLOSED = 5       # id
+WORKSPACE_GROUP = 6       # id, outputs u32[]
+WORKSPACE = 7             # id, group, changes, name, coordinates u32[], states
+WORKSPACE_REMOVED = 8     # id
+SELECTION = 9             # primary, mime_types str[], empty if cleared
+
+# Client -> server
+TOPLEVEL_REQUEST = 32     # id, action
+WORKSPACE_ACTIVATE = 33   # id
+RECEIVE = 34              # primary, mime_type + fd of the write end
+
+# Bits of the changes field
+TOPLEVEL_FIELDS = ('title', 'app_id', 'states', 'outputs', 'parent')
+WORKSPACE_FIELDS = ('name', 'coordinates', 'states')
+
+# Actions of TOPLEVEL_REQUEST
+ACTIONS = (
+	'activate',
+	'close',
+	'minimize',
+	'unminimize',
+	'maximize',
+	'unmaximize',
+	'fullscreen',
+	'unfullscreen'
+)
+
+_U32 = struct.Struct('=I')
+_I32 = struct.Struct('=i')
+
+class WireError(Exception):
+	pass
+
+def encode_mask(changes, fields):
+	mask = 0
+	for bit, field in enumerate(fields):
+		if field in changes:
+			mask |= 1 << bit
+	return mask
+
+def decode_mask(mask, fields):
+	return frozenset(field for bit, field in enumerate(fields) if mask & (1 << bit))
+
+class Writer:
+	__slots__ = ('_parts', '_opcode')
+
+	def __init__(self, opcode):
+		self._opcode = opcode
+		self._parts = list()
+
+	def u32(self, value):
+		self._parts.append(_U32.pack(value))
+		return self
+
+	def i32(self, value):
+		self._parts.append(_I32.pack(value))
+		return self
+
+	def str(self, value):
+		data = (value or '').encode('utf-8')
+		self._parts.append(_U32.pack(len(data)))
+		self._parts.append(data)
+		return self
+
+	def u32_array(self, values):
+		values = tuple(values)
+		self._parts.append(struct.pack(f'=I{len(values)}I', len(values), *values))
+		return self
+
+	def str_array(self, values):
+		values = tuple(values)
+		self._parts.append(_U32.pack(len(values)))
+		for value in values:
+			self.str(value)
+		return self
+
+	def finish(self):
+		data = b''.join(self._parts)
+		return HEADER.pack(HEADER.size + len(data), self._opcode, 0) + data
+
+class Reader:
+	__slots__ = ('_data', '_offset')
+
+	def __init__(self, data):
+		self._data = data
+		self._offset = 0
+
+	def u32(self):
+		value = _U32.unpack_from(self._data, self._offset)[0]
+		self._offset += 4
+		return value
+
+	def i32(self):
+		value = _I32.unpack_from(self._data, self._offset)[0]
+		self._offset += 4
+		return value
+
+	def str(self):
+		size = self.u32()
+		end = self._offset + size
+		if end > len(self._data):
+			raise WireError("String exceeds message")
+		value = bytes(self._data[self._offset:end]).decode('utf-8')
+		self._offset = end
+		return value
+
+	def u32_array(self):
+		count = self.u32()
+		if self._offset + count * 4 > len(self._data):
+			raise WireError("Array exceeds message")
+		values = struct.unpack_from(f'={count}I', self._data, self._offset)
+		self._offset += count * 4
+		return values
+
+	def str_array(self):
+		return tuple(self.str() for _ in range(self.u32()))
+
+def split_messages(buffer):
+	# Returns [(opcode, payload)] for all complete messages in buffer,
+	# a bytearray, and removes them from it.
+	messages = list()
+	offset = 0
+	length = len(buffer)
+	while length - offset >= HEADER.size:
+		size, opcode, _ = HEADER.unpack_from(buffer, offset)
+		if size < HEADER.size:
+			raise WireError(f"Invalid message size {size}")
+		if length - offset < size:
+			break
+		messages.append((opcode, bytes(buffer[offset + HEADER.size:offset + size])))
+		offset += size
+	del buffer[:offset]
+	return messages
@@ -14,3 +14,8 @@ def PollIntegration(*args, **kwargs):
 	# Defer importing select
 	from .poll import PollIntegration as x
 	return x(*args, **kwargs)
+
+def EpollIntegration(*args, **kwargs):
+	# Defer importing select, Linux only
+	from .epoll import EpollIntegration as x
+	return x(*args, **kwargs)
@@ -0,0 +1,107 @@
+import math
+import time
+import heapq
+
+class TimerHeap:
+	"""
+		Timer bookkeeping for loop integrations without native timers.
+
+		Deadlines are kept in a min-heap. Removing a timer only drops it
+		from the timer table, stale heap entries are skipped once they
+		reach the top (lazy cancellation) and the heaps get compacted if
+		stale entries start to dominate.
+
+		Timers may have some slack: they are due at their deadline but
+		may fire up to slack seconds later. A second heap ordered by
+		deadline + slack determines the next wakeup, once woken up all
+		timers past their deadline fire together.
+	"""
+	def __init__(self, ids=None):
+		self._heap = list()
+		self._wakeups = list()
+		self._timers = dict()
+		self._stale = 0
+		if ids is None:
+			# Not using range() as it requires defining a maximum
+			def ids():
+				x = 0
+				while True:
+					yield x
+					x += 1
+			ids = iter(ids())
+		self._timerid = ids
+
+	def __len__(self):
+		return len(self._timers)
+
+	def __contains__(self, timer_id):
+		return timer_id in self._timers
+
+	def add(self, interval_in_s, callback, oneshot=False, slack=0):
+		timer_id = next(self._timerid)
+		self._schedule(timer_id,
+			time.monotonic() + interval_in_s, oneshot, interval_in_s, slack, callback
+		)
+		return timer_id
+
+	def remove(self, timer_id):
+		if self._timers.pop(timer_id, None) is None:
+			# Oneshot timer removed from within its own callback
+			return
+		self._stale += 1
+		if self._stale > 64 and self._stale > 2 * len(self._timers):
+			self._compact()
+
+	def get_next_wakeup(self):
+		# Returns None if there are no timers
+		wakeups = self._wakeups
+		timers = self._timers
+		while wakeups:
+			wakeup, deadline, timer_id = wakeups[0]
+			timer = timers.get(timer_id)
+			if timer is not None and timer[0] == deadline:
+				return wakeup
+			heapq.heappop(wakeups)
+		return None
+
+	def get_timeout(self):
+		# Milliseconds until the next wakeup or None if there is none
+		wakeup = self.get_next_wakeup()
+		if wakeup is None:
+			return None
+		return max(0, math.ceil((wakeup - time.monotonic()) * 1000))
+
+	def run_due(self):
+		now = time.monotonic()
+		heap = self._heap
+		timers = self._timers
+		while heap and heap[0][0] <= now:
+			deadline, timer_id = heapq.heappop(heap)
+			timer = timers.get(timer_id)
+			if timer is None or timer[0] != deadline:
+				self._stale -= 1
+				continue
+			_, oneshot, interval, slack, callback = timer
+			if oneshot:
+				del timers[timer_id]
+			else:
+				self._schedule(timer_id,
+					now + interval, oneshot, interval, slack, callback
+				)
+			callback(timer_id)
+
+	# Internal helpers
+	def _schedule(self, timer_id, deadline, oneshot, interval, slack, callback):
+		self._timers[timer_id] = (deadline, oneshot, interval, slack, callback)
+		heapq.heappush(self._heap, (deadline, timer_id))
+		heapq.heappush(self._wakeups, (deadline + slack, deadline, timer_id))
+
+	def _compact(self):
+		self._heap = [(timer[0], timer_id) for timer_id, timer in self._timers.items()]
+		self._wakeups = [
+			(timer[0] + timer[3], timer[0], timer_id)
+			for timer_id, timer in self._timers.items()
+		]
+		heapq.heapify(self._heap)
+		heapq.heapify(self._wakeups)
+		self._stale = 0
@@ -1,56 +1,43 @@
 import asyncio
 
+from ._timers import TimerHeap
+
 class AsyncIOIntegration:
 	def __init__(self):
 		self.loop = asyncio.get_running_loop()
-		self._timer_ids = dict()
-
-		# Not using range() as it requires defining a maximum
-		def ids():
-			x = 0
-			while True:
-				yield x
-				x += 1
-		self._timerid = iter(ids())
-
-	def _get_timerid(self):
-		return next(self._timerid)
-
-	def _timer_cb(self, timer_id, callback, oneshot, _interval):
-		now = self.loop.time()
-		callback(timer_id)
-		if not oneshot:
-			self.create_timer(
-				_interval, callback,
-				oneshot=oneshot,
-				_timer_id=timer_id, _start_at=now
-			)
-		else:
-			del self._timer_ids[timer_id]
-
-	def create_timer(self,
-		interval_in_s, callback, oneshot=False,
-		_timer_id=None, _start_at=None
-	):
-		# We need a timer_id in _timer_cb() callback.
-		# As AsyncIO doesn't actually send it as argument
-		# we have to roll our own id.
-		if _timer_id is None:
-			_timer_id = self._get_timerid()
-		if _start_at is None:
-			_start_at = self.loop.time()
-		timer_obj = self.loop.call_at(
-			_start_at + interval_in_s,
-			self._timer_cb,
-			_timer_id, callback, oneshot, interval_in_s
-		)
-		self._timer_ids[_timer_id] = timer_obj
-		return _timer_id
+		# All timers share a single asyncio handle which is armed for
+		# the next wakeup. loop.time() is based on time.monotonic().
+		self._timers = TimerHeap()
+		self._handle = None
+		self._handle_at = None
+
+	def _timer_cb(self):
+		self._handle = None
+		self._handle_at = None
+		try:
+			self._timers.run_due()
+		finally:
+			self._arm()
+
+	def _arm(self):
+		wakeup = self._timers.get_next_wakeup()
+		if wakeup == self._handle_at:
+			return
+		if self._handle is not None:
+			self._handle.cancel()
+			self._handle = None
+		self._handle_at = wakeup
+		if wakeup is not None:
+			self._handle = self.loop.call_at(wakeup, self._timer_cb)
+
+	def create_timer(self, interval_in_s, callback, oneshot=False, slack=0):
+		timer_id = self._timers.add(interval_in_s, callback, oneshot=oneshot, slack=slack)
+		self._arm()
+		return timer_id
 
 	def remove_timer(self, timer_id):
-		obj = self._timer_ids[timer_id]
-		del self._timer_ids[timer_id]
-		obj.cancel()
+		self._timers.remove(timer_id)
+		self._arm()
 
 	def create_reader(self, fd, callback):
 		self.loop.add_reader(fd, callback, fd)
@@ -58,3 +45,8 @@ class AsyncIOIntegration:
 	def remove_reader(self, fd):
 		self.loop.remove_reader(fd)
 
+	def create_writer(self, fd, callback):
+		self.loop.add_writer(fd, callback, fd)
+
+	def remove_writer(self, fd):
+		self.loop.remove_writer(fd)
@@ -1,7 +1,9 @@
 class DummyIntegration:
 
-	def create_timer(self, interval_in_s, callback, oneshot=False):
-		# Returns opaque timer_id
+	def create_timer(self, interval_in_s, callback, oneshot=False, slack=0):
+		# Returns opaque timer_id. The timer may fire up to slack
+		# seconds late to share a wakeup with other timers. Only
+		# passed if non-zero, so supporting it is optional.
 		raise NotImplementedError()
 
 	def remove_timer(self, timer_id):
@@ -12,3 +14,10 @@ class DummyIntegration:
 
 	def remove_reader(self, fd):
 		raise NotImplementedError()
+
+	def create_writer(self, fd, callback):
+		# Optional, callback(fd) is called once fd is writable
+		raise NotImplementedError()
+
+	def remove_writer(self, fd):
+		raise NotImplementedError()
@@ -0,0 +1,158 @@
+import os
+import time
+import select
+
+from ._timers import TimerHeap
+
+class EpollIntegration:
+	"""
+		Linux only integration based on epoll. Timers are backed by
+		timerfd if supported by Python (3.13+), otherwise by a deadline
+		heap which is used to calculate the epoll timeout. Timers with
+		slack always use the heap so they can share wakeups.
+
+		To embed this integration into another loop, watch fileno()
+		for readability and call dispatch(0) once it is readable.
+	"""
+	def __init__(self, use_timerfd=None):
+		if use_timerfd is None:
+			use_timerfd = hasattr(os, 'timerfd_create')
+		self._use_timerfd = use_timerfd
+		self._epoll = select.epoll()
+		self._callbacks = dict()
+		self._write_callbacks = dict()
+		self._masks = dict()
+		self._timer_fds = dict()
+		# Not using range() as it requires defining a maximum
+		def ids():
+			x = 0
+			while True:
+				yield x
+				x += 1
+		self._timerid = iter(ids())
+		self._timers = TimerHeap(ids=self._timerid)
+
+	def fileno(self):
+		return self._epoll.fileno()
+
+	def close(self):
+		for fd, _, _ in self._timer_fds.values():
+			os.close(fd)
+		self._timer_fds.clear()
+		self._epoll.close()
+
+	def __contains__(self, fd):
+		return fd in self._callbacks or fd in self._write_callbacks
+
+	def create_timer(self, interval_in_s, callback, oneshot=False, slack=0):
+		if not self._use_timerfd or slack:
+			return self._timers.add(interval_in_s, callback, oneshot=oneshot, slack=slack)
+		timer_id = next(self._timerid)
+		fd = os.timerfd_create(
+			time.CLOCK_MONOTONIC, flags=os.TFD_NONBLOCK | os.TFD_CLOEXEC
+		)
+		# An initial value of 0 would disarm the timer
+		initial = max(interval_in_s, 1e-9)
+		os.timerfd_settime(fd,
+			initial=initial, interval=0 if oneshot else initial
+		)
+		self._timer_fds[timer_id] = (fd, oneshot, callback)
+		self.create_reader(fd, lambda fd: self._timerfd_cb(fd, timer_id))
+		return timer_id
+
+	def remove_timer(self, timer_id):
+		if timer_id in self._timers:
+			self._timers.remove(timer_id)
+			return
+		timer = self._timer_fds.pop(timer_id, None)
+		if timer is None:
+			# Oneshot timer removed from within its own callback
+			return
+		fd = timer[0]
+		self.remove_reader(fd)
+		os.close(fd)
+
+	def create_reader(self, fd, callback):
+		self._callbacks[fd] = callback
+		self._update(fd)
+
+	def remove_reader(self, fd):
+		del self._callbacks[fd]
+		self._update(fd)
+
+	def create_writer(self, fd, callback):
+		self._write_callbacks[fd] = callback
+		self._update(fd)
+
+	def remove_writer(self, fd):
+		del self._write_callbacks[fd]
+		self._update(fd)
+
+	def handle_event(self, fd, evt=select.EPOLLIN):
+		if evt & (select.EPOLLOUT | select.EPOLLERR | select.EPOLLHUP):
+			callback = self._write_callbacks.get(fd)
+			if callback is not None:
+				callback(fd)
+		if evt & (select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP):
+			# Might have been removed by an earlier callback
+			callback = self._callbacks.get(fd)
+			if callback is not None:
+				callback(fd)
+
+	def get_timeout(self):
+		# Seconds until the next heap timer is due, -1 if there is none
+		timeout = self._timers.get_timeout()
+		if timeout is None:
+			return -1
+		return timeout / 1000
+
+	def check_timers(self):
+		self._timers.run_due()
+
+	def dispatch(self, timeout=None):
+		if timeout is None:
+			timeout = self.get_timeout()
+		for fd, evt in self._epoll.poll(timeout):
+			self.handle_event(fd, evt)
+		self.check_timers()
+
+	def run(self):
+		while True:
+			self.dispatch()
+
+	# Internal helpers
+	def _update(self, fd):
+		mask = 0
+		if fd in self._callbacks:
+			mask |= select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP
+		if fd in self._write_callbacks:
+			mask |= select.EPOLLOUT
+		old_mask = self._masks.get(fd)
+		if not mask:
+			del self._masks[fd]
+			try:
+				self._epoll.unregister(fd)
+			except OSError:
+				# Closed fds are removed from the epoll set automatically
+				pass
+		elif old_mask is None:
+			self._masks[fd] = mask
+			self._epoll.register(fd, mask)
+		elif old_mask != mask:
+			self._masks[fd] = mask
+			try:
+				self._epoll.modify(fd, mask)
+			except FileNotFoundError:
+				# fd got closed and reused without being removed first
+				self._epoll.register(fd, mask)
+
+	def _timerfd_cb(self, fd, timer_id):
+		try:
+			os.read(fd, 8)
+		except BlockingIOError:
+			# Not actually expired, fd got reused in the meantime
+			return
+		fd, oneshot, callback = self._timer_fds[timer_id]
+		if oneshot:
+			self.remove_timer(timer_id)
+		callback(timer_id)
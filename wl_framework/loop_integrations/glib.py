@@ -1,10 +1,60 @@
+import math
+
 import gi
 gi.require_version("GLib", "2.0")
 from gi.repository import GLib
 
+class WaylandSource(GLib.Source):
+	"""
+		Dedicated source for a WaylandConnection socket.
+
+		prepare() flushes queued requests before the main loop goes
+		to sleep and additionally waits for the socket to become
+		writable if they could not be sent completely. dispatch()
+		drains the socket and dispatches all received events at once.
+	"""
+	IN = GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR
+	OUT = GLib.IO_OUT
+
+	def __init__(self, connection):
+		super().__init__()
+		self._connection = connection
+		self._events = self.IN
+		self._tag = self.add_unix_fd(connection.fileno(), self._events)
+		self.set_name('wl_framework')
+
+	def _set_events(self, events):
+		if events != self._events:
+			self._events = events
+			self.modify_unix_fd(self._tag, events)
+
+	def prepare(self):
+		if self._connection.flush():
+			self._set_events(self.IN)
+		else:
+			self._set_events(self.IN | self.OUT)
+		return False, -1
+
+	def check(self):
+		return bool(self.query_unix_fd(self._tag) & self._events)
+
+	def dispatch(self, callback, args):
+		revents = self.query_unix_fd(self._tag)
+		if revents & self.OUT:
+			self._connection.flush()
+		if revents & self.IN:
+			self._connection.do_read(drain=True)
+		return GLib.SOURCE_CONTINUE
+
 class GLibIntegration:
-	def __init__(self):
+	def __init__(self, wayland_priority=GLib.PRIORITY_DEFAULT):
+		# wayland_priority is used for the connection source. GTK redraws
+		# run at GLib.PRIORITY_HIGH_IDLE + 20, so the default priority
+		# dispatches Wayland events before redrawing.
 		self._fds = dict()
+		self._write_fds = dict()
+		self._sources = dict()
+		self._wayland_priority = wayland_priority
 		self._timer_ids = dict()
 
 		# Not using range() as it requires defining a maximum
@@ -28,17 +78,30 @@ class GLibIntegration:
 		callback(fd)
 		return True
 
-	def create_timer(self, interval_in_s, callback, oneshot=False):
+	def create_timer(self, interval_in_s, callback, oneshot=False, slack=0):
 		# We need a timer_id in _timer_cb callback.
 		# As GLib doesn't actually send it as argument
 		# we have to roll our own id.
 		_timer_id = self._get_timerid()
-		glib_source_id = GLib.timeout_add(
-			int(interval_in_s * 1000),
-			self._timer_cb,
-			(_timer_id, callback, oneshot),
-			priority=GLib.PRIORITY_LOW
-		)
+		seconds = math.ceil(interval_in_s)
+		if interval_in_s >= 1 and seconds - interval_in_s + 1 <= slack:
+			# Second based timers of all processes fire at the same
+			# (per session randomized) offset within a second. That
+			# offset and rounding up to full seconds may delay the
+			# timer by almost two seconds but never fire it early.
+			glib_source_id = GLib.timeout_add_seconds(
+				seconds,
+				self._timer_cb,
+				(_timer_id, callback, oneshot),
+				priority=GLib.PRIORITY_LOW
+			)
+		else:
+			glib_source_id = GLib.timeout_add(
+				math.ceil(interval_in_s * 1000),
+				self._timer_cb,
+				(_timer_id, callback, oneshot),
+				priority=GLib.PRIORITY_LOW
+			)
 		self._timer_ids[_timer_id] = glib_source_id
 		return _timer_id
 
@@ -62,6 +125,31 @@ class GLibIntegration:
 		del self._fds[fd]
 		GLib.source_remove(glib_source_id)
 
+	def create_writer(self, fd, callback):
+		glib_source_id = GLib.io_add_watch(
+			fd,
+			GLib.PRIORITY_DEFAULT,
+			GLib.IO_OUT | GLib.IO_HUP | GLib.IO_NVAL | GLib.IO_ERR,
+			self._read_cb,
+			callback
+		)
+		self._write_fds[fd] = glib_source_id
+
+	def remove_writer(self, fd):
+		glib_source_id = self._write_fds[fd]
+		del self._write_fds[fd]
+		GLib.source_remove(glib_source_id)
+
+	def create_connection_source(self, connection):
+		source = WaylandSource(connection)
+		source.set_priority(self._wayland_priority)
+		source.attach(None)
+		self._sources[connection] = source
+
+	def remove_connection_source(self, connection):
+		source = self._sources.pop(connection)
+		source.destroy()
+
 	def run(self):
 		loop = GLib.MainLoop()
 		loop.run()
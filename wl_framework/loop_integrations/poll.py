@@ -1,78 +1,80 @@
-import time
 import select
 
+from ._timers import TimerHeap
+
 class PollIntegration:
 	"""
 		If you use this Integration with an existing poll object
-		make sure to call handle_event(fd) once you got an event.
+		make sure to call handle_event(fd, evt) once you got an event.
 		You may use 'fd in pollIntegration' to check if the fd you
 		got an event for was registered in this class before calling.
-		You should also call check_timers() roughly about every second
-		(or more, or less, depending on how exact you want your timers
-		to be).
+		You should also call check_timers() after each poll() and use
+		get_timeout() as poll() timeout so timers fire in time.
 	"""
 	def __init__(self, poll_obj=None):
 		self._poll = poll_obj
 		if not self._poll:
 			self._poll = select.poll()
 		self._callbacks = dict()
-		self._timers = dict()
-		# Not using range() as it requires defining a maximum
-		def ids():
-			x = 0
-			while True:
-				yield x
-				x += 1
-		self._timerid = iter(ids())
-
-	def _get_timerid(self):
-		return next(self._timerid)
+		self._write_callbacks = dict()
+		self._timers = TimerHeap()
 
-	def create_timer(self, interval_in_s, callback, oneshot=False):
-		# Wouldn't it be great if base Python would have a timerfd wrapper?
-		timer_id = self._get_timerid()
-		run_at = time.monotonic() + interval_in_s
-		self._timers[timer_id] = (run_at, oneshot, interval_in_s, callback)
-		return timer_id
+	def create_timer(self, interval_in_s, callback, oneshot=False, slack=0):
+		return self._timers.add(interval_in_s, callback, oneshot=oneshot, slack=slack)
 
 	def remove_timer(self, timer_id):
-		del self._timers[timer_id]
+		self._timers.remove(timer_id)
 
 	def __contains__(self, fd):
-		return fd in self._callbacks
+		return fd in self._callbacks or fd in self._write_callbacks
 
 	def create_reader(self, fd, callback):
-		self._poll.register(fd, select.POLLIN | select.POLLERR | select.POLLHUP)
 		self._callbacks[fd] = callback
+		self._update(fd)
 
 	def remove_reader(self, fd):
-		self._poll.unregister(fd)
 		del self._callbacks[fd]
+		self._update(fd)
 
-	def handle_event(self, fd):
-		callback = self._callbacks[fd]
-		callback(fd)
+	def create_writer(self, fd, callback):
+		self._write_callbacks[fd] = callback
+		self._update(fd)
 
-	def check_timers(self):
-		# Wouldn't it be great if base Python would have a timerfd wrapper?
-		now = time.monotonic()
-		for timer_id in tuple(self._timers):
-			if timer_id not in self._timers:
-				# Deleted in the meantime, probably by us
-				continue
-			run_at, oneshot, interval, callback = self._timers[timer_id]
-			if now < run_at:
-				continue
-			callback(timer_id)
+	def remove_writer(self, fd):
+		del self._write_callbacks[fd]
+		self._update(fd)
+
+	def handle_event(self, fd, evt=select.POLLIN):
+		if evt & (select.POLLOUT | select.POLLERR | select.POLLHUP):
+			callback = self._write_callbacks.get(fd)
+			if callback is not None:
+				callback(fd)
+		if evt & (select.POLLIN | select.POLLERR | select.POLLHUP | select.POLLNVAL):
+			callback = self._callbacks.get(fd)
+			if callback is not None:
+				callback(fd)
 
-			if oneshot:
-				del self._timers[timer_id]
-			else:
-				run_at = now + interval
-				self._timers[timer_id] = (run_at, oneshot, interval, callback)
+	def get_timeout(self):
+		# Milliseconds until the next timer is due, None if there are no timers
+		return self._timers.get_timeout()
+
+	def check_timers(self):
+		self._timers.run_due()
 
 	def run(self):
 		while True:
-			for fd, evt in self._poll.poll(1000):
-				self.handle_event(fd)
+			for fd, evt in self._poll.poll(self._timers.get_timeout()):
+				self.handle_event(fd, evt)
 			self.check_timers()
+
+	# Internal helpers
+	def _update(self, fd):
+		mask = 0
+		if fd in self._callbacks:
+			mask |= select.POLLIN | select.POLLERR | select.POLLHUP
+		if fd in self._write_callbacks:
+			mask |= select.POLLOUT
+		if mask:
+			self._poll.register(fd, mask)
+		else:
+			self._poll.unregister(fd)
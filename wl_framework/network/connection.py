@@ -1,22 +1,92 @@
 import os
+import time
 import errno
 import array
 import socket
 import struct
+import signal
+import threading
+from collections import deque
 
-from ..protocols.base import Interface
+from ..protocols.base import ArgUint32, Interface, UnsupportedProtocolError
 from ..protocols.wayland import Display
 from ..loop_integrations.dummy import DummyIntegration
+from .tracker import ObjectTracker
+from .profiler import SamplingProfiler
+
+# Object ids starting from here are allocated by the server
+SERVER_ID_START = 0xff000000
 
 class WaylandDisconnected(Exception):
 	pass
 
+class _Timer:
+	__slots__ = (
+		'loop_id', 'deadline', 'oneshot', 'interval', 'slack',
+		'idle_suspend', 'callback', 'args', 'kwargs'
+	)
+
+	def __init__(self, oneshot, interval, slack, idle_suspend, callback, args, kwargs):
+		self.loop_id = None
+		self.deadline = None
+		self.oneshot = oneshot
+		self.interval = interval
+		self.slack = slack
+		self.idle_suspend = idle_suspend
+		self.callback = callback
+		self.args = args
+		self.kwargs = kwargs
+
 # TODO: cleanup and use sections
 class WaylandConnection:
-	def __init__(self, eventloop_integration=None):
+	def __init__(self, eventloop_integration=None, reconnect_interval=None):
+		# If reconnect_interval is set, a lost connection is not raised as
+		# WaylandDisconnected but re-established every reconnect_interval
+		# seconds. Afterwards all globals bound via bind() are re-bound.
 		self._obj_ids_reuse = list()
 		self._obj_ids = self._obj_id_generator()
+		self._connect()
+
+		self._leftover = b''
+		self._incoming_fds = list()
+		self._event_handlers = dict()
+
+		self._read_callbacks = dict()
+		self._write_callbacks = dict()
+		# Timer ids handed out by add_timer() are independent of the
+		# loop integration so suspended timers can be re-created.
+		self._timer_callbacks = dict()
+		self._loop_timers = dict()
+		self._timer_ids = self._timer_id_generator()
+		self._timers_suspended = False
+
+		# Outgoing data which could not be sent without blocking,
+		# entries are [data, fds] with fds owned by the queue.
+		self._send_queue = deque()
+		self._send_watched = False
+		# Requests held back behind binds which wait for their global
+		# to be announced, entries are [interface, obj_id, data, fds].
+		# interface is only set for the binds themselves.
+		self._held = None
+
+		self._bound = list()
+		self._reconnect_interval = reconnect_interval
+		self._reconnect_timer = None
+		self.reconnecting = False
+
+		self.tracker = None
+		self.profiler = None
+		self._loop_thread = threading.get_ident()
+
+		self.loop = eventloop_integration
+		if self.loop is None:
+			self.loop = DummyIntegration()
+		self._watch_socket()
+
+		self.display = Display(self)
+		self.display.do_sync(self.on_initial_sync)
 
+	def _connect(self):
 		xdg_runtime_dir = os.getenv('XDG_RUNTIME_DIR', None)
 		wayland_display = os.getenv('WAYLAND_DISPLAY', None)
 		if None in (xdg_runtime_dir, wayland_display):
@@ -30,41 +100,144 @@ class WaylandConnection:
 		except ConnectionRefusedError:
 			self.log("Failed to connect to", wayland_socket)
 			self.log()
+			self._socket.close()
 			raise
+		except OSError:
+			self._socket.close()
+			raise
+		self._fd = self._socket.fileno()
+		self._connected = True
 
-		self._leftover = b''
-		self._incoming_fds = list()
-		self._event_handlers = dict()
+	def shutdown(self):
+		if self._reconnect_timer is not None:
+			self.remove_timer(self._reconnect_timer)
+			self._reconnect_timer = None
+		self._reconnect_interval = None
+		if self._connected:
+			self._close_socket()
+		raise WaylandDisconnected()
 
-		self._read_callbacks = dict()
-		self._write_callbacks = dict()
-		self._timer_callbacks = dict()
+	def on_initial_sync(self, data):
+		self.display.registry.on_initial_sync()
+		for interface in tuple(self._event_handlers.values()):
+			if isinstance(interface, Interface):
+				if interface != self.display.registry:
+					interface.on_initial_sync()
 
-		self.loop = eventloop_integration
-		if self.loop is None:
-			self.loop = DummyIntegration()
+	# Custom events
+	def on_disconnected(self):
+		pass
+
+	def on_reconnected(self):
+		pass
+
+	# Reconnect handling
+	def reconnect(self):
+		if self._connected:
+			self._close_socket()
+		self._connect()
+		self.reconnecting = True
+
+		for fd in self._incoming_fds:
+			os.close(fd)
+		self._incoming_fds.clear()
+		self._leftover = b''
+		self._event_handlers.clear()
+		self._obj_ids_reuse.clear()
+		self._obj_ids = self._obj_id_generator()
+
+		self._watch_socket()
+		self.display.reset()
+		self.display.do_sync(self._on_reconnect_sync)
+
+	def _watch_socket(self):
+		# Loop integrations may provide a dedicated source for the
+		# connection which takes care of reading and flushing itself.
+		create_source = getattr(self.loop, 'create_connection_source', None)
+		if create_source is not None:
+			create_source(self)
+			self._socket_source = True
+			return
+		self._socket_source = False
 		try:
 			self.add_reader(self.fileno(), self.do_read)
 		except NotImplementedError:
 			pass
 
-		self.display = Display(self)
-		self.display.do_sync(self.on_initial_sync)
+	def _close_socket(self):
+		self._connected = False
+		if self._socket_source:
+			self.loop.remove_connection_source(self)
+		else:
+			try:
+				self.remove_reader(self._fd)
+			except NotImplementedError:
+				pass
+		if self._send_watched:
+			self.remove_writer(self._fd)
+			self._send_watched = False
+		for _, fds in self._send_queue:
+			for fd in fds:
+				os.close(fd)
+		self._send_queue.clear()
+		self._drop_held_requests()
+		self._socket.close()
 
-	def shutdown(self):
+	def _handle_disconnect(self):
+		if not self._connected:
+			# Already being handled
+			return
+		self._close_socket()
+		if self._reconnect_interval is None:
+			raise WaylandDisconnected()
+		self.reconnecting = True
+		self.log("Connection lost, trying to reconnect")
+		self.on_disconnected()
+		self._schedule_reconnect()
+
+	def _schedule_reconnect(self):
 		try:
-			self.remove_reader(self.fileno())
+			self._reconnect_timer = self.add_timer(
+				self._reconnect_interval, self._try_reconnect, oneshot=True
+			)
 		except NotImplementedError:
-			pass
-		self._socket.close()
-		raise WaylandDisconnected()
+			self.reconnecting = False
+			raise WaylandDisconnected()
 
-	def on_initial_sync(self, data):
+	def _try_reconnect(self):
+		self._reconnect_timer = None
+		try:
+			self.reconnect()
+		except OSError as e:
+			self.log(f"Reconnect failed: {e}")
+			self._schedule_reconnect()
+
+	def _on_reconnect_sync(self, data):
+		# Replay all binds in their original order
 		self.display.registry.on_initial_sync()
-		for interface in tuple(self._event_handlers.values()):
-			if isinstance(interface, Interface):
-				if interface != self.display.registry:
-					interface.on_initial_sync()
+		for interface in tuple(self._bound):
+			interface.obj_id = None
+			try:
+				self.display.registry.do_bind(interface)
+			except UnsupportedProtocolError as e:
+				self.log(f"Dropping {interface.__class__.__name__}: {e}")
+				self._bound.remove(interface)
+				continue
+			self.add_event_handler(interface)
+		# Only now, on_reconnected() may send requests referring to
+		# globals bound later on, e.g. a lazily bound seat.
+		for interface in tuple(self._bound):
+			interface.on_reconnected()
+		# Wait for the initial state of the re-bound globals
+		self.display.do_sync(self._on_resync_done)
+
+	def _on_resync_done(self, data):
+		self.display.on_resynced()
+		for interface in tuple(self._bound):
+			interface.on_resynced()
+		self.reconnecting = False
+		self.log("Reconnected")
+		self.on_reconnected()
 
 	def fileno(self):
 		return self._socket.fileno()
@@ -77,23 +250,49 @@ class WaylandConnection:
 		callback, args, kwargs = self._read_callbacks[fd]
 		callback(*args, **kwargs)
 
-	def _notify_timer_cb(self, timer_id):
-		if timer_id not in self._timer_callbacks:
-			self.log(f"Ignoring timer cb for timer id {timer_id}")
+	def _notify_write_cb(self, fd):
+		if fd not in self._write_callbacks:
+			self.log(f"Ignoring write cb for fd {fd}")
 			return
-		oneshot, callback, args, kwargs = self._timer_callbacks[timer_id]
+		callback, args, kwargs = self._write_callbacks[fd]
 		callback(*args, **kwargs)
-		if oneshot:
+
+	def _notify_timer_cb(self, loop_timer_id):
+		timer_id = self._loop_timers.get(loop_timer_id)
+		if timer_id is None:
+			self.log(f"Ignoring timer cb for loop timer id {loop_timer_id}")
+			return
+		timer = self._timer_callbacks[timer_id]
+		if timer.oneshot:
 			del self._timer_callbacks[timer_id]
+			del self._loop_timers[loop_timer_id]
+		else:
+			timer.deadline = time.monotonic() + timer.interval
+		timer.callback(*timer.args, **timer.kwargs)
 
 	# public API
 	def add_reader(self, fd, callback, *args, **kwargs):
 		self.loop.create_reader(fd, self._notify_read_cb)
 		self._read_callbacks[fd] = (callback, args, kwargs)
 
-	def add_timer(self, interval_in_s, callback, *args, oneshot=False, **kwargs):
-		timer_id = self.loop.create_timer(interval_in_s, self._notify_timer_cb, oneshot=oneshot)
-		self._timer_callbacks[timer_id] = (oneshot, callback, args, kwargs)
+	def add_writer(self, fd, callback, *args, **kwargs):
+		self.loop.create_writer(fd, self._notify_write_cb)
+		self._write_callbacks[fd] = (callback, args, kwargs)
+
+	def add_timer(self, interval_in_s, callback, *args,
+		oneshot=False, slack=0, idle_suspend=False, **kwargs
+	):
+		# slack allows the timer to fire up to slack seconds late
+		# so it can be coalesced with other timers into one wakeup.
+		# idle_suspend timers are paused by suspend_idle_timers(),
+		# see IdleScheduler in protocols/idle_notify.py.
+		timer = _Timer(oneshot, interval_in_s, slack, idle_suspend, callback, args, kwargs)
+		timer_id = next(self._timer_ids)
+		if idle_suspend and self._timers_suspended:
+			timer.deadline = time.monotonic() + interval_in_s
+		else:
+			self._arm_timer(timer_id, timer, interval_in_s)
+		self._timer_callbacks[timer_id] = timer
 		return timer_id
 
 	def remove_reader(self, fd):
@@ -103,49 +302,116 @@ class WaylandConnection:
 		self.loop.remove_reader(fd)
 		del self._read_callbacks[fd]
 
+	def remove_writer(self, fd):
+		if fd not in self._write_callbacks:
+			self.log(f"Warning: FD {fd} does not refer to a known fd. Not removing writer.")
+			return
+		self.loop.remove_writer(fd)
+		del self._write_callbacks[fd]
+
 	def remove_timer(self, timer_id):
 		if timer_id not in self._timer_callbacks:
 			self.log(f"Warning: Timer {timer_id} does not refer to a known timer. Not removing.")
 			return
-		self.loop.remove_timer(timer_id)
-		del self._timer_callbacks[timer_id]
+		timer = self._timer_callbacks.pop(timer_id)
+		if timer.loop_id is not None:
+			self.loop.remove_timer(timer.loop_id)
+			del self._loop_timers[timer.loop_id]
+
+	def suspend_idle_timers(self):
+		# Stops all timers added with idle_suspend=True
+		if self._timers_suspended:
+			return
+		self._timers_suspended = True
+		for timer in self._timer_callbacks.values():
+			if not timer.idle_suspend or timer.loop_id is None:
+				continue
+			self.loop.remove_timer(timer.loop_id)
+			del self._loop_timers[timer.loop_id]
+			timer.loop_id = None
+
+	def resume_idle_timers(self):
+		# Timers which would have fired while suspended fire right away
+		# so e.g. a clock does not show a stale time until the next tick.
+		if not self._timers_suspended:
+			return
+		self._timers_suspended = False
+		now = time.monotonic()
+		overdue = list()
+		for timer_id, timer in tuple(self._timer_callbacks.items()):
+			if not timer.idle_suspend or timer.loop_id is not None:
+				continue
+			if timer.oneshot:
+				self._arm_timer(timer_id, timer, max(0, timer.deadline - now))
+				continue
+			if timer.deadline <= now:
+				overdue.append(timer)
+			self._arm_timer(timer_id, timer, timer.interval)
+		for timer in overdue:
+			timer.callback(*timer.args, **timer.kwargs)
 
 	# internals
-	def do_read(self):
-		fds = array.array('i')
-		try:
-			# We allow receiving up to 32 FDs in a single call. If there
-			# are more filedescriptors pending they will be automatically
-			# closed by the Linux kernel. See man 7 unix (part SCM_RIGHTS).
-			# All received FDs which force the open FD count above the
-			# process limit are also automatically closed.
-
-			# TODO: we should likely keep on eye on the limit (getrlimit).
-			#       + possibly set it to the hard limit while starting.
-			data, aux_data, msg_flags, address = self._socket.recvmsg(
-				4096, socket.CMSG_SPACE(32 * fds.itemsize)
+	def _arm_timer(self, timer_id, timer, interval_in_s):
+		if timer.slack:
+			loop_id = self.loop.create_timer(
+				interval_in_s, self._notify_timer_cb, oneshot=timer.oneshot, slack=timer.slack
 			)
-		except OSError as e:
-			if e.errno != errno.EBADF:
-				raise
+		else:
+			loop_id = self.loop.create_timer(
+				interval_in_s, self._notify_timer_cb, oneshot=timer.oneshot
+			)
+		timer.loop_id = loop_id
+		timer.deadline = time.monotonic() + interval_in_s
+		self._loop_timers[loop_id] = timer_id
+
+	def do_read(self, drain=False):
+		# With drain set, keep on reading until the socket would block
+		# and dispatch all received events in one go afterwards.
+		chunks = list()
+		flags = 0
+		while True:
 			try:
-				self.remove_reader(self.fileno())
-			except NotImplementedError:
-				pass
-			raise WaylandDisconnected()
-
-		for cmsg_level, cmsg_type, cmsg_data in aux_data:
-			if (
-				cmsg_level == socket.SOL_SOCKET and
-				cmsg_type == socket.SCM_RIGHTS
-			):
-				# Received FDs, append them to _incoming_fds
-				# where event handlers may .pop(0) them again.
-				fds.frombytes(cmsg_data)
-				self._incoming_fds.extend(fds)
-
-		if not data and not aux_data:
-			raise WaylandDisconnected()
+				# We allow receiving up to 32 FDs in a single call. If there
+				# are more filedescriptors pending they will be automatically
+				# closed by the Linux kernel. See man 7 unix (part SCM_RIGHTS).
+				# All received FDs which force the open FD count above the
+				# process limit are also automatically closed.
+
+				# TODO: we should likely keep on eye on the limit (getrlimit).
+				#       + possibly set it to the hard limit while starting.
+				data, aux_data, msg_flags, address = self._socket.recvmsg(
+					4096, socket.CMSG_SPACE(32 * 4), flags
+				)
+			except BlockingIOError:
+				break
+			except ConnectionResetError:
+				return self._handle_disconnect()
+			except OSError as e:
+				if e.errno != errno.EBADF:
+					raise
+				return self._handle_disconnect()
+
+			for cmsg_level, cmsg_type, cmsg_data in aux_data:
+				if (
+					cmsg_level == socket.SOL_SOCKET and
+					cmsg_type == socket.SCM_RIGHTS
+				):
+					# Received FDs, append them to _incoming_fds
+					# where event handlers may .pop(0) them again.
+					fds = array.array('i')
+					fds.frombytes(cmsg_data)
+					self._incoming_fds.extend(fds)
+
+			if not data and not aux_data:
+				if chunks:
+					# Dispatch what we got, the next read will notice
+					break
+				return self._handle_disconnect()
+			chunks.append(data)
+			if not drain or len(data) < 4096:
+				break
+			flags = socket.MSG_DONTWAIT
+		data = b''.join(chunks)
 
 		fds = self._incoming_fds
 		data = self._leftover + data
@@ -169,6 +435,12 @@ class WaylandConnection:
 			yield next_id
 			next_id += 1
 
+	def _timer_id_generator(self):
+		next_id = 1
+		while True:
+			yield next_id
+			next_id += 1
+
 	def get_new_obj_id(self):
 		return next(self._obj_ids)
 
@@ -177,7 +449,11 @@ class WaylandConnection:
 		if obj is not None:
 			if isinstance(obj, Interface):
 				obj.on_destroyed()
+				if obj in self._bound:
+					self._bound.remove(obj)
 			del self._event_handlers[obj_id]
+		if self.tracker is not None:
+			self.tracker.on_deleted(obj_id)
 		self._obj_ids_reuse.append(obj_id)
 
 	def get_obj(self, obj_id):
@@ -187,8 +463,21 @@ class WaylandConnection:
 		self.display.do_sync(callback)
 
 	def bind(self, interface):
+		# Works before the initial sync as well, in that case the bind
+		# may only be sent once the global got announced.
 		self.display.registry.do_bind(interface)
 		self.add_event_handler(interface)
+		self._bound.append(interface)
+
+	def bind_when_seen(self, iface_name, factory, on_bound=None, on_removed=None, bind_all=False):
+		return self.display.registry.bind_when_seen(
+			iface_name, factory, on_bound, on_removed, bind_all
+		)
+
+	def bind_all(self, iface_name, factory, on_bound=None, on_removed=None):
+		return self.display.registry.bind_when_seen(
+			iface_name, factory, on_bound, on_removed, bind_all=True
+		)
 
 	def add_event_handler(self, obj_id, callback=None):
 		if isinstance(obj_id, Interface):
@@ -205,6 +494,8 @@ class WaylandConnection:
 			raise RuntimeError(f"Can't add event handler. Event handler already installed for {obj_id}: {existing}.")
 
 		self._event_handlers[obj_id] = callback
+		if self.tracker is not None and isinstance(callback, Interface):
+			self.tracker.on_created(callback)
 
 	def remove_event_handler(self, obj_id):
 		if isinstance(obj_id, Interface):
@@ -212,38 +503,259 @@ class WaylandConnection:
 		if obj_id not in self._event_handlers:
 			raise RuntimeError(f"Can't remove event handler with obj_id {obj_id}: Not actually attached.")
 		del self._event_handlers[obj_id]
+		if self.tracker is not None and obj_id >= SERVER_ID_START:
+			# The server doesn't send delete_id for its own objects
+			self.tracker.on_deleted(obj_id)
+
+	def enable_tracking(self, history=1024):
+		# Registers already existing objects as well
+		if self.tracker is not None:
+			return self.tracker
+		self.tracker = ObjectTracker(history=history)
+		for obj in self._event_handlers.values():
+			if isinstance(obj, Interface):
+				self.tracker.on_created(obj)
+		return self.tracker
+
+	def disable_tracking(self):
+		self.tracker = None
+
+	def start_profiling(self, interval_in_ms=5):
+		# Samples the thread which created the connection
+		if self.profiler is not None and self.profiler.running:
+			return self.profiler
+		self.profiler = SamplingProfiler(self._loop_thread, interval_in_ms)
+		self.profiler.start()
+		return self.profiler
+
+	def stop_profiling(self, output=None):
+		# Writes collapsed stacks to output if given
+		profiler = self.profiler
+		if profiler is None:
+			return None
+		profiler.stop()
+		self.profiler = None
+		if output is not None:
+			profiler.write(output)
+			self.log(f"Profile with {profiler.samples} samples written to {output}")
+		return profiler
+
+	def enable_profiling_signal(self, signum=signal.SIGUSR1, output=None, interval_in_ms=5):
+		# The first signal starts profiling, the next one stops it and writes the result.
+		# Must be called from the main thread.
+		if output is None:
+			output = f"wl_framework-{os.getpid()}.collapsed"
+		def toggle(_signum, _frame):
+			if self.profiler is None:
+				self.log(f"Profiling started, send signal {_signum} again to stop")
+				self.start_profiling(interval_in_ms)
+			else:
+				self.stop_profiling(output)
+		if self.profiler is not None and self.profiler.running:
+			raise RuntimeError("Profiler already running, call stop_profiling() first")
+		signal.signal(signum, toggle)
+		self.profiler = None
+		self._loop_thread = threading.get_ident()
 
 	def _handle_event(self, obj_id, evt_id, data, fds):
 		callback = self._event_handlers.get(obj_id)
 		if isinstance(callback, Interface):
-			if len(callback._events) <= evt_id:
-				self.log(f"No idea how to handle event {callback.name}.{evt_id}({data})")
+			events = callback._events
+			if len(events) <= evt_id:
+				self.log(f"No idea how to handle event {callback.iface_name}.{evt_id}({data})")
 			else:
-				callback._events[evt_id](data, fds)
+				events[evt_id](data, fds)
 		elif callable(callback):
 			callback(data)
 		else:
 			raise RuntimeError(f"_handle_event() got invalid callback: {callback} of type {type(callback)}")
 
 	def send_opcode(self, obj_id, opcode, data=b'', fds=None):
+		data = self._pack_request(obj_id, opcode, data)
+
+		if not self._connected:
+			self.log(f"Not connected, dropping request {opcode} for object {obj_id}")
+			return
+		if isinstance(fds, int):
+			fds = (fds,)
+		if self._held is not None:
+			fds = tuple(os.dup(fd) for fd in fds) if fds else tuple()
+			self._held.append([None, obj_id, data, fds])
+			return
+		self._send_request(data, fds)
+
+	def _pack_request(self, obj_id, opcode, data):
 		size = 8 + len(data)
 		sizeop = size << 16 | opcode
-		data = struct.pack('=II', obj_id, sizeop) + data
-
-		# TODO: wrap in try except and raise WaylandDisconnected()
-		sent = 0
-		if fds is not None:
-			if isinstance(fds, int):
-				fds = (fds,)
-			sent += self._socket.sendmsg(
-				[data], [
-					(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))
-				]
-			)
-		while sent != len(data):
-			if sent:
-				self.log(f"Sending additional data chunk. {sent}/{len(data)} sent")
-			sent += self._socket.sendmsg([data[sent:]])
+		return struct.pack('=II', obj_id, sizeop) + data
+
+	def _send_request(self, data, fds):
+		if self._send_queue:
+			# Keep ordering, callers are free to close their fds once we return
+			self._queue(data, fds)
+			return
+		try:
+			sent = self._send(data, fds)
+		except BlockingIOError:
+			sent = 0
+		except (BrokenPipeError, ConnectionResetError):
+			return self._handle_disconnect()
+		if sent == len(data):
+			return
+		if sent:
+			# fds are transferred with the first byte
+			fds = None
+		self._queue(data[sent:], fds)
+
+	def has_pending_output(self):
+		return bool(self._send_queue) or bool(self._held)
+
+	# Pipelined binds
+	def hold_requests(self, interface):
+		# The bind of interface has to wait until its global is announced.
+		# Hold back all following requests as well, they might refer to it.
+		if self._held is None:
+			self._held = deque()
+		self._held.append([interface, interface.obj_id, None, tuple()])
+
+	def release_held_requests(self):
+		# Called by the registry whenever a global got announced
+		# and once the initial set of globals is complete.
+		held = self._held
+		if held is None:
+			return
+		registry = self.display.registry
+		dropped = set()
+		while held:
+			interface, obj_id, data, fds = held[0]
+			if interface is not None:
+				try:
+					data = self._pack_request(
+						registry.obj_id, 0, registry._create_bind(interface)
+					)
+				except UnsupportedProtocolError as e:
+					if not registry._initial_sync:
+						# Might still be announced
+						return
+					held.popleft()
+					dropped.add(obj_id)
+					self._drop_interface(interface, e)
+					continue
+			elif obj_id in dropped:
+				held.popleft()
+				for fd in fds:
+					os.close(fd)
+				continue
+			held.popleft()
+			try:
+				self._send_request(data, fds)
+			finally:
+				for fd in fds:
+					os.close(fd)
+			if not self._connected:
+				# Remaining requests were dropped with the socket
+				return
+		self._held = None
+
+	def _drop_interface(self, interface, error):
+		self.log(f"Dropping {interface.__class__.__name__}: {error}")
+		if interface in self._bound:
+			self._bound.remove(interface)
+		obj_id = interface.obj_id
+		if self._event_handlers.get(obj_id) is interface:
+			del self._event_handlers[obj_id]
+		interface.obj_id = None
+		# Higher ids may already have been sent and a gap in client ids
+		# is fatal. Use the id up with a sync, delete_id then frees it.
+		self.add_event_handler(obj_id, self._on_placeholder_done)
+		self._send_request(
+			self._pack_request(self.display.obj_id, 0, ArgUint32.create(obj_id)), tuple()
+		)
+		interface.on_unsupported()
+
+	def _on_placeholder_done(self, data):
+		pass
+
+	def _drop_held_requests(self):
+		if self._held is None:
+			return
+		for _, _, _, fds in self._held:
+			for fd in fds:
+				os.close(fd)
+		self._held = None
+
+	def flush(self):
+		# Sends as much of the queued data as possible without blocking.
+		# Returns True if there is nothing left to send.
+		queue = self._send_queue
+		try:
+			while queue:
+				data, fds = queue[0]
+				if not fds:
+					# Merge following chunks without fds into a single syscall
+					chunks = [data]
+					size = len(data)
+					for i in range(1, len(queue)):
+						_data, _fds = queue[i]
+						if _fds or size + len(_data) > 65536:
+							break
+						chunks.append(_data)
+						size += len(_data)
+					data = b''.join(chunks)
+					count = len(chunks)
+				else:
+					count = 1
+				try:
+					sent = self._send(data, fds)
+				except BlockingIOError:
+					break
+				for _ in range(count):
+					queue.popleft()
+				for fd in fds:
+					os.close(fd)
+				if sent != len(data):
+					queue.appendleft([data[sent:], tuple()])
+					break
+		except (BrokenPipeError, ConnectionResetError):
+			self._handle_disconnect()
+			return True
+		if not queue and self._send_watched:
+			self.remove_writer(self._fd)
+			self._send_watched = False
+		return not queue
+
+	def _send(self, data, fds, flags=socket.MSG_DONTWAIT):
+		if fds:
+			return self._socket.sendmsg([data], [
+				(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))
+			], flags)
+		return self._socket.sendmsg([data], [], flags)
+
+	def _queue(self, data, fds):
+		fds = tuple(os.dup(fd) for fd in fds) if fds else tuple()
+		self._send_queue.append([data, fds])
+		if self._send_watched or self._socket_source:
+			# A connection source flushes on its own
+			return
+		try:
+			self.add_writer(self._fd, self.flush)
+			self._send_watched = True
+		except NotImplementedError:
+			# Loop integration doesn't support writers, block instead
+			self._flush_blocking()
+
+	def _flush_blocking(self):
+		while self._send_queue:
+			data, fds = self._send_queue.popleft()
+			try:
+				sent = self._send(data, fds, flags=0)
+			except (BrokenPipeError, ConnectionResetError):
+				return self._handle_disconnect()
+			finally:
+				for fd in fds:
+					os.close(fd)
+			if sent != len(data):
+				self._send_queue.appendleft([data[sent:], tuple()])
 
 	def log(self, *msg):
 		name = f"[{repr(self)}]"
@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import sysconfig
+import threading
+from collections import defaultdict
+
+_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_LOOP_DIR = os.path.join(_PACKAGE_DIR, 'loop_integrations')
+_STDLIB_DIR = sysconfig.get_paths()['stdlib']
+
+class SamplingProfiler:
+	"""
+		Samples the stack of a single thread (usually the one running
+		the event loop) from a background thread every interval_in_ms.
+
+		Each sample is attributed to one of the following categories:
+		  idle          waiting for events inside a loop integration
+		  wl_framework  wire protocol parsing and dispatching
+		  callback      user code called by wl_framework
+		  other         anything not running below wl_framework
+
+		Results can be written as collapsed stacks which can be
+		turned into a flame graph by flamegraph.pl or speedscope.
+	"""
+	def __init__(self, thread_id=None, interval_in_ms=5):
+		if thread_id is None:
+			thread_id = threading.get_ident()
+		self.thread_id = thread_id
+		self.interval = interval_in_ms / 1000
+		self.stacks = defaultdict(int)
+		self.categories = defaultdict(int)
+		self.handlers = defaultdict(int)
+		self.samples = 0
+		self.started = None
+		self.stopped = None
+		self._running = False
+		self._thread = None
+		self._file_cache = dict()
+
+	def start(self):
+		if self._running:
+			return
+		self._running = True
+		self.started = time.monotonic()
+		self.stopped = None
+		self._thread = threading.Thread(
+			target=self._run, name='wl_framework-profiler', daemon=True
+		)
+		self._thread.start()
+
+	def stop(self):
+		if not self._running:
+			return
+		self._running = False
+		self._thread.join()
+		self._thread = None
+		self.stopped = time.monotonic()
+
+	@property
+	def running(self):
+		return self._running
+
+	def write(self, path):
+		with open(path, 'w') as f:
+			for stack, count in sorted(self.stacks.items()):
+				f.write(f"{stack} {count}\n")
+
+	def get_summary(self):
+		# Returns {category: share} and {handler: share}
+		total = self.samples or 1
+		return (
+			{k: v / total for k, v in self.categories.items()},
+			{k: v / total for k, v in self.handlers.items()}
+		)
+
+	def log_summary(self, out=print):
+		categories, handlers = self.get_summary()
+		out(f"{self.samples} samples every {self.interval * 1000:.1f} ms")
+		for name, share in sorted(categories.items(), key=lambda x: -x[1]):
+			out(f"  {name:14s} {share * 100:6.2f}%")
+		if handlers:
+			out("wl_framework entry points:")
+		for name, share in sorted(handlers.items(), key=lambda x: -x[1]):
+			out(f"  {name:40s} {share * 100:6.2f}%")
+
+	# Internal helpers
+	def _run(self):
+		interval = self.interval
+		next_sample = time.monotonic()
+		while self._running:
+			frame = sys._current_frames().get(self.thread_id)
+			if frame is None:
+				# Thread is gone
+				self._running = False
+				break
+			self._sample(frame)
+			del frame
+			next_sample += interval
+			delay = next_sample - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				next_sample = time.monotonic()
+
+	def _get_origin(self, filename):
+		# Returns 'loop', 'wl_framework', 'stdlib' or 'user'
+		origin = self._file_cache.get(filename)
+		if origin is None:
+			path = os.path.abspath(filename)
+			if path.startswith(_LOOP_DIR):
+				origin = 'loop'
+			elif path.startswith(_PACKAGE_DIR):
+				origin = 'wl_framework'
+			elif path.startswith(_STDLIB_DIR) or filename.startswith('<frozen'):
+				origin = 'stdlib'
+			else:
+				origin = 'user'
+			self._file_cache[filename] = origin
+		return origin
+
+	def _sample(self, frame):
+		names = list()
+		origins = list()
+		while frame is not None:
+			code = frame.f_code
+			name = getattr(code, 'co_qualname', code.co_name)
+			module = frame.f_globals.get('__name__', '?')
+			names.append(f"{module}:{name}")
+			origins.append(self._get_origin(code.co_filename))
+			frame = frame.f_back
+		names.reverse()
+		origins.reverse()
+
+		# Find the innermost wl_framework frame
+		innermost = None
+		for i in range(len(origins) - 1, -1, -1):
+			if origins[i] in ('loop', 'wl_framework'):
+				innermost = i
+				break
+
+		if innermost is None:
+			category = 'other'
+		elif 'user' in origins[innermost + 1:]:
+			category = 'callback'
+		elif origins[innermost] == 'loop':
+			category = 'idle'
+		else:
+			category = 'wl_framework'
+
+		if innermost is not None and category != 'idle':
+			# Attribute to the outermost non loop wl_framework frame
+			# beyond do_read, e.g. TopLevel.on_title or a timer callback.
+			for i in range(innermost + 1):
+				if origins[i] != 'wl_framework':
+					continue
+				handler = names[i].rsplit(':', 1)[1]
+				if handler.endswith((
+					'do_read', '_handle_event', '_notify_read_cb', '_notify_timer_cb'
+				)):
+					if i + 1 <= innermost and origins[i + 1] == 'wl_framework':
+						continue
+				self.handlers[handler] += 1
+				break
+
+		self.stacks[';'.join(names)] += 1
+		self.categories[category] += 1
+		self.samples += 1
@@ -0,0 +1,114 @@
+import gc
+import time
+import types
+import weakref
+from collections import defaultdict, deque
+
+class TrackedObject:
+	__slots__ = ('ref', 'obj_id', 'iface_name', 'type_name', 'created', 'destroyed')
+
+	def __init__(self, obj, created):
+		self.ref = weakref.ref(obj)
+		self.obj_id = obj.obj_id
+		self.iface_name = obj.iface_name
+		self.type_name = obj.__class__.__name__
+		self.created = created
+		self.destroyed = None
+
+	@property
+	def alive(self):
+		return self.ref() is not None
+
+	def __repr__(self):
+		state = 'live' if self.destroyed is None else 'deleted'
+		return f'<{self.type_name} {self.iface_name}-{self.obj_id} {state}>'
+
+class ObjectTracker:
+	"""
+		Keeps track of protocol objects known to a WaylandConnection.
+
+		Objects are registered once they get an event handler installed
+		and are considered destroyed once the compositor sends delete_id
+		for their object id. Server allocated objects never receive a
+		delete_id, those are considered destroyed once their event
+		handler is removed. Destroyed objects are only referenced weakly
+		so any object which is still alive after its delete_id is being
+		kept around by something else, usually a stale cache entry.
+
+		Enable it via WaylandConnection.enable_tracking().
+	"""
+	def __init__(self, history=1024):
+		self._live = dict()
+		self._deleted = deque(maxlen=history)
+		self._created = defaultdict(int)
+		self._destroyed = defaultdict(int)
+
+	# Connection hooks
+	def on_created(self, obj):
+		if obj.obj_id in self._live:
+			# Object id got reused without us seeing a delete_id,
+			# happens for server allocated ids.
+			self.on_deleted(obj.obj_id)
+		record = TrackedObject(obj, time.monotonic())
+		self._live[obj.obj_id] = record
+		self._created[record.iface_name] += 1
+
+	def on_deleted(self, obj_id):
+		record = self._live.pop(obj_id, None)
+		if record is None:
+			return
+		record.destroyed = time.monotonic()
+		self._destroyed[record.iface_name] += 1
+		self._deleted.append(record)
+
+	# Public API
+	def get_counts(self):
+		# Returns {iface_name: (live, created, destroyed)}
+		live = defaultdict(int)
+		for record in self._live.values():
+			live[record.iface_name] += 1
+		return {
+			name: (live[name], created, self._destroyed[name])
+			for name, created in self._created.items()
+		}
+
+	def get_live(self, iface_name=None):
+		return tuple(
+			record for record in self._live.values()
+			if iface_name is None or record.iface_name == iface_name
+		)
+
+	def get_leaks(self, collect=True):
+		# Objects which are still referenced after their delete_id
+		if collect:
+			gc.collect()
+		return tuple(record for record in self._deleted if record.alive)
+
+	def dump(self, out=print, collect=True):
+		now = time.monotonic()
+		counts = self.get_counts()
+		leaks = self.get_leaks(collect=collect)
+		out(f"{'Interface':40s} {'live':>8s} {'created':>8s} {'destroyed':>9s}")
+		for name in sorted(counts, key=str):
+			live, created, destroyed = counts[name]
+			out(f"{str(name):40s} {live:8d} {created:8d} {destroyed:9d}")
+		if not leaks:
+			return
+		out()
+		out(f"{len(leaks)} objects still referenced after delete_id:")
+		for record in leaks:
+			out(
+				f"  {record!r} created {now - record.created:.1f}s ago, " +
+				f"deleted {now - record.destroyed:.1f}s ago, " +
+				f"referenced by: {', '.join(self._get_referrers(record))}"
+			)
+
+	# Internal helpers
+	def _get_referrers(self, record):
+		obj = record.ref()
+		if obj is None:
+			return tuple()
+		return tuple(sorted(set(
+			type(x).__name__ for x in gc.get_referrers(obj)
+			if not isinstance(x, types.FrameType)
+		)))
@@ -0,0 +1,119 @@
+import sys
+import struct
+
+# Strings like app_ids and output names repeat a lot across objects and
+# events. Interned strings share memory and are compared by identity
+# first. Strings interned at runtime are released again once unused.
+intern_string = sys.intern
+
+# Sets of changed attribute names, there are only a few combinations
+_frozensets = dict()
+
+def intern_frozenset(values):
+	values = frozenset(values)
+	return _frozensets.setdefault(values, values)
+
+class FlagTable:
+	"""
+		Maps protocol enum values to names and creates FlagSets from
+		wl_array arguments. There is a single FlagSet instance for every
+		mask in use, shared by all objects having the same flags set.
+	"""
+	# Unknown values are kept unless strict, up to this bit width. Masks
+	# are also sent as u32 by wl_framework.fanout.
+	MAX_BITS = 32
+
+	def __init__(self, names, kind='value'):
+		# names is indexed by enum value, None for unused values
+		self.names = names
+		self.bits = {name: 1 << value for value, name in enumerate(names) if name}
+		self.kind = kind
+		self._sets = dict()
+		self.empty = self.get(0)
+
+	def bit(self, name):
+		return self.bits[name]
+
+	def get(self, mask):
+		flags = self._sets.get(mask)
+		if flags is None:
+			flags = self._sets[mask] = FlagSet(self, mask)
+		return flags
+
+	def from_array(self, data, strict=False):
+		# With strict unknown values are dropped and logged
+		mask = 0
+		for value, in struct.iter_unpack('=I', data):
+			if value >= self.MAX_BITS or (
+				strict and (value >= len(self.names) or not self.names[value])
+			):
+				print(f"Got invalid {self.kind}: {value}")
+				continue
+			mask |= 1 << value
+		return self.get(mask)
+
+	def get_names(self, mask):
+		names = list()
+		value = 0
+		while mask:
+			if mask & 1:
+				if value < len(self.names) and self.names[value]:
+					names.append(self.names[value])
+				else:
+					# Unknown values are kept as int like the protocol sent them
+					names.append(value)
+			mask >>= 1
+			value += 1
+		return tuple(names)
+
+class FlagSet:
+	"""
+		Immutable set of protocol flags backed by an int bitmask.
+
+		Membership tests by name are a dict lookup plus a bit test. For
+		backwards compatibility it behaves like the tuple of names which
+		was used before, that tuple is only built on demand.
+	"""
+	__slots__ = ('mask', '_table', '_names')
+
+	def __init__(self, table, mask):
+		self.mask = mask
+		self._table = table
+		self._names = None
+
+	@property
+	def names(self):
+		if self._names is None:
+			self._names = self._table.get_names(self.mask)
+		return self._names
+
+	def __contains__(self, name):
+		bit = self._table.bits.get(name)
+		if bit is None:
+			return isinstance(name, int) and bool(self.mask >> name & 1)
+		return bool(self.mask & bit)
+
+	def __bool__(self):
+		return self.mask != 0
+
+	def __len__(self):
+		return len(self.names)
+
+	def __iter__(self):
+		return iter(self.names)
+
+	def __getitem__(self, index):
+		return self.names[index]
+
+	def __eq__(self, other):
+		if isinstance(other, FlagSet):
+			return self.mask == other.mask and self._table is other._table
+		if isinstance(other, tuple):
+			return self.names == other
+		return NotImplemented
+
+	def __hash__(self):
+		return hash(self.names)
+
+	def __repr__(self):
+		return repr(self.names)
@@ -38,10 +38,48 @@ class ArgArray:
 class UnsupportedProtocolError(Exception):
 	pass
 
+class EventTable:
+	"""
+		Class level event table, replaces building a list of bound
+		methods for every single instance via add_event():
+
+			class Example(Interface):
+				__slots__ = ('state',)
+				_events = EventTable('on_first_event', 'on_second_event')
+
+		Event handlers are looked up by name on dispatch, so subclasses
+		can still override them.
+	"""
+	def __init__(self, *names):
+		self._names = names
+
+	def __get__(self, obj, objtype=None):
+		if obj is None:
+			return self
+		return _BoundEventTable(obj, self._names)
+
+class _BoundEventTable:
+	__slots__ = ('_obj', '_names')
+
+	def __init__(self, obj, names):
+		self._obj = obj
+		self._names = names
+
+	def __len__(self):
+		return len(self._names)
+
+	def __getitem__(self, index):
+		return getattr(self._obj, self._names[index])
+
 class Interface:
+	# Subclasses which are instantiated in large numbers define
+	# __slots__ as well and use an EventTable instead of add_event().
+	# Everything else gets a __dict__ as usual.
+	__slots__ = ('version', '_connection', 'obj_id', 'iface_name', 'global_id', '__weakref__')
+	_events = tuple()
+
 	def __init__(self, connection, obj_id=None):
 		self.version = 1
-		self._events = list()
 		self._connection = connection
 		self.obj_id = obj_id
 		self.iface_name = None
@@ -57,7 +95,7 @@ class Interface:
 		self.version = version
 
 	def add_event(self, callback):
-		self._events.append(callback)
+		self.__dict__.setdefault('_events', list()).append(callback)
 
 	def get_new_obj_id(self):
 		return self._connection.get_new_obj_id()
@@ -74,6 +112,28 @@ class Interface:
 	def on_destroyed(self):
 		pass
 
+	def on_unsupported(self):
+		# Called if a bind issued before the initial sync could not be
+		# satisfied because the server doesn't announce the global.
+		pass
+
+	def on_reconnected(self):
+		# Called after the object has been re-bound on a new connection
+		pass
+
+	def on_resynced(self):
+		# Called once the initial state of all re-bound objects arrived
+		pass
+
+	def _take_over(self, other):
+		# Continue as other which is a fresh instance of the same object
+		# received after a reconnect, keeps references held by users valid.
+		self._connection.remove_event_handler(other)
+		self.obj_id = other.obj_id
+		self.global_id = other.global_id
+		self.version = other.version
+		self._connection.add_event_handler(self)
+
 	def send_command(self, opcode, data=b'', fds=None):
 		self._connection.send_opcode(self.obj_id, opcode, data, fds)
 
@@ -84,5 +144,6 @@ class Interface:
 	def __repr__(self):
 		return f'<{self.iface_name}-{self.obj_id}>'
 
-	def __hash__(self):
-		return self.obj_id
+	# Not hashing by obj_id as it changes when re-binding after a
+	# reconnect, which would break sets and dicts holding interfaces.
+	__hash__ = object.__hash__
@@ -1,27 +1,40 @@
 #https://raw.githubusercontent.com/pop-os/cosmic-protocols/9c41b6b0ece1672c335e59bf670f8671ce66ed33/unstable/cosmic-workspace-unstable-v1.xml
 
+import array
+
 from .base import (
 	ArgString,
 	ArgUint32,
 	ArgArray,
+	EventTable,
 	Interface,
 	UnsupportedProtocolError
 )
+from ._intern import (
+	FlagTable,
+	intern_string,
+	intern_frozenset
+)
 
 class CosmicWorkspaceManager(Interface):
+	_events = EventTable(
+		'_on_workspace_group',
+		'_on_done',
+		'_on_finished'
+	)
 
 	def __init__(self, connection):
 		super().__init__(connection)
 		self.set_name('zcosmic_workspace_manager_v1')
 		self.set_version(1)
-		self._events = (
-			self._on_workspace_group,
-			self._on_done,
-			self._on_finished
-		)
 		self.bind()
 		self.groups = list()
 		self._new_groups = list()
+		self._stale_groups = None
+		self._groups_by_output = dict()
+		# Groups and workspaces with staged state, the whole
+		# protocol is double-buffered by the manager's done event.
+		self._dirty = list()
 
 	# Wayland events
 	def _on_workspace_group(self, data, fds):
@@ -29,9 +42,25 @@ class CosmicWorkspaceManager(Interface):
 		self.log(f"new workspace group; {obj_id}")
 		group = CosmicWorkspaceGroup(self._connection, obj_id=obj_id, parent=self)
 		self.groups.append(group)
-		self.on_group(group)
+		if self._stale_groups is None:
+			self.on_group(group)
 
 	def _on_done(self, data, fds):
+		dirty = self._dirty
+		self._dirty = list()
+		for obj in dirty:
+			obj.changes = obj._commit()
+		if self._stale_groups is not None:
+			self._resync()
+		else:
+			for obj in dirty:
+				if not obj.changes:
+					continue
+				if isinstance(obj, CosmicWorkspaceGroup):
+					if obj in self.groups:
+						self.on_group_changed(obj, obj.changes)
+				elif obj in obj._parent.workspaces:
+					self.on_workspace_changed(obj, obj.changes)
 		self.on_sync()
 
 	def _on_finished(self, data, fds):
@@ -44,6 +73,16 @@ class CosmicWorkspaceManager(Interface):
 	def stop(self):
 		self.send_command(1)
 
+	# Lookups
+	def get_group(self, output):
+		return self._groups_by_output.get(output)
+
+	def get_active_workspace(self, output):
+		group = self._groups_by_output.get(output)
+		if group is None:
+			return None
+		return group.active
+
 	# Custom events
 	def on_sync(self):
 		pass
@@ -51,63 +90,140 @@ class CosmicWorkspaceManager(Interface):
 	def on_group(self, group):
 		pass
 
+	def on_group_changed(self, group, changes):
+		# changes is a frozenset of attribute names, e.g. {'outputs'}
+		pass
+
 	def on_workspace(self, workspace):
 		pass
 
+	def on_workspace_changed(self, workspace, changes):
+		# changes is a frozenset of attribute names, e.g. {'states'}
+		pass
+
 	def on_workspace_removed(self, workspace):
 		pass
 
 	def on_finished(self):
 		pass
 
+	# Internal events
+	def on_reconnected(self):
+		# Hold back events until the first done event
+		self._stale_groups = self.groups
+		self.groups = list()
+
+	# Internal helpers
+	def _resync(self):
+		# Match fresh groups by their outputs and workspaces by
+		# their names. Only report workspaces which actually changed.
+		stale_groups = self._stale_groups
+		self._stale_groups = None
+		for index, group in enumerate(tuple(self.groups)):
+			old_group = None
+			for candidate in stale_groups:
+				if candidate.outputs == group.outputs:
+					old_group = candidate
+					break
+			if old_group is None:
+				self.on_group(group)
+				for workspace in group.workspaces:
+					self.on_workspace(workspace)
+				continue
+			stale_groups.remove(old_group)
+			old_group._take_over(group)
+			self.groups[index] = old_group
+
+			stale_workspaces = {x.name: x for x in old_group.workspaces}
+			old_group.workspaces = set()
+			for workspace in group.workspaces:
+				old = stale_workspaces.pop(workspace.name, None)
+				if old is None:
+					workspace._parent = old_group
+					old_group.workspaces.add(workspace)
+					self.on_workspace(workspace)
+					continue
+				changes = old._diff(workspace)
+				old._take_over(workspace)
+				old.changes = changes
+				old_group.workspaces.add(old)
+				if changes:
+					self.on_workspace_changed(old, changes)
+			for workspace in stale_workspaces.values():
+				self.on_workspace_removed(workspace)
+		for group in stale_groups:
+			for workspace in group.workspaces:
+				self.on_workspace_removed(workspace)
+		self._groups_by_output = dict()
+		for group in self.groups:
+			group._rebuild_index()
+			self._update_outputs(group, set())
+
+	def _update_outputs(self, group, old_outputs):
+		for output in old_outputs - group.outputs:
+			if self._groups_by_output.get(output) is group:
+				del self._groups_by_output[output]
+		for output in group.outputs - old_outputs:
+			self._groups_by_output[output] = group
+
 class CosmicWorkspaceGroup(Interface):
+	__slots__ = (
+		'_parent', 'outputs', 'workspaces', 'capabilities', 'changes', '_pending',
+		'active', '_active', '_by_coordinates'
+	)
+	_events = EventTable(
+		'on_capabilities',
+		'on_output_enter',
+		'on_output_leave',
+		'on_workspace',
+		'on_remove'
+	)
 
 	CAPS = (
 		None,
 		'create_workspace',
 	)
+	CAP_FLAGS = FlagTable(CAPS, 'capability')
 
 	def __init__(self, connection, obj_id, parent):
 		super().__init__(connection, obj_id=obj_id)
 		self._parent = parent
 		self.set_name('zcosmic_workspace_group_handle_v1')
 		self.set_version(parent.version)
-		self._events = (
-			self.on_capabilities,
-			self.on_output_enter,
-			self.on_output_leave,
-			self.on_workspace,
-			self.on_remove
-		)
 		connection.add_event_handler(self)
 
 		self.outputs = set()
 		self.workspaces = set()
-		self.capabilities = tuple()
+		self.capabilities = self.CAP_FLAGS.empty
+		self.changes = frozenset()
+		self._pending = None
+		# Most recently activated workspace, all active ones in _active
+		self.active = None
+		self._active = set()
+		self._by_coordinates = dict()
 
 	# Wayland events
 	def on_capabilities(self, data, fds):
-		_, data = ArgArray.parse(data)
-		self.capabilities = tuple(self._parse_capabilities(data))
-		#self.log(f"group capabilities: {', '.join(self.capabilities)}")
+		self._stage('capabilities', data)
 
 	def on_output_enter(self, data, fds):
 		_, output_id = ArgUint32.parse(data)
 		output = self._connection.display.get_output_by_id(output_id)
-		self.outputs.add(output)
+		self._get_pending_outputs().add(output)
 		#self.log(f"output enter for {output.name}")
 
 	def on_output_leave(self, data, fds):
 		_, output_id = ArgUint32.parse(data)
 		output = self._connection.display.get_output_by_id(output_id)
-		self.outputs.remove(output)
+		self._get_pending_outputs().discard(output)
 		#self.log(f"output leave for {output.name}")
 
 	def on_workspace(self, data, fds):
 		_, obj_id = ArgUint32.parse(data)
 		workspace = CosmicWorkspaceHandle(self._connection, obj_id=obj_id, parent=self)
 		self.workspaces.add(workspace)
-		self._parent.on_workspace(workspace)
+		if self._parent._stale_groups is None:
+			self._parent.on_workspace(workspace)
 
 	def on_remove(self, data, fds):
 		#self.log("group removed")
@@ -124,26 +240,110 @@ class CosmicWorkspaceGroup(Interface):
 		#self.log("Destroying")
 		self.send_command(1)
 
+	# Lookups
+	def get_workspace_at(self, *coordinates):
+		return self._by_coordinates.get(coordinates)
+
+	def get_neighbour(self, workspace, dx=0, dy=0):
+		# Workspace next to the given one, e.g. dx=-1 for the one to
+		# the left. Returns None at the edges or without coordinates.
+		coordinates = workspace.coordinates
+		if not coordinates or (dy and len(coordinates) < 2):
+			return None
+		if len(coordinates) == 1:
+			return self._by_coordinates.get((coordinates[0] + dx,))
+		return self._by_coordinates.get(
+			(coordinates[0] + dx, coordinates[1] + dy) + coordinates[2:]
+		)
+
 	# Internal helpers
-	def _parse_capabilities(self, capabilities):
-		while len(capabilities):
-			consumed, cap = ArgUint32.parse(capabilities)
-			capabilities = capabilities[consumed:]
-			try:
-				cap = self.CAPS[cap]
-				yield cap
-			except IndexError:
-				self.log(f"Got invalid capability: {cap}")
+	def _index_coordinates(self, workspace, old_coordinates):
+		if old_coordinates and self._by_coordinates.get(old_coordinates) is workspace:
+			del self._by_coordinates[old_coordinates]
+		if workspace.coordinates:
+			self._by_coordinates[workspace.coordinates] = workspace
+
+	def _index_state(self, workspace):
+		if 'active' in workspace.states:
+			self._active.add(workspace)
+			self.active = workspace
+			return
+		self._active.discard(workspace)
+		if self.active is workspace:
+			self.active = next(iter(self._active), None)
+
+	def _unindex(self, workspace):
+		if self._by_coordinates.get(workspace.coordinates) is workspace:
+			del self._by_coordinates[workspace.coordinates]
+		self._active.discard(workspace)
+		if self.active is workspace:
+			self.active = next(iter(self._active), None)
+
+	def _rebuild_index(self):
+		self._by_coordinates = dict()
+		self._active = set()
+		self.active = None
+		for workspace in self.workspaces:
+			self._index_coordinates(workspace, None)
+			self._index_state(workspace)
+
+	def _stage(self, field, value):
+		if self._pending is None:
+			self._pending = dict()
+			self._parent._dirty.append(self)
+		self._pending[field] = value
+
+	def _get_pending_outputs(self):
+		if self._pending is None or 'outputs' not in self._pending:
+			self._stage('outputs', set(self.outputs))
+		return self._pending['outputs']
+
+	def _commit(self):
+		changes = set()
+		pending = self._pending
+		self._pending = None
+		if pending is None:
+			return frozenset()
+		if 'capabilities' in pending:
+			_, data = ArgArray.parse(pending['capabilities'])
+			capabilities = self.CAP_FLAGS.from_array(data, strict=True)
+			if capabilities is not self.capabilities:
+				self.capabilities = capabilities
+				changes.add('capabilities')
+		if 'outputs' in pending and pending['outputs'] != self.outputs:
+			old_outputs = self.outputs
+			self.outputs = pending['outputs']
+			changes.add('outputs')
+			if self._parent._stale_groups is None:
+				self._parent._update_outputs(self, old_outputs)
+		return intern_frozenset(changes)
+
+	def _take_over(self, other):
+		super()._take_over(other)
+		self.outputs = other.outputs
+		self.capabilities = other.capabilities
 
 	# _internal_handlers
 	def _on_workspace_removed(self, workspace):
 		self.workspaces.remove(workspace)
-		self._parent.on_workspace_removed(workspace)
+		self._unindex(workspace)
+		# Don't let a pending commit add it back
+		workspace._pending = None
+		if self._parent._stale_groups is None:
+			self._parent.on_workspace_removed(workspace)
 
 	def __str__(self):
 		return f"Group-{self.obj_id}"
 
 class CosmicWorkspaceHandle(Interface):
+	__slots__ = ('_parent', 'name', 'coordinates', 'states', 'capabilities', 'changes', '_pending')
+	_events = EventTable(
+		'on_name',
+		'on_coordinates',
+		'on_state',
+		'on_capabilities',
+		'on_remove'
+	)
 
 	CAPS = (
 		None,
@@ -158,43 +358,34 @@ class CosmicWorkspaceHandle(Interface):
 		'hidden'
 	)
 
+	CAP_FLAGS = FlagTable(CAPS, 'capability')
+	STATE_FLAGS = FlagTable(STATES, 'state')
+
 	def __init__(self, connection, obj_id, parent):
 		super().__init__(connection, obj_id=obj_id)
 		self._parent = parent
 		self.set_name('zcosmic_workspace_handle_v1')
 		self.set_version(parent.version)
-		self._events = (
-			self.on_name,
-			self.on_coordinates,
-			self.on_state,
-			self.on_capabilities,
-			self.on_remove,
-		)
 		connection.add_event_handler(self)
 		self.name = None
-		self.states = tuple()
-		self.capabilities = tuple()
+		self.coordinates = tuple()
+		self.states = self.STATE_FLAGS.empty
+		self.capabilities = self.CAP_FLAGS.empty
+		self.changes = frozenset()
+		self._pending = None
 
 	# Wayland events
 	def on_name(self, data, fds):
-		_, name = ArgString.parse(data)
-		#self.log(f"workspace name: {name}")
-		self.name = name
+		self._stage('name', data)
 
 	def on_coordinates(self, data, fds):
-		# FIXME: some array
-		#self.log(f"workspace coordinates")
-		pass
+		self._stage('coordinates', data)
 
 	def on_state(self, data, fds):
-		_, data = ArgArray.parse(data)
-		self.states = tuple(self._parse_array(self.STATES, data))
-		#self.log("workspace state: " + ', '.join(self.states))
+		self._stage('states', data)
 
 	def on_capabilities(self, data, fs):
-		_, data = ArgArray.parse(data)
-		self.capabilities = tuple(self._parse_array(self.CAPS, data))
-		#self.log("workspace capabilities: " + ', '.join(self.capabilities))
+		self._stage('capabilities', data)
 
 	def on_remove(self, data, fds):
 		#self.log("workspace removed")
@@ -223,15 +414,58 @@ class CosmicWorkspaceHandle(Interface):
 		#self.log("removing workspace")
 
 	# Internal helpers
-	def _parse_array(self, states, array):
-		while array:
-			consumed, val = ArgUint32.parse(array)
-			array = array[consumed:]
-			try:
-				val = states[val]
-				yield val
-			except IndexError:
-				self.log(f"Got invalid {'capability' if states == self.CAPS  else 'state'}: {val}")
+	def _stage(self, field, data):
+		if self._pending is None:
+			self._pending = dict()
+			self._parent._parent._dirty.append(self)
+		self._pending[field] = data
+
+	def _commit(self):
+		changes = set()
+		pending = self._pending
+		self._pending = None
+		if pending is None:
+			return frozenset()
+		for field, data in pending.items():
+			if field == 'name':
+				_, value = ArgString.parse(data)
+				value = intern_string(value)
+			elif field == 'coordinates':
+				value = self._decode_coordinates(data)
+			else:
+				_, data = ArgArray.parse(data)
+				flags = self.STATE_FLAGS if field == 'states' else self.CAP_FLAGS
+				value = flags.from_array(data, strict=True)
+			old = getattr(self, field)
+			if value != old:
+				setattr(self, field, value)
+				changes.add(field)
+				if field == 'coordinates':
+					self._parent._index_coordinates(self, old)
+				elif field == 'states':
+					self._parent._index_state(self)
+		return intern_frozenset(changes)
+
+	def _decode_coordinates(self, data):
+		# Array of uint32, one entry per dimension of the group's layout
+		_, data = ArgArray.parse(data)
+		coordinates = array.array('I')
+		coordinates.frombytes(data[:len(data) - len(data) % coordinates.itemsize])
+		return tuple(coordinates)
+
+	def _diff(self, other):
+		changes = set()
+		for field in ('name', 'coordinates', 'states', 'capabilities'):
+			if getattr(self, field) != getattr(other, field):
+				changes.add(field)
+		return intern_frozenset(changes)
+
+	def _take_over(self, other):
+		super()._take_over(other)
+		self.name = other.name
+		self.coordinates = other.coordinates
+		self.states = other.states
+		self.capabilities = other.capabilities
 
 	def log(self, *msg):
 		if self.name is None:
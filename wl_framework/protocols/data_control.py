@@ -1,11 +1,15 @@
 # https://gitlab.freedesktop.org/wlroots/wlr-protocols/-/blob/master/unstable/wlr-data-control-unstable-v1.xml
 
 import os
+import time
 import errno
+import fcntl
+import tempfile
 
 from .base import (
 	ArgUint32,
 	ArgString,
+	EventTable,
 	Interface
 )
 
@@ -37,6 +41,12 @@ class DataControl(Interface):
 	def destroy(self):
 		self.send_command(2)
 
+	# Internal events
+	def on_reconnected(self):
+		# Sources and the device died with the old connection
+		self._sources.clear()
+		self._device = self.get_data_device(self._connection.display.seat)
+
 	# Custom device callbacks
 	def on_source_removed(self, source):
 		self.log(f"Source {source} has been cancelled")
@@ -143,7 +153,7 @@ class DataControlSource(Interface):
 		# TODO: attach send_fd to IO loop + add write callback
 		_, mime_type = ArgString.parse(data)
 		send_fd = fds.pop(0)
-		self.log(f"Should send data for fd {fd} with mimetype {mime_type}")
+		self.log(f"Should send data for fd {send_fd} with mimetype {mime_type}")
 		os.close(send_fd)
 
 	def on_cancelled(self, data, fds):
@@ -158,19 +168,45 @@ class DataControlSource(Interface):
 		self.send_command(1)
 		self._connection.remove_event_handler(self)
 
+class _Transfer:
+	__slots__ = (
+		'fd', 'mime_type', 'buffer', 'file', 'size', 'limit', 'spill_threshold',
+		'done_callback', 'chunk_callback', 'progress_callback', 'last_read', 'timer_id'
+	)
+
+	def __init__(self, fd, mime_type, done_callback, chunk_callback,
+		progress_callback, limit, spill_threshold
+	):
+		self.fd = fd
+		self.mime_type = mime_type
+		self.done_callback = done_callback
+		self.chunk_callback = chunk_callback
+		self.progress_callback = progress_callback
+		self.limit = limit
+		self.spill_threshold = spill_threshold
+		self.buffer = bytearray()
+		self.file = None
+		self.size = 0
+		self.last_read = time.monotonic()
+		self.timer_id = None
+
 class DataControlOffer(Interface):
+	__slots__ = ('_parent', '_mime_types', '_transfers', '_timeout')
+	_events = EventTable('on_offer')
+
+	# Bytes read per wakeup, the pipe is enlarged to match if possible
+	READ_SIZE = 1024 * 1024
 
 	def __init__(self, connection, obj_id, parent):
 		super().__init__(connection, obj_id=obj_id)
 		self.set_name('zwlr_data_control_offer_v1')
 		self.set_version(1)
-		self.add_event(self.on_offer)
 		connection.add_event_handler(self)
 
 		self._parent = parent
 		self._mime_types = dict()
+		# read fd -> _Transfer
 		self._transfers = dict()
-		self._fd_timers = dict()
 		self._timeout = 5
 
 	# Wayland events
@@ -180,21 +216,61 @@ class DataControlOffer(Interface):
 		#self._parent.on_offer_mime(self, mime_type)
 
 	# Wayland methods
-	def receive(self, mime_type, done_callback):
+	def receive(self, mime_type, done_callback, chunk_callback=None,
+		progress_callback=None, limit=None, spill_threshold=None
+	):
+		# done_callback(mime_type, data) is called once the source closed
+		# its end. data is
+		#   a bytearray      by default, handed over without a copy
+		#   a file object    positioned at the start once more than
+		#                    spill_threshold bytes were received, backed
+		#                    by a memfd. The caller has to close it.
+		#   the total size   with chunk_callback(mime_type, chunk), which
+		#                    gets every chunk as it arrives instead
+		#   None             if the transfer failed, timed out or
+		#                    exceeded limit bytes
+		# progress_callback(mime_type, received_bytes) is called after
+		# every chunk.
 		if mime_type not in self._mime_types:
 			raise KeyError(f"{mime_type} not part of offer")
 		pipe_read, pipe_write = os.pipe()
-		self.log(f"Requesting {mime_type} with read fd {pipe_read} and write_fd {pipe_write}")
+		# Only our end, sources expect a blocking pipe
+		os.set_blocking(pipe_read, False)
+		#self.log(f"Requesting {mime_type} with read fd {pipe_read} and write_fd {pipe_write}")
+		try:
+			# Fewer wakeups for large transfers, limited by
+			# /proc/sys/fs/pipe-max-size for unprivileged users
+			fcntl.fcntl(pipe_read, fcntl.F_SETPIPE_SZ, self.READ_SIZE)
+		except (AttributeError, OSError):
+			pass
 
 		# Send write end of pipe to remote peer and close it on our end
 		data = ArgString.create(mime_type)
 		self.send_command(0, data, (pipe_write,))
 		os.close(pipe_write)
 
+		transfer = _Transfer(
+			pipe_read, mime_type, done_callback, chunk_callback,
+			progress_callback, limit, spill_threshold
+		)
+		self._transfers[pipe_read] = transfer
+
 		# Wait for data to receive + create fallback timer to cancel for misbehaving peers
-		self._connection.add_reader(pipe_read, self._read_cb, pipe_read, mime_type, done_callback)
-		self._idle_timer_add(pipe_read, mime_type)
-		self._transfers[mime_type] = b''
+		self._connection.add_reader(pipe_read, self._read_cb, transfer)
+		transfer.timer_id = self._connection.add_timer(
+			self._timeout, self._read_idle, transfer, oneshot=True
+		)
+
+	def receive_fd(self, mime_type, fd):
+		# Lets the source write directly into fd, e.g. a pipe handed
+		# over by another process. fd is closed.
+		if mime_type not in self._mime_types:
+			os.close(fd)
+			raise KeyError(f"{mime_type} not part of offer")
+		try:
+			self.send_command(0, ArgString.create(mime_type), (fd,))
+		finally:
+			os.close(fd)
 
 	def destroy(self):
 		self._connection.remove_event_handler(self)
@@ -205,60 +281,86 @@ class DataControlOffer(Interface):
 		return tuple(self._mime_types.keys())
 
 	# Internal helpers
-	def _idle_timer_add(self, fd, mime_type):
-		if fd in self._fd_timers:
-			self.log(f"_idle_timer_add: timer for fd {fd} already active")
-			return
-		timer_id = self._connection.add_timer(self._timeout,
-			self._read_idle, fd, mime_type, oneshot=True
-		)
-		self._fd_timers[fd] = timer_id
-
-	def _idle_timer_remove(self, fd):
-		if fd in self._fd_timers:
-			timer_id = self._fd_timers[fd]
-			self._connection.remove_timer(timer_id)
-			del self._fd_timers[fd]
-
-	# Internal callbacks
-	def _read_cb(self, fd, mime_type, done_callback):
+	def _spill(self, transfer):
 		try:
-			data = os.read(fd, 1024 * 1024)
+			fd = os.memfd_create(f'clipboard-{transfer.mime_type}', os.MFD_CLOEXEC)
+			transfer.file = os.fdopen(fd, 'w+b')
+		except AttributeError:
+			transfer.file = tempfile.TemporaryFile()
+		transfer.file.write(transfer.buffer)
+		transfer.buffer = None
+
+	def _finish(self, transfer, failed=False):
+		del self._transfers[transfer.fd]
+		if transfer.timer_id is not None:
+			self._connection.remove_timer(transfer.timer_id)
+		self._connection.remove_reader(transfer.fd)
+		try:
+			os.close(transfer.fd)
 		except OSError as e:
-			data = None
 			if e.errno != errno.EBADF:
 				raise
-		self._idle_timer_remove(fd)
-		if data:
-			self._transfers[mime_type] += data
-			#self.log("Got data: {:.2f} KiB / {:.2f} KiB".format(
-			#	len(data) / 1024, len(self._transfers[mime_type]) / 1024
-			#))
-			self._idle_timer_add(fd, mime_type)
-			return
+		mime_type = transfer.mime_type
+		if failed:
+			if transfer.file is not None:
+				transfer.file.close()
+			result = None
+		elif transfer.chunk_callback is not None:
+			result = transfer.size
+		elif transfer.file is not None:
+			transfer.file.seek(0)
+			result = transfer.file
+		else:
+			result = transfer.buffer
+			self._mime_types[mime_type] = result
+		transfer.buffer = None
+		transfer.done_callback(mime_type, result)
 
-		self._mime_types[mime_type] = self._transfers[mime_type]
-		del self._transfers[mime_type]
-		self._connection.remove_reader(fd)
+	# Internal callbacks
+	def _read_cb(self, transfer):
 		try:
-			os.close(fd)
+			data = os.read(transfer.fd, self.READ_SIZE)
+		except BlockingIOError:
+			return
 		except OSError as e:
-			if e.errno != errno.EBADF:
-				raise
-		done_callback(mime_type, self._mime_types[mime_type])
+			self.log(f"Reading {transfer.mime_type} failed: {e}")
+			self._finish(transfer, failed=True)
+			return
+		if not data:
+			self._finish(transfer)
+			return
 
-	def _read_idle(self, fd, mime_type):
-		if fd not in self._fd_timers:
-			self.log(f"Late fd idle notification for for {fd}")
+		transfer.size += len(data)
+		transfer.last_read = time.monotonic()
+		if transfer.limit is not None and transfer.size > transfer.limit:
+			self.log(f"{transfer.mime_type} exceeds {transfer.limit} bytes. Closing.")
+			self._finish(transfer, failed=True)
+			return
+		if transfer.chunk_callback is not None:
+			transfer.chunk_callback(transfer.mime_type, data)
+		elif transfer.file is not None:
+			transfer.file.write(data)
+		else:
+			transfer.buffer += data
+			if transfer.spill_threshold is not None and transfer.size > transfer.spill_threshold:
+				self._spill(transfer)
+		if transfer.progress_callback is not None:
+			transfer.progress_callback(transfer.mime_type, transfer.size)
+
+	def _read_idle(self, transfer):
+		# The timer is only re-armed here instead of on every chunk
+		transfer.timer_id = None
+		if transfer.fd not in self._transfers:
+			self.log(f"Late fd idle notification for for {transfer.fd}")
+			return
+		idle = time.monotonic() - transfer.last_read
+		if idle < self._timeout:
+			transfer.timer_id = self._connection.add_timer(
+				self._timeout - idle, self._read_idle, transfer, oneshot=True
+			)
 			return
-		del self._fd_timers[fd]
 		self.log(
-			f"Pipe for {mime_type} with fd {fd} idle for {self._timeout} seconds. " +
+			f"Pipe for {transfer.mime_type} with fd {transfer.fd} idle for {self._timeout} seconds. " +
 			"Remote peer likes to block everybody else for no reason. Closing."
 		)
-		self._transfers[mime_type] = None
-		#self._transfers[mime_type] = b'BROKEN_APPLICATION'
-
-		# Let _read_cb deal with cleanup
-		os.close(fd)
-		self._read_cb(fd, mime_type)
+		self._finish(transfer, failed=True)
@@ -1,10 +1,19 @@
 # https://gitlab.freedesktop.org/wlroots/wlr-protocols/-/blob/master/unstable/wlr-foreign-toplevel-management-unstable-v1.xml
 
+from collections import defaultdict
+
 from .base import (
 	ArgUint32,
 	ArgString,
+	ArgArray,
+	EventTable,
 	Interface
 )
+from ._intern import (
+	FlagTable,
+	intern_string,
+	intern_frozenset
+)
 
 class ForeignTopLevel(Interface):
 
@@ -15,6 +24,13 @@ class ForeignTopLevel(Interface):
 		self.add_event(self.on_new_toplevel)
 		self.add_event(self.on_finished)
 		self.windows = dict()
+		self._trackers = list()
+		self._stale = None
+		# field -> (interval_in_s, debounce)
+		self._rate_limits = dict()
+		# (toplevel, field) -> [timer_id, pending]
+		self._deferred = dict()
+		self.suppressed_updates = defaultdict(int)
 		self.bind()
 
 	# Wayland events
@@ -22,7 +38,8 @@ class ForeignTopLevel(Interface):
 		_, obj_id = ArgUint32.parse(data)
 		toplevel = TopLevel(self._connection, obj_id=obj_id, parent=self)
 		self.windows[obj_id] = toplevel
-		self.on_toplevel_created(toplevel)
+		if self._stale is None:
+			self._notify_created(toplevel)
 
 	def on_finished(self, data, fds):
 		pass
@@ -31,6 +48,41 @@ class ForeignTopLevel(Interface):
 	def stop(self):
 		self.send_command(0)
 
+	# Trackers
+	def add_tracker(self, tracker):
+		# A tracker is notified about toplevel changes before the custom
+		# events below are called. It has to implement:
+		#   on_toplevel_created(toplevel)
+		#   on_toplevel_changed(toplevel, changes)
+		#   on_toplevel_closed(toplevel)
+		# Already known toplevels are reported as created right away.
+		self._trackers.append(tracker)
+		for toplevel in self.windows.values():
+			tracker.on_toplevel_created(toplevel)
+		return tracker
+
+	def remove_tracker(self, tracker):
+		self._trackers.remove(tracker)
+
+	# Rate limiting
+	def set_rate_limit(self, field, interval_in_s, debounce=False):
+		# Limits how often changes of a single field of a toplevel, e.g.
+		# 'title', are reported via on_toplevel_changed() and
+		# on_toplevel_synced(). The toplevel attributes and trackers are
+		# always updated right away, only the custom events are delayed.
+		#
+		# Throttling reports the first change right away and at most one
+		# more per interval. Debouncing reports a change once the field
+		# did not change for interval seconds. In both cases the latest
+		# change is always reported eventually. Changes which got merged
+		# into a later report are counted in suppressed_updates[field].
+		#
+		# An interval of None or 0 removes the limit.
+		if not interval_in_s:
+			self._rate_limits.pop(field, None)
+			return
+		self._rate_limits[field] = (interval_in_s, debounce)
+
 	# Custom events
 	def on_toplevel_created(self, toplevel):
 		pass
@@ -38,84 +90,236 @@ class ForeignTopLevel(Interface):
 	def on_toplevel_synced(self, toplevel):
 		pass
 
+	def on_toplevel_changed(self, toplevel, changes):
+		# changes is a frozenset of the attribute names which got
+		# modified by the last commit, e.g. {'title'}. Also available
+		# as toplevel.changes from within on_toplevel_synced().
+		pass
+
 	def on_toplevel_closed(self, toplevel):
 		pass
 
 	def on_toplevel_output_change(self, toplevel):
 		pass
 
+	# Internal events
+	def on_reconnected(self):
+		# Hold back events until the fresh state is complete
+		self._stale = self.windows
+		self.windows = dict()
+
+	def on_resynced(self):
+		# Match fresh toplevels against the ones known before the
+		# reconnect and only report actual differences.
+		stale = self._stale
+		self._stale = None
+		fresh = list(self.windows.values())
+		matched = list()
+		for key in (
+			lambda x: (x.app_id, x.title),
+			lambda x: x.app_id
+		):
+			candidates = dict()
+			for toplevel in stale.values():
+				candidates.setdefault(key(toplevel), list()).append(toplevel)
+			for toplevel in tuple(fresh):
+				old = candidates.get(key(toplevel))
+				if not old:
+					continue
+				old = old.pop(0)
+				del stale[old.obj_id]
+				fresh.remove(toplevel)
+				matched.append((old, toplevel))
+
+		for old, toplevel in matched:
+			changes = old._diff(toplevel)
+			del self.windows[toplevel.obj_id]
+			old._take_over(toplevel)
+			old.changes = changes
+			self.windows[old.obj_id] = old
+			if changes:
+				self._notify_changes(old, changes)
+		for toplevel in stale.values():
+			if self._deferred:
+				self._cancel_deferred(toplevel)
+			self._notify_closed(toplevel)
+		for toplevel in fresh:
+			self._notify_created(toplevel)
+			self.on_toplevel_synced(toplevel)
+
 	# Internal handlers
+	def _on_toplevel_committed(self, toplevel, changes):
+		if self._stale is not None:
+			return
+		if not self._rate_limits or not changes or toplevel._initial:
+			# The initial state of a toplevel is never held back
+			self._notify_changes(toplevel, changes)
+			return
+		for tracker in self._trackers:
+			tracker.on_toplevel_changed(toplevel, changes)
+		immediate = set(changes)
+		for field in changes & self._rate_limits.keys():
+			if self._defer(toplevel, field):
+				immediate.remove(field)
+		if immediate:
+			toplevel.changes = intern_frozenset(immediate)
+			self._notify_events(toplevel, toplevel.changes)
+
+	def _defer(self, toplevel, field):
+		# Returns True if reporting the change has been deferred
+		interval, debounce = self._rate_limits[field]
+		key = (toplevel, field)
+		entry = self._deferred.get(key)
+		if entry is None:
+			timer_id = self._connection.add_timer(
+				interval, self._on_rate_limit_timer, toplevel, field, oneshot=True
+			)
+			# Throttling reports the leading edge right away
+			self._deferred[key] = [timer_id, debounce]
+			return debounce
+		if entry[1]:
+			# Merged into an already pending report
+			self.suppressed_updates[field] += 1
+		entry[1] = True
+		if debounce:
+			self._connection.remove_timer(entry[0])
+			entry[0] = self._connection.add_timer(
+				interval, self._on_rate_limit_timer, toplevel, field, oneshot=True
+			)
+		return True
+
+	def _on_rate_limit_timer(self, toplevel, field):
+		key = (toplevel, field)
+		timer_id, pending = self._deferred.pop(key)
+		if not pending:
+			# Throttle window passed without further changes
+			return
+		interval, debounce = self._rate_limits.get(field, (None, True))
+		if not debounce:
+			# Keep throttling after the trailing report
+			timer_id = self._connection.add_timer(
+				interval, self._on_rate_limit_timer, toplevel, field, oneshot=True
+			)
+			self._deferred[key] = [timer_id, False]
+		if self._stale is None:
+			toplevel.changes = intern_frozenset((field,))
+			self._notify_events(toplevel, toplevel.changes)
+
+	def _cancel_deferred(self, toplevel):
+		for key in tuple(self._deferred):
+			if key[0] is toplevel:
+				timer_id, _ = self._deferred.pop(key)
+				self._connection.remove_timer(timer_id)
+
+	def _notify_created(self, toplevel):
+		for tracker in self._trackers:
+			tracker.on_toplevel_created(toplevel)
+		self.on_toplevel_created(toplevel)
+
+	def _notify_changes(self, toplevel, changes):
+		if changes:
+			for tracker in self._trackers:
+				tracker.on_toplevel_changed(toplevel, changes)
+		self._notify_events(toplevel, changes)
+
+	def _notify_events(self, toplevel, changes):
+		if 'outputs' in changes:
+			self.on_toplevel_output_change(toplevel)
+		if changes:
+			self.on_toplevel_changed(toplevel, changes)
+		self.on_toplevel_synced(toplevel)
+
 	def _on_toplevel_closed(self, toplevel):
 		del self.windows[toplevel.obj_id]
+		if self._deferred:
+			self._cancel_deferred(toplevel)
+		if self._stale is None:
+			self._notify_closed(toplevel)
+
+	def _notify_closed(self, toplevel):
+		for tracker in self._trackers:
+			tracker.on_toplevel_closed(toplevel)
 		self.on_toplevel_closed(toplevel)
 
 
 class TopLevel(Interface):
+	# __dict__ allows users to attach their own attributes
+	__slots__ = (
+		'_parent', 'title', 'app_id', 'states', 'parent', 'outputs', 'changes',
+		'_pending', '_pending_outputs', '_initial', '__dict__'
+	)
+	_events = EventTable(
+		'on_title',
+		'on_app_id',
+		'on_output_enter',
+		'on_output_leave',
+		'on_state',
+		'on_done',
+		'on_closed',
+		'on_parent'
+	)
 	STATES = (
 		'maximized',
 		'minimized',
 		'activated',
 		'fullscreen'
 	)
+	# states is a FlagSet, 'activated' in states is a cheap bit test
+	# and states.mask can be tested against STATE_FLAGS.bit('activated')
+	STATE_FLAGS = FlagTable(STATES, 'state')
 
 	def __init__(self, connection, obj_id, parent):
 		super().__init__(connection, obj_id=obj_id)
 		self.set_name('zwlr_foreign_toplevel_handle_v1')
 		self.set_version(parent.version)
-		self._events = (
-			self.on_title,
-			self.on_app_id,
-			self.on_output_enter,
-			self.on_output_leave,
-			self.on_state,
-			self.on_done,
-			self.on_closed,
-			self.on_parent
-		)
 		connection.add_event_handler(self)
 		self._parent = parent
 		self.title = ''
 		self.app_id = ''
-		self.states = tuple()
+		self.states = TopLevel.STATE_FLAGS.empty
 		self.parent = 0
-		self.outputs = set()
+		self.outputs = frozenset()
+		self.changes = frozenset()
+
+		# The protocol is double-buffered: events are staged as raw
+		# data and only decoded and applied once done arrives, so
+		# events superseded before done are never decoded.
+		# Allocated on demand as most toplevels are idle most of the time.
+		self._pending = None
+		self._pending_outputs = None
+		self._initial = True
 
 	# Wayland events
 	def on_title(self, data, fds):
-		_, data = ArgString.parse(data)
-		self.title = data
+		self._stage('title', data)
 
 	def on_app_id(self, data, fds):
-		_, data = ArgString.parse(data)
-		self.app_id = data
+		self._stage('app_id', data)
 
 	def on_output_enter(self, data, fds):
 		_, output_id = ArgUint32.parse(data)
 		output = self._connection.display.get_output_by_id(output_id)
-		self.outputs.add(output)
-		self._parent.on_toplevel_output_change(self)
+		self._get_pending_outputs().add(output)
 
 	def on_output_leave(self, data, fds):
 		_, output_id = ArgUint32.parse(data)
 		output = self._connection.display.get_output_by_id(output_id)
-		self.outputs.remove(output)
-		self._parent.on_toplevel_output_change(self)
+		self._get_pending_outputs().discard(output)
 
 	def on_state(self, data, fds):
-		consumed, state_count = ArgUint32.parse(data)
-		states = data[consumed:]
-		self.states = tuple(self._get_states(states))
+		self._stage('states', data)
 
 	def on_done(self, data, fds):
-		self._parent.on_toplevel_synced(self)
+		self.changes = self._commit()
+		self._parent._on_toplevel_committed(self, self.changes)
+		self._initial = False
 
 	def on_closed(self, data, fds):
 		self.destroy()
 		self._parent._on_toplevel_closed(self)
 
 	def on_parent(self, data, fds):
-		_, data = ArgUint32.parse(data)
-		self.parent = data
+		self._stage('parent', data)
 
 	# Wayland requests
 	def set_maximize(self, enabled=True):
@@ -155,13 +359,59 @@ class TopLevel(Interface):
 		else:
 			self.send_command(9)
 
+	# Internal helpers
+	def _stage(self, field, data):
+		if self._pending is None:
+			self._pending = dict()
+		self._pending[field] = data
+
+	def _get_pending_outputs(self):
+		if self._pending_outputs is None:
+			self._pending_outputs = set(self.outputs)
+		return self._pending_outputs
+
+	def _commit(self):
+		changes = set()
+		if self._pending is not None:
+			for field, data in self._pending.items():
+				value = getattr(self, '_decode_' + field)(data)
+				if value != getattr(self, field):
+					setattr(self, field, value)
+					changes.add(field)
+			self._pending = None
+		if self._pending_outputs is not None:
+			if self._pending_outputs != self.outputs:
+				self.outputs = frozenset(self._pending_outputs)
+				changes.add('outputs')
+			self._pending_outputs = None
+		return intern_frozenset(changes)
+
+	def _diff(self, other):
+		# parent is skipped as it refers to a transient object id
+		changes = set()
+		for field in ('title', 'app_id', 'states', 'outputs'):
+			if getattr(self, field) != getattr(other, field):
+				changes.add(field)
+		return intern_frozenset(changes)
+
+	def _take_over(self, other):
+		super()._take_over(other)
+		self.title = other.title
+		self.app_id = other.app_id
+		self.states = other.states
+		self.parent = other.parent
+		self.outputs = other.outputs
+
 	# Internal parsers
-	def _get_states(self, states):
-		while len(states):
-			consumed, state = ArgUint32.parse(states)
-			states = states[consumed:]
-			try:
-				state = TopLevel.STATES[state]
-			except IndexError:
-				pass
-			yield state
+	def _decode_title(self, data):
+		return intern_string(ArgString.parse(data)[1])
+
+	def _decode_app_id(self, data):
+		return intern_string(ArgString.parse(data)[1])
+
+	def _decode_states(self, data):
+		_, data = ArgArray.parse(data)
+		return TopLevel.STATE_FLAGS.from_array(data)
+
+	def _decode_parent(self, data):
+		return ArgUint32.parse(data)[1]
@@ -0,0 +1,248 @@
+# https://gitlab.freedesktop.org/wayland/wayland-protocols/-/blob/main/staging/ext-foreign-toplevel-list/ext-foreign-toplevel-list-v1.xml
+
+from .base import (
+	ArgUint32,
+	ArgString,
+	EventTable,
+	Interface
+)
+from ._intern import (
+	intern_string,
+	intern_frozenset
+)
+
+class ForeignTopLevelList(Interface):
+	# Read-only list of toplevels. Unlike the wlr protocol every toplevel
+	# carries a stable identifier which is never reused for a different
+	# toplevel, so it can be used as key for data attached to a window.
+	_events = EventTable(
+		'_on_toplevel',
+		'_on_finished'
+	)
+
+	def __init__(self, connection):
+		super().__init__(connection)
+		self.set_name('ext_foreign_toplevel_list_v1')
+		self.set_version(1)
+		self.windows = dict()
+		self.identifiers = dict()
+		self._trackers = list()
+		self._stale = None
+		self.bind()
+
+	# Wayland events
+	def _on_toplevel(self, data, fds):
+		_, obj_id = ArgUint32.parse(data)
+		toplevel = ListTopLevel(self._connection, obj_id=obj_id, parent=self)
+		self.windows[obj_id] = toplevel
+		if self._stale is None:
+			self._notify_created(toplevel)
+
+	def _on_finished(self, data, fds):
+		self.on_finished()
+
+	# Wayland requests
+	def stop(self):
+		# The server answers with finished, toplevels are still
+		# valid until they are closed or destroyed.
+		self.send_command(0)
+
+	def destroy(self):
+		self._connection.remove_event_handler(self)
+		self.send_command(1)
+
+	# Lookups
+	def get_by_identifier(self, identifier):
+		return self.identifiers.get(identifier)
+
+	# Trackers
+	def add_tracker(self, tracker):
+		# Same hooks as for ForeignTopLevel.add_tracker():
+		#   on_toplevel_created(toplevel)
+		#   on_toplevel_changed(toplevel, changes)
+		#   on_toplevel_closed(toplevel)
+		self._trackers.append(tracker)
+		for toplevel in self.windows.values():
+			tracker.on_toplevel_created(toplevel)
+		return tracker
+
+	def remove_tracker(self, tracker):
+		self._trackers.remove(tracker)
+
+	# Custom events
+	def on_toplevel_created(self, toplevel):
+		pass
+
+	def on_toplevel_synced(self, toplevel):
+		pass
+
+	def on_toplevel_changed(self, toplevel, changes):
+		# changes is a frozenset of attribute names, e.g. {'title'}
+		pass
+
+	def on_toplevel_closed(self, toplevel):
+		pass
+
+	def on_finished(self):
+		pass
+
+	# Internal events
+	def on_reconnected(self):
+		# Hold back events until the fresh state is complete
+		self._stale = self.windows
+		self.windows = dict()
+		self.identifiers = dict()
+
+	def on_resynced(self):
+		# Identifiers are only stable for the lifetime of a compositor,
+		# fall back to matching by app_id and title if they changed.
+		stale = self._stale
+		self._stale = None
+		fresh = list(self.windows.values())
+		matched = list()
+		for key in (
+			lambda x: x.identifier,
+			lambda x: (x.app_id, x.title),
+			lambda x: x.app_id
+		):
+			candidates = dict()
+			for toplevel in stale.values():
+				candidates.setdefault(key(toplevel), list()).append(toplevel)
+			for toplevel in tuple(fresh):
+				old = candidates.get(key(toplevel))
+				if not old:
+					continue
+				old = old.pop(0)
+				del stale[old.obj_id]
+				fresh.remove(toplevel)
+				matched.append((old, toplevel))
+
+		for old, toplevel in matched:
+			changes = old._diff(toplevel)
+			del self.windows[toplevel.obj_id]
+			old._take_over(toplevel)
+			old.changes = changes
+			self.windows[old.obj_id] = old
+			self.identifiers[old.identifier] = old
+			if changes:
+				self._notify_changes(old, changes)
+		for toplevel in stale.values():
+			self._notify_closed(toplevel)
+		for toplevel in fresh:
+			self._notify_created(toplevel)
+			self.on_toplevel_synced(toplevel)
+
+	# Internal handlers
+	def _on_toplevel_committed(self, toplevel, changes):
+		if 'identifier' in changes:
+			self.identifiers[toplevel.identifier] = toplevel
+		if self._stale is None:
+			self._notify_changes(toplevel, changes)
+
+	def _on_toplevel_closed(self, toplevel):
+		del self.windows[toplevel.obj_id]
+		if self.identifiers.get(toplevel.identifier) is toplevel:
+			del self.identifiers[toplevel.identifier]
+		if self._stale is None:
+			self._notify_closed(toplevel)
+
+	def _notify_created(self, toplevel):
+		for tracker in self._trackers:
+			tracker.on_toplevel_created(toplevel)
+		self.on_toplevel_created(toplevel)
+
+	def _notify_changes(self, toplevel, changes):
+		if changes:
+			for tracker in self._trackers:
+				tracker.on_toplevel_changed(toplevel, changes)
+			self.on_toplevel_changed(toplevel, changes)
+		self.on_toplevel_synced(toplevel)
+
+	def _notify_closed(self, toplevel):
+		for tracker in self._trackers:
+			tracker.on_toplevel_closed(toplevel)
+		self.on_toplevel_closed(toplevel)
+
+
+class ListTopLevel(Interface):
+	# __dict__ allows users to attach their own attributes
+	__slots__ = (
+		'_parent', 'title', 'app_id', 'identifier', 'changes',
+		'_pending', '__dict__'
+	)
+	_events = EventTable(
+		'on_closed',
+		'on_done',
+		'on_title',
+		'on_app_id',
+		'on_identifier'
+	)
+	FIELDS = ('title', 'app_id', 'identifier')
+
+	def __init__(self, connection, obj_id, parent):
+		super().__init__(connection, obj_id=obj_id)
+		self.set_name('ext_foreign_toplevel_handle_v1')
+		self.set_version(parent.version)
+		connection.add_event_handler(self)
+		self._parent = parent
+		self.title = ''
+		self.app_id = ''
+		# Sent once before the first done
+		self.identifier = None
+		self.changes = frozenset()
+		# Raw event data, decoded and applied on done
+		self._pending = None
+
+	# Wayland events
+	def on_closed(self, data, fds):
+		self.destroy()
+		self._parent._on_toplevel_closed(self)
+
+	def on_done(self, data, fds):
+		self.changes = self._commit()
+		self._parent._on_toplevel_committed(self, self.changes)
+
+	def on_title(self, data, fds):
+		self._stage('title', data)
+
+	def on_app_id(self, data, fds):
+		self._stage('app_id', data)
+
+	def on_identifier(self, data, fds):
+		self._stage('identifier', data)
+
+	# Wayland requests
+	def destroy(self):
+		self._connection.remove_event_handler(self)
+		self.send_command(0)
+
+	# Internal helpers
+	def _stage(self, field, data):
+		if self._pending is None:
+			self._pending = dict()
+		self._pending[field] = data
+
+	def _commit(self):
+		pending = self._pending
+		self._pending = None
+		if pending is None:
+			return frozenset()
+		changes = set()
+		for field, data in pending.items():
+			value = intern_string(ArgString.parse(data)[1])
+			if value != getattr(self, field):
+				setattr(self, field, value)
+				changes.add(field)
+		return intern_frozenset(changes)
+
+	def _diff(self, other):
+		changes = set()
+		for field in ListTopLevel.FIELDS:
+			if getattr(self, field) != getattr(other, field):
+				changes.add(field)
+		return intern_frozenset(changes)
+
+	def _take_over(self, other):
+		super()._take_over(other)
+		for field in ListTopLevel.FIELDS:
+			setattr(self, field, getattr(other, field))
@@ -34,6 +34,7 @@ class _IdleNotifyManager(Interface):
 				"IdleNotifyManager requires a subclass of IdleNotifier"
 			)
 		self._notifier_class = notifier_class
+		self._notifiers = list()
 
 	# Wayland requests
 	def destroy(self):
@@ -47,7 +48,22 @@ class _IdleNotifyManager(Interface):
 			idle_time_in_seconds,
 			supports_simulate=self.iface_name != 'ext_idle_notifier_v1'
 		)
+		self._notifiers.append((idle_notifier, seat))
+		self._request_idle_notifier(idle_notifier, seat)
+		return idle_notifier
 
+	# Internal events
+	def on_reconnected(self):
+		for idle_notifier, seat in tuple(self._notifiers):
+			if idle_notifier._destroyed:
+				self._notifiers.remove((idle_notifier, seat))
+				continue
+			idle_notifier.obj_id = self.get_new_obj_id()
+			self._connection.add_event_handler(idle_notifier)
+			self._request_idle_notifier(idle_notifier, seat)
+
+	# Internal helpers
+	def _request_idle_notifier(self, idle_notifier, seat):
 		data = ArgUint32.create(idle_notifier.obj_id)
 		if self.iface_name == 'ext_idle_notifier_v1':
 			data += ArgUint32.create(idle_notifier._idle_time_in_ms)
@@ -59,7 +75,6 @@ class _IdleNotifyManager(Interface):
 			data += ArgUint32.create(seat.obj_id)
 			data += ArgUint32.create(idle_notifier._idle_time_in_ms)
 			self.send_command(0, data)
-		return idle_notifier
 
 class IdleNotifier(Interface):
 	def __init__(self, connection, idle_time_in_s, supports_simulate=False):
@@ -67,6 +82,7 @@ class IdleNotifier(Interface):
 		self.obj_id = self.get_new_obj_id()
 		self._idle_time_in_ms = int(idle_time_in_s * 1000)
 		self.supports_simulate = supports_simulate
+		self._destroyed = False
 		self.add_event(self._on_idled)
 		self.add_event(self._on_resumed)
 		connection.add_event_handler(self)
@@ -87,6 +103,7 @@ class IdleNotifier(Interface):
 
 	# Wayland requests
 	def destroy(self):
+		self._destroyed = True
 		self.send_command(0)
 
 	def simulate_user_activity(self):
@@ -96,3 +113,24 @@ class IdleNotifier(Interface):
 				"protocol supports simulating user activity"
 			)
 		self.send_command(1)
+
+class IdleScheduler(IdleNotifier):
+	"""
+		Suspends all timers added with add_timer(..., idle_suspend=True)
+		while the user is idle and resumes them on activity.
+
+		Usage:
+			manager = IdleNotifyManager(connection, IdleScheduler)
+			manager.get_idle_notifier(idle_time_in_s, seat)
+
+		Subclasses overriding on_idle() or on_resume() have to call super().
+	"""
+	def on_idle(self):
+		self._connection.suspend_idle_timers()
+
+	def on_resume(self):
+		self._connection.resume_idle_timers()
+
+	def destroy(self):
+		super().destroy()
+		self._connection.resume_idle_timers()
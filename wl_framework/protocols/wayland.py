@@ -1,15 +1,17 @@
 # https://gitlab.freedesktop.org/wayland/wayland/-/blob/main/protocol/wayland.xml
 
 import struct
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 from .base import (
 	ArgInt32,
 	ArgUint32,
 	ArgString,
+	EventTable,
 	Interface,
 	UnsupportedProtocolError
 )
+from ._intern import intern_string, intern_frozenset
 
 class ArgDisplayError:
 	def parse(data):
@@ -45,6 +47,34 @@ class Display(Interface):
 		connection.add_event_handler(self)
 		self.registry = self.get_registry()
 		self.outputs = list()
+		self._outputs_by_id = dict()
+		self._outputs_by_global = dict()
+		self._outputs_by_name = dict()
+		self._output_listeners = list()
+		self._stale_outputs = list()
+		# Core globals are bound on first use
+		self._seat = None
+		self._seats = None
+		self._shm = None
+		self._output_plan = self.registry.bind_when_seen(
+			'wl_output', self._create_output,
+			self.on_output_new, self.on_output_del,
+			bind_all=True
+		)
+
+	def reset(self):
+		# Used by the connection after reconnecting
+		self._connection.add_event_handler(self)
+		registry = self.registry
+		self.registry = self.get_registry()
+		self.registry._take_listeners(registry)
+		if self._seats is not None:
+			self._seats.clear()
+		self._stale_outputs = self.outputs
+		self.outputs = list()
+		self._outputs_by_id.clear()
+		self._outputs_by_global.clear()
+		self._outputs_by_name.clear()
 
 	# Wayland events
 	def on_error(self, data, fds):
@@ -70,27 +100,162 @@ class Display(Interface):
 		self.send_command(1, data)
 		return registry
 
-	# Internal events
-	def on_initial_sync(self):
-		self.seat = Seat(self._connection)
-		self.shm = Shm(self._connection)
+	# Core globals
+	@property
+	def seat(self):
+		# The first seat announced by the server
+		if self._seat is None:
+			self._seat = Seat(self._connection)
+		return self._seat
+
+	@property
+	def seats(self):
+		# All seats, kept up to date when seats come and go
+		if self._seats is None:
+			self._seats = list()
+			self.registry.bind_when_seen(
+				'wl_seat', self._create_seat,
+				self._seats.append, self._seats.remove,
+				bind_all=True
+			)
+		return self._seats
+
+	@property
+	def shm(self):
+		if self._shm is None:
+			self._shm = Shm(self._connection)
+		return self._shm
+
+	def _create_seat(self, global_id):
+		return Seat(self._connection, global_id=global_id)
+
+	def _create_output(self, global_id):
+		return Output(self._connection, global_id)
 
+	# Internal events
 	def on_output_new(self, output):
 		self.outputs.append(output)
+		self._outputs_by_id[output.obj_id] = output
+		self._outputs_by_global[output.global_id] = output
 
-	def on_output_del(self, output_global):
-		for output in tuple(self.outputs):
-			if output.global_id == output_global:
-				self.outputs.remove(output)
-				self.log(f"Output {output_global} removed, {len(self.outputs)} outputs remaining")
-				return
-		self.log(f"We can't remove output {output_global} because we don't know anything about it")
+	def on_output_del(self, output):
+		if self._outputs_by_global.get(output.global_id) is not output:
+			self.log(f"We can't remove output {output.global_id} because we don't know anything about it")
+			return
+		del self._outputs_by_global[output.global_id]
+		self.outputs.remove(output)
+		del self._outputs_by_id[output.obj_id]
+		if self._outputs_by_name.get(output.name) is output:
+			del self._outputs_by_name[output.name]
+		self.log(f"Output {output.global_id} removed, {len(self.outputs)} outputs remaining")
+		if output._synced:
+			for listener in tuple(self._output_listeners):
+				listener.on_output_removed(output)
+
+	def on_output_done(self, output):
+		changes = output.changes
+		if self._stale_outputs and output.name is not None:
+			for stale in self._stale_outputs:
+				if stale.name == output.name:
+					self._stale_outputs.remove(stale)
+					changes = stale._diff(output)
+					stale._take_over(output)
+					stale.changes = changes
+					self.outputs[self.outputs.index(output)] = stale
+					self._outputs_by_id[stale.obj_id] = stale
+					self._outputs_by_global[stale.global_id] = stale
+					# Removal of the global has to report the stale output
+					self._output_plan.instances[stale.global_id] = stale
+					output = stale
+					break
+		if 'name' in changes or self._outputs_by_name.get(output.name) is not output:
+			self._outputs_by_name = {
+				x.name: x for x in self.outputs if x.name is not None
+			}
+		if not output._synced:
+			output._synced = True
+			for listener in tuple(self._output_listeners):
+				listener.on_output_added(output)
+		elif changes:
+			for listener in tuple(self._output_listeners):
+				listener.on_output_changed(output, changes)
+
+	def on_resynced(self):
+		for output in self._stale_outputs:
+			self.log(f"Output {output.name} vanished while reconnecting")
+			for listener in tuple(self._output_listeners):
+				listener.on_output_removed(output)
+		self._stale_outputs = list()
+
+	# Outputs
+	def add_output_listener(self, listener):
+		# A listener has to implement:
+		#   on_output_added(output)
+		#   on_output_changed(output, changes)
+		#   on_output_removed(output)
+		# Outputs are reported as added once their initial state
+		# is complete. Already known outputs are reported right away.
+		self._output_listeners.append(listener)
+		for output in self.outputs:
+			if output._synced:
+				listener.on_output_added(output)
+		return listener
+
+	def remove_output_listener(self, listener):
+		self._output_listeners.remove(listener)
 
 	def get_output_by_id(self, output_id):
-		for output in self.outputs:
-			if output.obj_id == output_id:
-				return output
-		raise Exception(f"No output with id {output_id}")
+		output = self._outputs_by_id.get(output_id)
+		if output is None:
+			raise Exception(f"No output with id {output_id}")
+		return output
+
+	def get_output_by_global_id(self, global_id):
+		# Returns None for unknown outputs
+		return self._outputs_by_global.get(global_id)
+
+	def get_output_by_name(self, name):
+		# Returns None for unknown outputs, e.g. 'HDMI-A-1'
+		return self._outputs_by_name.get(name)
+
+class _BindPlan:
+	# Binds globals of a single interface as soon as they are announced
+	def __init__(self, registry, iface_name, factory, on_bound, on_removed, bind_all):
+		self._connection = registry._connection
+		self.iface_name = iface_name
+		self.factory = factory
+		self.on_bound = on_bound
+		self.on_removed = on_removed
+		self.bind_all = bind_all
+		self.instances = dict()
+
+	def reset(self):
+		# Global ids of a previous connection are meaningless
+		self.instances.clear()
+
+	def on_global_added(self, global_id, version):
+		if self.instances and not self.bind_all:
+			return
+		interface = self.factory(global_id)
+		interface.global_id = global_id
+		self._connection.display.registry.do_bind(interface)
+		self._connection.add_event_handler(interface)
+		self.instances[global_id] = interface
+		if self.on_bound is not None:
+			self.on_bound(interface)
+
+	def on_global_removed(self, global_id):
+		interface = self.instances.pop(global_id, None)
+		if interface is None:
+			return
+		if self.on_removed is not None:
+			self.on_removed(interface)
+		if not self.instances and not self.bind_all:
+			# Continue with the next instance if there is one
+			registry = self._connection.display.registry
+			for global_id in registry.get_globals(self.iface_name):
+				self.on_global_added(global_id, registry.get_version(global_id))
+				break
 
 class Registry(Interface):
 	def __init__(self, connection, obj_id):
@@ -99,6 +264,8 @@ class Registry(Interface):
 		self.set_version(1)
 		self._registry = dict()
 		self._interfaces = defaultdict(list)
+		self._listeners = defaultdict(list)
+		self._plans = list()
 		self._initial_sync = False
 		self.add_event(self.on_global)
 		self.add_event(self.on_global_remove)
@@ -111,13 +278,10 @@ class Registry(Interface):
 			return
 		self._registry[global_id] = (name, version)
 		self._interfaces[name].append(global_id)
-
-		if name == 'wl_output':
-			#self.log("Creating new output:", global_id, "with server supported version", version)
-			output = Output(self._connection, global_id)
-			self.do_bind(output, ignore_sync=True)
-			self._connection.add_event_handler(output)
-			self._connection.display.on_output_new(output)
+		# Binds which waited for this global go first
+		self._connection.release_held_requests()
+		for on_added, _ in tuple(self._listeners.get(name, ())):
+			on_added(global_id, version)
 
 	def on_global_remove(self, data, fds):
 		_, global_id = ArgUint32.parse(data)
@@ -128,17 +292,35 @@ class Registry(Interface):
 		self._interfaces[name].remove(global_id)
 		if len(self._interfaces[name]) == 0:
 			del self._interfaces[name]
-
-		if name == 'wl_output':
-			self._connection.display.on_output_del(global_id)
+		for _, on_removed in tuple(self._listeners.get(name, ())):
+			if on_removed is not None:
+				on_removed(global_id)
 
 		# TODO: Should we notify all current instances of this global?
 
 	# Wayland methods
-	def do_bind(self, interface, ignore_sync=False):
-		if not self._initial_sync and not ignore_sync:
-			raise RuntimeError("Bind without waiting for full sync. Please bind in on_initial_sync().")
+	def do_bind(self, interface):
+		# Before the initial sync the global might just not have been
+		# announced yet. The object id is allocated right away so the
+		# interface can be used, the bind and all requests following
+		# it are held back until the global shows up.
+		if not self._initial_sync and interface.iface_name not in self._interfaces:
+			interface.obj_id = self.get_new_obj_id()
+			self._connection.hold_requests(interface)
+			return
+		# Resolve the global before allocating the id, an id which is
+		# never sent would leave a gap the server treats as fatal.
+		global_id, version = self._resolve_global(interface)
+		interface.obj_id = self.get_new_obj_id()
+		self.send_command(0, ArgRegistryBind.create(
+			global_id, interface.iface_name, version, interface.obj_id
+		))
+
+	def _create_bind(self, interface):
+		global_id, version = self._resolve_global(interface)
+		return ArgRegistryBind.create(global_id, interface.iface_name, version, interface.obj_id)
 
+	def _resolve_global(self, interface):
 		if interface.iface_name not in self._interfaces:
 			raise UnsupportedProtocolError(f"Interface {interface.iface_name} not supported by server")
 
@@ -153,29 +335,85 @@ class Registry(Interface):
 		version = min(interface.version, version)
 		if version < interface.version:
 			interface.set_version(version)
-		interface.obj_id = self.get_new_obj_id()
-		data = ArgRegistryBind.create(global_id, interface.iface_name, version, interface.obj_id)
-		self.send_command(0, data)
+		return global_id, version
+
+	# Listeners
+	def add_listener(self, iface_name, on_added, on_removed=None):
+		# on_added(global_id, version) is called for every global of
+		# iface_name, already announced ones are reported right away.
+		# on_removed(global_id) is called once a global is gone.
+		# Listeners are kept across reconnects, global ids are not.
+		self._listeners[iface_name].append((on_added, on_removed))
+		for global_id in tuple(self._interfaces.get(iface_name, ())):
+			on_added(global_id, self._registry[global_id][1])
+
+	def remove_listener(self, iface_name, on_added):
+		listeners = self._listeners[iface_name]
+		for entry in listeners:
+			if entry[0] == on_added:
+				listeners.remove(entry)
+				break
+		if not listeners:
+			del self._listeners[iface_name]
+
+	def bind_when_seen(self, iface_name, factory, on_bound=None, on_removed=None, bind_all=False):
+		# Binds the global as soon as it is announced, which may be well
+		# before the initial sync. factory(global_id) has to return a new
+		# unbound instance. With bind_all every instance is bound, e.g.
+		# for multiple seats, otherwise only one at a time.
+		# on_bound(interface) and on_removed(interface) are optional.
+		plan = _BindPlan(self, iface_name, factory, on_bound, on_removed, bind_all)
+		self._plans.append(plan)
+		self.add_listener(iface_name, plan.on_global_added, plan.on_global_removed)
+		return plan
+
+	def cancel_plan(self, plan):
+		# Already bound instances stay alive
+		self._plans.remove(plan)
+		self.remove_listener(plan.iface_name, plan.on_global_added)
+
+	def get_globals(self, iface_name):
+		return tuple(self._interfaces.get(iface_name, ()))
+
+	def get_version(self, global_id):
+		return self._registry[global_id][1]
 
 	# Internal events
 	def on_initial_sync(self):
 		self._initial_sync = True
+		# Fail binds of globals which never showed up
+		self._connection.release_held_requests()
+
+	# Internal helpers
+	def _take_listeners(self, other):
+		# Used by the display after reconnecting
+		self._listeners = other._listeners
+		self._plans = other._plans
+		for plan in self._plans:
+			plan.reset()
 
 class Seat(Interface):
-	def __init__(self, connection):
+	def __init__(self, connection, global_id=None):
+		# Without a global_id the first seat gets bound right
+		# away, otherwise binding is up to the caller.
 		super().__init__(connection)
 		self.set_name('wl_seat')
 		self.set_version(7)
 		self.add_event(self.on_capabilities)
 		self.add_event(self.on_name)
-		self.bind()
+		self.name = None
+		if global_id is None:
+			self.bind()
+		else:
+			self.global_id = global_id
 
 	# Wayland events
 	def on_capabilities(self, data, fds):
 		pass
 
 	def on_name(self, data, fds):
-		pass
+		_, name = ArgString.parse(data)
+		self.name = intern_string(name)
 
 	# Wayland methods
 	def get_keyboard(self):
@@ -189,80 +427,151 @@ class Seat(Interface):
 			return
 		pass
 
+class OutputMode(namedtuple('OutputMode', ('width', 'height', 'refresh', 'preferred'))):
+	__slots__ = ()
+
+	def __str__(self):
+		return f"{self.width}x{self.height}@{self.refresh / 1000:.3f}"
+
 class Output(Interface):
 	MODE_CURRENT = 1
 	MODE_PREFERRED = 2
+	_events = EventTable(
+		'on_geometry',
+		'on_mode',
+		'on_done',
+		'on_scale',
+		'on_name',
+		'on_description'
+	)
+	# Attributes which are reported in changes after a commit
+	FIELDS = (
+		'x', 'y', 'physical_width', 'physical_height', 'subpixel',
+		'make', 'model', 'transform', 'modes', 'mode', 'width', 'height',
+		'refresh', 'scale', 'name', 'description'
+	)
+
 	def __init__(self, connection, global_id):
 		super().__init__(connection)
 		self.set_name('wl_output')
 		self.set_version(4)
 		self.global_id = global_id
-		self._events = (
-			self.on_geometry,
-			self.on_mode,
-			self.on_done,
-			self.on_scale,
-			self.on_name,
-			self.on_description
-		)
+		self.x = 0
+		self.y = 0
+		self.physical_width = 0
+		self.physical_height = 0
+		self.subpixel = 0
+		self.make = None
+		self.model = None
+		self.transform = 0
+		self.modes = tuple()
+		self.mode = None
 		self.width = 0
 		self.height = 0
+		self.refresh = 0
+		self.scale = 1
 		self.name = None
 		self.description = None
+		self.changes = frozenset()
+		# Staged raw event data, decoded and applied on done
+		self._pending = dict()
+		self._synced = False
 
 	# Wayland events
 	def on_geometry(self, data, fds):
-		offset = 0
-		consumed, x = ArgInt32.parse(data[offset:])
-		offset += consumed
-		consumed, y = ArgInt32.parse(data[offset:])
-		offset += consumed
-		consumed, w_phys = ArgInt32.parse(data[offset:])
-		offset += consumed
-		consumed, h_phys = ArgInt32.parse(data[offset:])
-		offset += consumed
-		consumed, sub = ArgInt32.parse(data[offset:])
-		offset += consumed
-		consumed, make = ArgString.parse(data[offset:])
-		offset += consumed
-		consumed, model = ArgString.parse(data[offset:])
-		offset += consumed
-		_, transform = ArgInt32.parse(data[offset:])
-
-		#self.log(f"on_geometry (version {self.version}): pos {x}|{y} phys {w_phys}x{h_phys} subpixel align {sub} {model} from {make} with transform {transform}")
+		self._pending['geometry'] = data
 
 	def on_mode(self, data, fds):
-		_, _flags = ArgUint32.parse(data)
-		_, width = ArgInt32.parse(data[4:])
-		_, height = ArgInt32.parse(data[8:])
-		_, refresh = ArgInt32.parse(data[12:])
-		flags = list()
-		if _flags & Output.MODE_CURRENT:
-			self.width = width
-			self.height = height
-			flags.append('current')
-		if _flags & Output.MODE_PREFERRED:
-			flags.append('preferred')
-		flags = ', '.join(flags)
-		#self.log(f"on_mode (version {self.version}): {width}x{height}@{refresh} {flags}")
+		self._pending.setdefault('modes', list()).append(data)
+		if self.version < 2:
+			# wl_output v1 has no done event
+			self.on_done(b'', None)
 
 	def on_done(self, data, fds):
-		#self.log("on_done")
-		pass
+		self.changes = self._commit()
+		self._connection.display.on_output_done(self)
 
 	def on_scale(self, data, fds):
-		#self.log("on_scale")
-		pass
+		self._pending['scale'] = data
 
 	def on_name(self, data, fds):
-		_, name = ArgString.parse(data)
-		self.name = name
-		#self.log("Got name:", name)
+		self._pending['name'] = data
 
 	def on_description(self, data, fds):
-		_, description = ArgString.parse(data)
-		self.description = description
-		#self.log("Got description:", description)
+		self._pending['description'] = data
+
+	# Internal helpers
+	def _commit(self):
+		pending = self._pending
+		if not pending:
+			return frozenset()
+		values = dict()
+		if 'geometry' in pending:
+			values.update(self._decode_geometry(pending['geometry']))
+		if 'modes' in pending:
+			self._decode_modes(pending['modes'], values)
+		if 'scale' in pending:
+			_, values['scale'] = ArgInt32.parse(pending['scale'])
+		for field in ('name', 'description'):
+			if field in pending:
+				_, value = ArgString.parse(pending[field])
+				values[field] = intern_string(value)
+		pending.clear()
+		changes = set()
+		for field, value in values.items():
+			if value != getattr(self, field):
+				setattr(self, field, value)
+				changes.add(field)
+		return intern_frozenset(changes)
+
+	def _decode_geometry(self, data):
+		x, y, physical_width, physical_height, subpixel = struct.unpack('=5i', data[:20])
+		offset = 20
+		consumed, make = ArgString.parse(data[offset:])
+		offset += consumed
+		consumed, model = ArgString.parse(data[offset:])
+		offset += consumed
+		_, transform = ArgInt32.parse(data[offset:])
+		return {
+			'x': x,
+			'y': y,
+			'physical_width': physical_width,
+			'physical_height': physical_height,
+			'subpixel': subpixel,
+			'make': intern_string(make),
+			'model': intern_string(model),
+			'transform': transform
+		}
+
+	def _decode_modes(self, pending_modes, values):
+		# Compositors only send modes which changed, merge them into
+		# the known ones. The current mode is not listed in modes.
+		modes = {(x.width, x.height, x.refresh): x for x in self.modes}
+		current = None
+		for data in pending_modes:
+			flags, width, height, refresh = struct.unpack('=Iiii', data[:16])
+			mode = OutputMode(width, height, refresh, bool(flags & Output.MODE_PREFERRED))
+			modes[(width, height, refresh)] = mode
+			if flags & Output.MODE_CURRENT:
+				current = mode
+		values['modes'] = tuple(modes.values())
+		if current is not None:
+			values['mode'] = current
+			values['width'] = current.width
+			values['height'] = current.height
+			values['refresh'] = current.refresh
+
+	def _diff(self, other):
+		changes = set()
+		for field in Output.FIELDS:
+			if getattr(self, field) != getattr(other, field):
+				changes.add(field)
+		return intern_frozenset(changes)
+
+	def _take_over(self, other):
+		super()._take_over(other)
+		for field in Output.FIELDS:
+			setattr(self, field, getattr(other, field))
 
 	def __repr__(self):
 		return f'{self.__class__.__name__}-{self.global_id}'
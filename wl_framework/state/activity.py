@@ -0,0 +1,327 @@
+import os
+import time
+import mmap
+import struct
+from array import array
+from collections import defaultdict, OrderedDict
+
+# Row kinds
+CREATED = 0
+CLOSED = 1
+FOCUS = 2
+# No toplevel is activated anymore
+BLUR = 3
+TITLE = 4
+STATES = 5
+
+KINDS = ('created', 'closed', 'focus', 'blur', 'title', 'states')
+
+# (typecode, itemsize) of the columns in the order they are spilled
+_COLUMNS = (
+	('d', 8),	# timestamp
+	('Q', 8),	# app_id string id
+	('Q', 8),	# value string id, the title for TITLE rows
+	('I', 4),	# states bitmask
+	('B', 1),	# kind
+)
+_ROW_SIZE = sum(size for _, size in _COLUMNS)
+
+_STRING_SIZE = struct.Struct('=I')
+
+class _Chunk:
+	__slots__ = ('columns', 'mmap', 'view')
+
+	def __init__(self):
+		self.columns = tuple(array(typecode) for typecode, _ in _COLUMNS)
+		self.mmap = None
+		self.view = None
+
+	def __len__(self):
+		return len(self.columns[0])
+
+	def close(self):
+		if self.mmap is None:
+			return
+		for column in self.columns:
+			column.release()
+		self.view.release()
+		self.columns = None
+		self.view = None
+		self.mmap.close()
+		self.mmap = None
+
+class _StringTable:
+	# Id 0 is the empty string. Without fd strings are kept in memory.
+	# Otherwise they are appended to fd as u32 size + utf-8 and their id
+	# is the offset + 1, only the most recently used ones are cached. A
+	# string missing from the cache is stored again, that only costs disk.
+	def __init__(self, fd=None, cache_size=4096):
+		self._fd = fd
+		self._cache_size = cache_size
+		self._offset = 0
+		self._strings = ['']
+		# value -> id and id -> value, LRU ordered if spilling
+		self._ids = OrderedDict({'': 0})
+		self._values = OrderedDict()
+
+	def get_id(self, value):
+		if not value:
+			return 0
+		string_id = self._ids.get(value)
+		if string_id is not None:
+			if self._fd is not None:
+				self._ids.move_to_end(value)
+			return string_id
+		if self._fd is None:
+			string_id = len(self._strings)
+			self._strings.append(value)
+		else:
+			data = value.encode('utf-8')
+			os.pwrite(self._fd, _STRING_SIZE.pack(len(data)) + data, self._offset)
+			string_id = self._offset + 1
+			self._offset += _STRING_SIZE.size + len(data)
+			self._remember(self._values, string_id, value)
+		self._remember(self._ids, value, string_id)
+		return string_id
+
+	def get_value(self, string_id):
+		if not string_id:
+			return ''
+		if self._fd is None:
+			return self._strings[string_id]
+		value = self._values.get(string_id)
+		if value is not None:
+			self._values.move_to_end(string_id)
+			return value
+		offset = string_id - 1
+		size = _STRING_SIZE.unpack(os.pread(self._fd, _STRING_SIZE.size, offset))[0]
+		value = os.pread(self._fd, size, offset + _STRING_SIZE.size).decode('utf-8')
+		self._remember(self._values, string_id, value)
+		return value
+
+	def _remember(self, cache, key, value):
+		cache[key] = value
+		if self._fd is not None and len(cache) > self._cache_size:
+			cache.popitem(last=False)
+
+class ActivityRecorder:
+	"""
+		Compact append-only log of toplevel activity for reporting, e.g.
+		focus time per application over a week long session:
+
+			recorder = toplevels.add_tracker(ActivityRecorder('/tmp/activity'))
+			recorder.get_focus_seconds()
+			recorder.get_focus_seconds_by_bucket()
+
+		Rows are (timestamp, app_id, kind, states bitmask) plus the title
+		for title changes, stored column wise in arrays. Strings are
+		stored in a string table and referenced by id. Full chunks of
+		chunk_rows rows are written to spill_path and only mapped back
+		in, strings go to spill_path.strings with only the most recently
+		used string_cache ones kept in memory, so memory use stays flat.
+		Without spill_path everything is kept in memory.
+
+		Focus time is aggregated while recording into buckets of bucket
+		seconds of the clock, queries don't have to go over the rows.
+	"""
+	def __init__(self, spill_path=None, chunk_rows=65536, bucket=3600, clock=time.monotonic,
+		string_cache=4096
+	):
+		if spill_path is not None and (chunk_rows * _ROW_SIZE) % mmap.ALLOCATIONGRANULARITY:
+			raise ValueError(
+				f"chunk_rows has to be a multiple of {mmap.ALLOCATIONGRANULARITY} when spilling"
+			)
+		self._clock = clock
+		self._chunk_rows = chunk_rows
+		self._chunks = [_Chunk()]
+		self._spill_fd = None
+		self._strings_fd = None
+		if spill_path is not None:
+			flags = os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC
+			self._spill_fd = os.open(spill_path, flags, 0o600)
+			self._strings_fd = os.open(f'{spill_path}.strings', flags, 0o600)
+		self._strings = _StringTable(self._strings_fd, string_cache)
+		self.bucket = bucket
+		# (bucket start, app_id string id) -> focused seconds
+		self._focus = defaultdict(float)
+		self._active = None
+		self._active_app = 0
+		self._active_since = None
+
+	def __len__(self):
+		return (len(self._chunks) - 1) * self._chunk_rows + len(self._chunks[-1])
+
+	def close(self):
+		# Running iter_rows() generators stop at the next chunk
+		for chunk in self._chunks:
+			chunk.close()
+		self._chunks = [_Chunk()]
+		for fd in (self._spill_fd, self._strings_fd):
+			if fd is not None:
+				os.close(fd)
+		self._spill_fd = None
+		self._strings_fd = None
+		# Focus totals refer to ids of the dropped string table
+		self._strings = _StringTable()
+		self._focus.clear()
+		self._active = None
+		self._active_app = 0
+		self._active_since = None
+
+	# Public API
+	def get_focus_seconds(self, start=None, end=None):
+		# app_id -> focused seconds. start and end are timestamps of the
+		# clock and are rounded to buckets.
+		result = defaultdict(float)
+		for (bucket, app), seconds in self._iter_focus(start, end):
+			result[self._strings.get_value(app)] += seconds
+		return dict(result)
+
+	def get_focus_seconds_by_bucket(self, start=None, end=None):
+		# bucket start -> app_id -> focused seconds
+		result = dict()
+		for (bucket, app), seconds in self._iter_focus(start, end):
+			apps = result.setdefault(bucket, dict())
+			app = self._strings.get_value(app)
+			apps[app] = apps.get(app, 0) + seconds
+		return result
+
+	def iter_rows(self, start=None, end=None, kind=None):
+		# Yields (timestamp, app_id, kind, states, value) in order
+		get_value = self._strings.get_value
+		for chunk in self._chunks:
+			columns = chunk.columns
+			if columns is None:
+				# Closed in the meantime
+				return
+			if not len(columns[0]):
+				continue
+			if start is not None and columns[0][-1] < start:
+				continue
+			if end is not None and columns[0][0] >= end:
+				break
+			if chunk.mmap is not None:
+				# Copy spilled chunks, holding views of the mapping
+				# across yields would keep close() from unmapping it.
+				columns = tuple(array(column.format, column) for column in columns)
+			timestamps, apps, values, states, kinds = columns
+			for timestamp, app, value, mask, row_kind in zip(timestamps, apps, values, states, kinds):
+				if kind is not None and row_kind != kind:
+					continue
+				if start is not None and timestamp < start:
+					continue
+				if end is not None and timestamp >= end:
+					return
+				if chunk.columns is None:
+					return
+				yield (timestamp, get_value(app), row_kind, mask, get_value(value))
+
+	def get_title_history(self, app_id=None, start=None, end=None):
+		# Yields (timestamp, app_id, title)
+		for timestamp, app, _, _, title in self.iter_rows(start, end, TITLE):
+			if app_id is None or app == app_id:
+				yield (timestamp, app, title)
+
+	# Tracker hooks
+	def on_toplevel_created(self, toplevel):
+		self._append(toplevel, CREATED)
+		if self._is_active(toplevel):
+			self._focus_changed(toplevel)
+
+	def on_toplevel_changed(self, toplevel, changes):
+		if 'title' in changes:
+			self._append(toplevel, TITLE, toplevel.title)
+		if 'states' not in changes:
+			return
+		self._append(toplevel, STATES)
+		if self._is_active(toplevel):
+			if toplevel is not self._active:
+				self._focus_changed(toplevel)
+		elif toplevel is self._active:
+			self._focus_changed(None)
+
+	def on_toplevel_closed(self, toplevel):
+		if toplevel is self._active:
+			self._focus_changed(None)
+		self._append(toplevel, CLOSED)
+
+	# Internal helpers
+	def _is_active(self, toplevel):
+		states = getattr(toplevel, 'states', None)
+		return states is not None and 'activated' in states
+
+	def _focus_changed(self, toplevel):
+		now = self._clock()
+		if self._active is not None:
+			self._add_focus(self._focus, self._active_app, self._active_since, now)
+		self._active = toplevel
+		if toplevel is None:
+			self._append(None, BLUR, timestamp=now)
+			return
+		self._active_app = self._get_string_id(toplevel.app_id)
+		self._active_since = now
+		self._append(toplevel, FOCUS, timestamp=now)
+
+	def _add_focus(self, focus, app, since, until):
+		# Splits the interval at bucket boundaries
+		size = self.bucket
+		while since < until:
+			bucket = since - since % size
+			end = min(until, bucket + size)
+			focus[(bucket, app)] += end - since
+			since = end
+
+	def _iter_focus(self, start, end):
+		focus = self._focus
+		if self._active is not None:
+			# Include the still running interval
+			focus = defaultdict(float, focus)
+			self._add_focus(focus, self._active_app, self._active_since, self._clock())
+		for key, seconds in focus.items():
+			if start is not None and key[0] + self.bucket <= start:
+				continue
+			if end is not None and key[0] >= end:
+				continue
+			yield key, seconds
+
+	def _get_string_id(self, value):
+		return self._strings.get_id(value)
+
+	def _append(self, toplevel, kind, value=None, timestamp=None):
+		chunk = self._chunks[-1]
+		if len(chunk) == self._chunk_rows:
+			self._spill(chunk)
+			chunk = _Chunk()
+			self._chunks.append(chunk)
+		timestamps, apps, values, states, kinds = chunk.columns
+		timestamps.append(self._clock() if timestamp is None else timestamp)
+		if toplevel is None:
+			apps.append(0)
+			states.append(0)
+		else:
+			apps.append(self._get_string_id(toplevel.app_id))
+			mask = getattr(toplevel, 'states', None)
+			states.append(0 if mask is None else mask.mask)
+		values.append(self._get_string_id(value))
+		kinds.append(kind)
+
+	def _spill(self, chunk):
+		if self._spill_fd is None:
+			return
+		size = self._chunk_rows * _ROW_SIZE
+		offset = (len(self._chunks) - 1) * size
+		os.ftruncate(self._spill_fd, offset + size)
+		position = offset
+		for column in chunk.columns:
+			data = column.tobytes()
+			os.pwrite(self._spill_fd, data, position)
+			position += len(data)
+		chunk.mmap = mmap.mmap(self._spill_fd, size, prot=mmap.PROT_READ, offset=offset)
+		chunk.view = memoryview(chunk.mmap)
+		columns = list()
+		position = 0
+		for typecode, itemsize in _COLUMNS:
+			length = self._chunk_rows * itemsize
+			columns.append(chunk.view[position:position + length].cast(typecode))
+			position += length
+		chunk.columns = tuple(columns)
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+
+_MISSING = object()
+
+class IdentifierCache:
+	"""
+		Bounded LRU cache for data derived from toplevels like icons
+		or user settings, keyed by the stable identifier provided by
+		ext-foreign-toplevel-list:
+
+			cache = toplevels.add_tracker(IdentifierCache(256))
+			icon = cache.get_or_create(toplevel, load_icon)
+
+		Entries outlive the toplevel handle, so a handle recreated for
+		the same window finds its data again. If the identifier of a
+		known toplevel changes, e.g. after reconnecting to a restarted
+		compositor, its entry moves to the new identifier.
+
+		Keys are either toplevels or identifier strings. Toplevels which
+		didn't receive their identifier yet are never cached.
+	"""
+	def __init__(self, capacity=256):
+		if capacity < 1:
+			raise ValueError("capacity has to be at least 1")
+		self.capacity = capacity
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		# toplevel -> identifier as last seen
+		self._identifiers = dict()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, key):
+		return self._get_identifier(key) in self._entries
+
+	# Public API
+	def get(self, key, default=None):
+		identifier = self._get_identifier(key)
+		value = self._entries.get(identifier, _MISSING)
+		if value is _MISSING:
+			self.misses += 1
+			return default
+		self.hits += 1
+		self._entries.move_to_end(identifier)
+		return value
+
+	def set(self, key, value):
+		identifier = self._get_identifier(key)
+		if identifier is None:
+			return
+		self._entries[identifier] = value
+		self._entries.move_to_end(identifier)
+		if len(self._entries) > self.capacity:
+			self._entries.popitem(last=False)
+
+	def get_or_create(self, toplevel, factory):
+		# factory(toplevel) is only called on a cache miss
+		value = self.get(toplevel, _MISSING)
+		if value is _MISSING:
+			value = factory(toplevel)
+			self.set(toplevel, value)
+		return value
+
+	def discard(self, key):
+		self._entries.pop(self._get_identifier(key), None)
+
+	def clear(self):
+		self._entries.clear()
+
+	# Tracker hooks
+	def on_toplevel_created(self, toplevel):
+		if toplevel.identifier is not None:
+			self._identifiers[toplevel] = toplevel.identifier
+			if toplevel.identifier in self._entries:
+				self._entries.move_to_end(toplevel.identifier)
+
+	def on_toplevel_changed(self, toplevel, changes):
+		if 'identifier' not in changes:
+			return
+		old = self._identifiers.get(toplevel)
+		self._identifiers[toplevel] = toplevel.identifier
+		if old is None or old == toplevel.identifier:
+			return
+		value = self._entries.pop(old, _MISSING)
+		if value is not _MISSING:
+			self.set(toplevel.identifier, value)
+
+	def on_toplevel_closed(self, toplevel):
+		# The entry stays until evicted
+		self._identifiers.pop(toplevel, None)
+
+	# Internal helpers
+	def _get_identifier(self, key):
+		if isinstance(key, str):
+			return key
+		return key.identifier
@@ -0,0 +1,161 @@
+from collections import defaultdict
+
+_EMPTY = frozenset()
+
+class TopLevelIndex:
+	"""
+		Secondary indexes over ForeignTopLevel.windows which are kept
+		up to date from the toplevel event stream instead of scanning
+		all windows on every lookup:
+
+			index = toplevels.add_tracker(TopLevelIndex(toplevels))
+			index.get_by_app_id('firefox')
+			index.count('firefox', output)
+
+		Indexed are app_id, output, state and parent. Lookups return the
+		live internal sets, callers must not modify them and have to
+		copy them if they are going to close or otherwise change
+		toplevels while iterating.
+	"""
+	def __init__(self, manager):
+		self._manager = manager
+		self._app_ids = dict()
+		self._outputs = dict()
+		self._states = dict()
+		self._children = dict()
+		self._app_id_outputs = defaultdict(int)
+		# toplevel -> (app_id, outputs, states, parent) as last indexed
+		self._keys = dict()
+		# Children whose parent wasn't announced yet,
+		# parent object id -> children and child -> parent object id
+		self._orphans = dict()
+		self._orphan_parents = dict()
+		# child -> object id of its closed parent, the id may get reused
+		self._closed_parents = dict()
+
+	def __len__(self):
+		return len(self._keys)
+
+	# Public API
+	def get_by_app_id(self, app_id):
+		return self._app_ids.get(app_id, _EMPTY)
+
+	def get_by_output(self, output):
+		return self._outputs.get(output, _EMPTY)
+
+	def get_by_state(self, state):
+		return self._states.get(state, _EMPTY)
+
+	def get_children(self, toplevel):
+		return self._children.get(toplevel, _EMPTY)
+
+	def get_app_ids(self):
+		return self._app_ids.keys()
+
+	def count(self, app_id, output=None):
+		if output is None:
+			return len(self._app_ids.get(app_id, _EMPTY))
+		return self._app_id_outputs.get((app_id, output), 0)
+
+	# Tracker hooks
+	def on_toplevel_created(self, toplevel):
+		keys = self._get_keys(toplevel)
+		self._keys[toplevel] = keys
+		self._link(toplevel, keys)
+		orphans = self._orphans.pop(toplevel.obj_id, None)
+		if orphans:
+			# Children announced before their parent
+			for child in tuple(orphans):
+				self.on_toplevel_changed(child, frozenset(('parent',)))
+
+	def on_toplevel_changed(self, toplevel, changes):
+		old = self._keys.get(toplevel)
+		if old is None:
+			self.on_toplevel_created(toplevel)
+			return
+		if 'parent' in changes:
+			self._closed_parents.pop(toplevel, None)
+		new = self._get_keys(toplevel)
+		if new == old and self._orphan_parents.get(toplevel) == self._get_orphan_parent(toplevel, new):
+			return
+		self._unlink(toplevel, old)
+		self._keys[toplevel] = new
+		self._link(toplevel, new)
+
+	def on_toplevel_closed(self, toplevel):
+		keys = self._keys.pop(toplevel, None)
+		if keys is None:
+			return
+		self._unlink(toplevel, keys)
+		self._closed_parents.pop(toplevel, None)
+		children = self._children.pop(toplevel, None)
+		if children:
+			# Don't keep the closed parent alive via its children's keys
+			for child in children:
+				app_id, outputs, states, _ = self._keys[child]
+				self._keys[child] = (app_id, outputs, states, None)
+				self._closed_parents[child] = toplevel.obj_id
+
+	# Internal helpers
+	def _get_keys(self, toplevel):
+		# The parent is resolved to its TopLevel as its object id
+		# changes when the connection gets re-established.
+		parent = None
+		if toplevel.parent and self._closed_parents.get(toplevel) != toplevel.parent:
+			parent = self._manager.windows.get(toplevel.parent)
+		return (
+			toplevel.app_id,
+			frozenset(toplevel.outputs),
+			frozenset(toplevel.states),
+			parent
+		)
+
+	def _link(self, toplevel, keys):
+		app_id, outputs, states, parent = keys
+		self._app_ids.setdefault(app_id, set()).add(toplevel)
+		for output in outputs:
+			self._outputs.setdefault(output, set()).add(toplevel)
+			self._app_id_outputs[(app_id, output)] += 1
+		for state in states:
+			self._states.setdefault(state, set()).add(toplevel)
+		if parent is not None:
+			self._children.setdefault(parent, set()).add(toplevel)
+		else:
+			parent_id = self._get_orphan_parent(toplevel, keys)
+			if parent_id is not None:
+				self._orphans.setdefault(parent_id, set()).add(toplevel)
+				self._orphan_parents[toplevel] = parent_id
+
+	def _unlink(self, toplevel, keys):
+		app_id, outputs, states, parent = keys
+		self._discard(self._app_ids, app_id, toplevel)
+		for output in outputs:
+			self._discard(self._outputs, output, toplevel)
+			key = (app_id, output)
+			self._app_id_outputs[key] -= 1
+			if not self._app_id_outputs[key]:
+				del self._app_id_outputs[key]
+		for state in states:
+			self._discard(self._states, state, toplevel)
+		if parent is not None:
+			# The parent might have been closed already
+			self._discard(self._children, parent, toplevel)
+		parent_id = self._orphan_parents.pop(toplevel, None)
+		if parent_id is not None:
+			self._discard(self._orphans, parent_id, toplevel)
+
+	def _get_orphan_parent(self, toplevel, keys):
+		# Object id of a parent which wasn't announced yet
+		if keys[3] is not None or not toplevel.parent:
+			return None
+		if self._closed_parents.get(toplevel) == toplevel.parent:
+			return None
+		return toplevel.parent
+
+	def _discard(self, table, key, toplevel):
+		bucket = table.get(key)
+		if bucket is None:
+			return
+		bucket.discard(toplevel)
+		if not bucket:
+			del table[key]
@@ -0,0 +1,114 @@
+import time
+from itertools import islice
+from collections import OrderedDict
+
+class FocusHistory:
+	"""
+		Most recently used order of toplevels, globally and per output,
+		maintained from activated state transitions:
+
+			history = toplevels.add_tracker(FocusHistory())
+			for toplevel in history.get_recent(5):
+				...
+
+		All updates are O(1). Toplevels which never got activated are
+		ordered as least recently used. A toplevel entering an output
+		while not being activated is ordered as least recently used on
+		that output as its actual position would require a scan.
+	"""
+	def __init__(self, clock=time.monotonic):
+		self._clock = clock
+		# Both map toplevel -> last activated timestamp or None,
+		# ordered from least to most recently activated.
+		self._recent = OrderedDict()
+		self._outputs = dict()
+		self._toplevel_outputs = dict()
+		self._active = None
+
+	def __len__(self):
+		return len(self._recent)
+
+	# Public API
+	def get_recent(self, count=None, output=None):
+		# Iterates from the most recently activated toplevel backwards
+		if output is None:
+			recent = self._recent
+		else:
+			recent = self._outputs.get(output)
+			if recent is None:
+				return iter(tuple())
+		return islice(reversed(recent), count)
+
+	def get_last_activated(self, toplevel):
+		# Timestamp of the last activation, None if never activated
+		return self._recent.get(toplevel)
+
+	def get_active(self):
+		return self._active
+
+	def get_previous(self, output=None):
+		# The toplevel to switch to for a quick Alt-Tab
+		for toplevel in self.get_recent(output=output):
+			if toplevel is not self._active:
+				return toplevel
+		return None
+
+	# Tracker hooks
+	def on_toplevel_created(self, toplevel):
+		self._recent[toplevel] = None
+		self._recent.move_to_end(toplevel, last=False)
+		self._update_outputs(toplevel)
+		if 'activated' in toplevel.states:
+			self._activate(toplevel)
+
+	def on_toplevel_changed(self, toplevel, changes):
+		if toplevel not in self._recent:
+			self.on_toplevel_created(toplevel)
+			return
+		if 'outputs' in changes:
+			self._update_outputs(toplevel)
+		if 'states' not in changes:
+			return
+		if 'activated' in toplevel.states:
+			if toplevel is not self._active:
+				self._activate(toplevel)
+		elif toplevel is self._active:
+			self._active = None
+
+	def on_toplevel_closed(self, toplevel):
+		if toplevel not in self._recent:
+			return
+		del self._recent[toplevel]
+		for output in self._toplevel_outputs.pop(toplevel):
+			self._remove_from_output(output, toplevel)
+		if toplevel is self._active:
+			self._active = None
+
+	# Internal helpers
+	def _activate(self, toplevel):
+		now = self._clock()
+		self._active = toplevel
+		self._recent[toplevel] = now
+		self._recent.move_to_end(toplevel)
+		for output in self._toplevel_outputs[toplevel]:
+			recent = self._outputs[output]
+			recent[toplevel] = now
+			recent.move_to_end(toplevel)
+
+	def _update_outputs(self, toplevel):
+		old = self._toplevel_outputs.get(toplevel, frozenset())
+		new = frozenset(toplevel.outputs)
+		self._toplevel_outputs[toplevel] = new
+		for output in old - new:
+			self._remove_from_output(output, toplevel)
+		for output in new - old:
+			recent = self._outputs.setdefault(output, OrderedDict())
+			recent[toplevel] = self._recent[toplevel]
+			if toplevel is not self._active:
+				recent.move_to_end(toplevel, last=False)
+
+	def _remove_from_output(self, output, toplevel):
+		recent = self._outputs[output]
+		del recent[toplevel]
+		if not recent:
+			del self._outputs[output]
@@ -0,0 +1,145 @@
+import math
+import heapq
+
+_EMPTY = frozenset()
+
+def _trigrams(text):
+	return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _short_grams(text):
+	# All substrings of one and two characters
+	grams = set(text)
+	grams.update(text[i:i + 2] for i in range(len(text) - 1))
+	return grams
+
+class TitleSearchIndex:
+	"""
+		Case insensitive trigram index over toplevel titles and app_ids,
+		kept up to date from the toplevel event stream:
+
+			index = toplevels.add_tracker(TitleSearchIndex())
+			index.search('fire')
+			index.fuzzy_search('firfox')
+
+		Texts are padded with a marker on both ends so texts and queries
+		shorter than three characters still map to trigrams and matches
+		at the start of a text can be ranked higher. Substrings of one
+		and two characters are indexed separately so short queries are
+		lookups as well, they don't take part in fuzzy_search().
+	"""
+	MARK = '\x00'
+
+	def __init__(self):
+		self._postings = dict()
+		self._short_postings = dict()
+		# toplevel -> (title, app_id, trigrams, short grams) as last indexed
+		self._texts = dict()
+
+	def __len__(self):
+		return len(self._texts)
+
+	# Public API
+	def search(self, query, limit=None):
+		# Returns toplevels with query being a substring of their title
+		# or app_id. Ranked by exact match, prefix match, word start
+		# and match position.
+		query = query.lower()
+		if not query:
+			return list()
+		ranked = list()
+		for toplevel in self._get_candidates(query):
+			title, app_id, _, _ = self._texts[toplevel]
+			rank = min(self._rank(title, query), self._rank(app_id, query) + 1)
+			if rank < math.inf:
+				ranked.append((rank, len(title), toplevel.obj_id, toplevel))
+		if limit is None:
+			ranked.sort()
+		else:
+			ranked = heapq.nsmallest(limit, ranked)
+		return [x[-1] for x in ranked]
+
+	def fuzzy_search(self, query, limit=10, threshold=0.3):
+		# Returns toplevels sharing at least threshold of the query's
+		# trigrams, ordered by similarity. Tolerates typos.
+		if not query:
+			return list()
+		query = self.MARK + query.lower() + self.MARK
+		grams = _trigrams(query)
+		hits = dict()
+		for gram in grams:
+			for toplevel in self._postings.get(gram, _EMPTY):
+				hits[toplevel] = hits.get(toplevel, 0) + 1
+		ranked = list()
+		for toplevel, count in hits.items():
+			if count / len(grams) < threshold:
+				continue
+			# Dice coefficient, prefers texts without much else in them
+			score = 2 * count / (len(grams) + len(self._texts[toplevel][2]))
+			ranked.append((-score, toplevel.obj_id, toplevel))
+		return [x[-1] for x in heapq.nsmallest(limit, ranked)]
+
+	# Tracker hooks
+	def on_toplevel_created(self, toplevel):
+		self._index(toplevel)
+
+	def on_toplevel_changed(self, toplevel, changes):
+		if 'title' in changes or 'app_id' in changes:
+			self._index(toplevel)
+
+	def on_toplevel_closed(self, toplevel):
+		entry = self._texts.pop(toplevel, None)
+		if entry is not None:
+			self._unlink(self._postings, toplevel, entry[2])
+			self._unlink(self._short_postings, toplevel, entry[3])
+
+	# Internal helpers
+	def _index(self, toplevel):
+		title = toplevel.title.lower()
+		app_id = toplevel.app_id.lower()
+		grams = _trigrams(self.MARK + title + self.MARK)
+		grams |= _trigrams(self.MARK + app_id + self.MARK)
+		short_grams = _short_grams(title) | _short_grams(app_id)
+		old = self._texts.get(toplevel)
+		self._texts[toplevel] = (title, app_id, grams, short_grams)
+		# Only touch the postings which actually changed
+		self._update(self._postings, toplevel, _EMPTY if old is None else old[2], grams)
+		self._update(self._short_postings, toplevel, _EMPTY if old is None else old[3], short_grams)
+
+	def _update(self, postings, toplevel, old_grams, grams):
+		self._unlink(postings, toplevel, old_grams - grams)
+		for gram in grams - old_grams:
+			postings.setdefault(gram, set()).add(toplevel)
+
+	def _unlink(self, postings, toplevel, grams):
+		for gram in grams:
+			bucket = postings[gram]
+			bucket.discard(toplevel)
+			if not bucket:
+				del postings[gram]
+
+	def _get_candidates(self, query):
+		if len(query) < 3:
+			return self._short_postings.get(query, _EMPTY)
+		# Intersect starting with the smallest posting list
+		buckets = sorted(
+			(self._postings.get(gram, _EMPTY) for gram in _trigrams(query)),
+			key=len
+		)
+		candidates = set(buckets[0])
+		for bucket in buckets[1:]:
+			if not candidates:
+				break
+			candidates &= bucket
+		return candidates
+
+	def _rank(self, text, query):
+		pos = text.find(query)
+		if pos < 0:
+			return math.inf
+		if text == query:
+			return 0
+		if pos == 0:
+			return 1
+		if not text[pos - 1].isalnum():
+			return 2
+		return 3 + pos / (len(text) + 1)